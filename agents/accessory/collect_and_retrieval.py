@@ -1,4 +1,3 @@
-from datetime import datetime
 import json
 from typing import Any, Callable, Literal, Optional
 
@@ -6,7 +5,7 @@ from openai import NOT_GIVEN, InternalServerError, NotGiven
 from overrides import override
 from models.accessory import AccessoryModel
 from models.user_memory import UserIntent, UserMemoryModel
-from repositories.redis import get_value
+from repositories.accessory import get_accessory
 from service.openai import _client, _chat_model, OpenAIChatCompletionsRequest
 from openai.types.chat import (
     ChatCompletionMessageParam,
@@ -18,13 +17,21 @@ from pydantic import BaseModel
 from tools.base import ToolBase, ToolResponse
 from openai.types.chat_model import ChatModel
 from agents.base import (
+    current_date,
     Agent as AgentBase,
     SystemPromptConfig as SystemPromptConfigBase,
     AgentTemporaryMemory as AgentTemporaryMemoryBase,
     AgentResponseBase,
     Instruction,
 )
-from service.accessory import Config, search, AccessoryFilter
+from service.accessory import Config, search, search_candidates, AccessoryFilter
+from service.candidates import from_cursor
+from service.page_cursor import PageCursor, load as load_page_cursor
+from service.suggestions import (
+    Suggestion,
+    load as load_suggestions,
+    find_by_name as find_suggestion_by_name,
+)
 from agents.config import BRAND_DEFAULT
 from repositories.user_memory import update as update_user_memory
 from models.user_memory import UpdateUserMemoryModel
@@ -45,9 +52,7 @@ class SystemPromptConfig(SystemPromptConfigBase):
         "Carefully read and accurately understand the user's requirements in the conversation.",
         "Collect and update a diverse array of information simultaneously with precision and thoroughness.",
     ]
-    base_knowledge: list[str] = [
-        f"Current date: {datetime.now().strftime('%A, %B %d, %Y')} ({datetime.now().strftime('%Y-%m-%d')})",
-    ]
+    base_knowledge: list[str] = []
     rules: list[str] = [
         "Your primary responsibility is to diligently collect, verify, and analyze all relevant information. Please ensure your full attention is dedicated exclusively to this task.",
         "You must collect and update the user's requirements by calling appropriate functions concurrently, ensuring that all parameters are correctly assigned.",
@@ -74,8 +79,13 @@ class SystemPromptConfig(SystemPromptConfigBase):
     def skills_to_string(self) -> str:
         return "\n".join([f"- {skill}" for skill in self.skills])
 
-    def base_knowledge_to_string(self) -> str:
-        return "\n".join([f"- {knowledge}" for knowledge in self.base_knowledge])
+    def base_knowledge_to_string(self, include_turn_knowledge: bool = True) -> str:
+        base_knowledge = (
+            [*self.base_knowledge, current_date()]
+            if include_turn_knowledge
+            else self.base_knowledge
+        )
+        return "\n".join([f"- {knowledge}" for knowledge in base_knowledge])
 
     def rules_to_string(self) -> str:
         return "\n".join([f"- {rule}" for rule in self.rules])
@@ -128,6 +138,30 @@ class SystemPromptConfig(SystemPromptConfigBase):
             "content": f"This is the latest user's message: {(latest_user_message or {}).get('content', 'No content available')}",
         }
 
+        if self.is_cache_friendly_layout():
+            static_base_knowledge_message: ChatCompletionMessageParam | None = (
+                {
+                    "role": "system",
+                    "content": f"""## BASE KNOWLEDGE:\n{self.base_knowledge_to_string(include_turn_knowledge=False)}""",
+                }
+                if self.base_knowledge
+                else None
+            )
+            return self.arrange_messages(
+                [
+                    role_task_skill_message,
+                    static_base_knowledge_message,
+                    rules_message,
+                    workflow_message,
+                    initialization_message,
+                ],
+                conversation_messages,
+                [
+                    self.current_date_message(),
+                    latest_user_message_description,
+                ],
+            )
+
         messages = [
             role_task_skill_message,
             base_knowledge_message,
@@ -142,7 +176,9 @@ class SystemPromptConfig(SystemPromptConfigBase):
 
 
 class AgentTemporaryMemory(AgentTemporaryMemoryBase):
-    offset: int = 0
+    cursor: PageCursor = PageCursor()
+    # Last suggestion list shown in the thread, replaced when a new list is shown.
+    suggestions: list[Suggestion] = []
 
 
 class AgentResponse(AgentResponseBase):
@@ -226,8 +262,7 @@ class Agent(AgentBase):
             )
             return agent_response
 
-        offset = get_value(f"offset:{user_memory.thread_id}")
-        offset = int(offset) if offset else 0
+        cursor = load_page_cursor(user_memory.thread_id)
 
         if not user_memory.intent:
             user_memory.intent = UserIntent()
@@ -235,10 +270,11 @@ class Agent(AgentBase):
         if user_memory.intent.is_user_needs_other_suggestions:
             user_memory.product_name = None
             user_memory.current_filter.product_name = None
-            offset += self.limit
+            cursor = cursor.next_page()
             user_memory.intent.is_user_needs_other_suggestions = False
 
-        self.temporary_memory.offset = offset
+        self.temporary_memory.cursor = cursor
+        self.temporary_memory.suggestions = load_suggestions(user_memory.thread_id)
 
         if user_memory.product_name:
             agent_response = self._consult_specific_accessory()
@@ -250,13 +286,17 @@ class Agent(AgentBase):
     def _consult_accessories(self) -> AgentResponse:
         print("\n\nSearching accessories...\n\n")
         user_memory: UserMemoryModel = self.temporary_memory.user_memory
-        offset = self.temporary_memory.offset
-        accessories = []
-        config = Config(limit=self.limit)
-        config.offset = offset
-        filter = self._get_accessory_filter_from_user_memory(config=config)
-        if not user_memory.consultation_status.is_recommending:
-            accessories = self.retrieval(filter=filter)
+        config = Config(
+            limit=self.limit,
+            is_recommending=user_memory.consultation_status.is_recommending,
+        )
+        filter = from_cursor(
+            self._get_accessory_filter_from_user_memory(config=config),
+            self.temporary_memory.cursor,
+        )
+        candidates = search_candidates(filter)
+        self.temporary_memory.cursor = candidates.cursor
+        accessories = candidates.page
 
         if len(accessories) > 0:
             user_memory.consultation_status.is_recommending = False
@@ -274,17 +314,7 @@ class Agent(AgentBase):
                 else self._specific_accessory_to_response(accessories[0])
             )
 
-        if offset > 0 and not user_memory.consultation_status.is_recommending:
-            config.offset -= self.limit
-            filter.config = config
-            accessories = self.retrieval(filter=filter)
-            len_previous_page = len(accessories)
-            config.offset += len_previous_page
-            filter.config = config
-            self.temporary_memory.offset = config.offset
-
-        config.is_recommending = True
-        accessories = self.retrieval(filter=filter)
+        accessories = candidates.recommendations
         if len(accessories) > 0:
             user_memory.consultation_status.is_recommending = True
             user_memory.product_name = (
@@ -297,7 +327,7 @@ class Agent(AgentBase):
             )
             return self._accessories_to_response(accessories)
 
-        self.temporary_memory.offset = 0
+        self.temporary_memory.cursor = PageCursor()
         user_memory.consultation_status.is_recommending = False
         instructions = [
             Instruction(
@@ -327,6 +357,20 @@ class Agent(AgentBase):
         print("\n\nSearching specific accessory...\n\n")
         user_memory: UserMemoryModel = self.temporary_memory.user_memory
 
+        # An accessory picked from the last suggestions this turn is fetched by id,
+        # one consulted on an earlier turn is searched again with the new requirements.
+        suggestion = (
+            find_suggestion_by_name(
+                self.temporary_memory.suggestions, user_memory.product_name
+            )
+            if user_memory.product_name != user_memory.current_filter.product_name
+            else None
+        )
+        accessory = get_accessory(suggestion.id) if suggestion else None
+        if accessory:
+            user_memory.current_filter.product_name = accessory.name
+            return self._specific_accessory_to_response(accessory)
+
         config = Config(limit=1)
         filter = self._get_accessory_filter_from_user_memory(config=config)
         accessories = self.retrieval(
@@ -385,6 +429,7 @@ class Agent(AgentBase):
                 ),
                 temperature=0,
                 timeout=60,
+                agent="accessory_collect_and_retrieval",
             )
         if not before_tool_response:
             return OpenAIChatCompletionsRequest(
@@ -393,6 +438,7 @@ class Agent(AgentBase):
                 tools=before_request.tools,
                 temperature=before_request.temperature,
                 timeout=before_request.timeout,
+                agent=before_request.agent,
             )
 
         if before_tool_response.type == "message":
@@ -402,6 +448,7 @@ class Agent(AgentBase):
                 tools=NOT_GIVEN,
                 temperature=0,
                 timeout=60,
+                agent="accessory_collect_and_retrieval",
             )
 
         raise NotImplementedError()
@@ -483,6 +530,10 @@ class Agent(AgentBase):
         self, accessories: list[AccessoryModel]
     ) -> AgentResponse:
         user_memory: UserMemoryModel = self.temporary_memory.user_memory
+        self.temporary_memory.suggestions = [
+            Suggestion(id=accessory.id, name=accessory.name)
+            for accessory in accessories
+        ]
         knowledge = [
             accessory.to_text(include_key_selling_points=True)
             for accessory in accessories
@@ -1,4 +1,3 @@
-from datetime import datetime
 from typing import Literal, Optional
 from overrides import override
 from pydantic import BaseModel, Field
@@ -12,6 +11,7 @@ from models.faq import FAQModel
 from service.openai import OpenAIChatCompletionsRequest, _client, _chat_model
 from openai.types.chat_model import ChatModel
 from agents.base import (
+    current_date,
     Agent as AgentBase,
     Instruction,
     SystemPromptConfig as SystemPromptConfigBase,
@@ -43,8 +43,9 @@ class SystemPromptConfig(SystemPromptConfigBase):
             "   - Website: [FPTShop](https://fptshop.com.vn)\n"
             "   - Customer service email: cskh@fptshop.com\n"
         ),
-        f"Current date: {datetime.now().strftime('%A, %B %d, %Y')} ({datetime.now().strftime('%Y-%m-%d')})",
     ]
+    # Retrieved for the current turn, kept apart from the static base knowledge.
+    faq_knowledge: list[str] = []
     rules: list[str] = [
         "Don't talk nonsense and make up facts.",
         "Use only the Vietnamese language in your responses.",
@@ -69,8 +70,13 @@ class SystemPromptConfig(SystemPromptConfigBase):
     def skills_to_string(self) -> str:
         return "\n".join([f"- {skill}" for skill in self.skills])
 
-    def base_knowledge_to_string(self) -> str:
-        return "\n".join([f"- {knowledge}" for knowledge in self.base_knowledge])
+    def base_knowledge_to_string(self, include_turn_knowledge: bool = True) -> str:
+        base_knowledge = (
+            [*self.base_knowledge, current_date(), *self.faq_knowledge]
+            if include_turn_knowledge
+            else self.base_knowledge
+        )
+        return "\n".join([f"- {knowledge}" for knowledge in base_knowledge])
 
     def rules_to_string(self) -> str:
         return "\n".join([f"- {rule}" for rule in self.rules])
@@ -177,6 +183,43 @@ class SystemPromptConfig(SystemPromptConfigBase):
             "content": f"This is the latest user's message: {(latest_user_message or {}).get('content', 'No content available')}",
         }
 
+        if self.is_cache_friendly_layout():
+            static_base_knowledge_message: ChatCompletionMessageParam | None = (
+                {
+                    "role": "system",
+                    "content": f"""## BASE KNOWLEDGE:\n{self.base_knowledge_to_string(include_turn_knowledge=False)}""",
+                }
+                if self.base_knowledge
+                else None
+            )
+            faq_knowledge_message: ChatCompletionMessageParam | None = (
+                {
+                    "role": "system",
+                    "content": "\n".join(
+                        [f"- {knowledge}" for knowledge in self.faq_knowledge]
+                    ),
+                }
+                if self.faq_knowledge
+                else None
+            )
+            return self.arrange_messages(
+                [
+                    role_task_skill_message,
+                    static_base_knowledge_message,
+                    rules_message,
+                    workflow_message,
+                    initialization_message,
+                ],
+                conversation_messages,
+                [
+                    self.current_date_message(),
+                    faq_knowledge_message,
+                    accessory_knowledge_message,
+                    instructions_message,
+                    latest_user_message_description,
+                ],
+            )
+
         messages = [
             role_task_skill_message,
             base_knowledge_message,
@@ -244,7 +287,7 @@ class Agent(AgentBase):
         faqs = self.retrieval_faq(str(latest_user_message["content"]))
 
         if faqs:
-            self.system_prompt_config.base_knowledge.append(
+            self.system_prompt_config.faq_knowledge.append(
                 f"Some frequently asked questions (FAQs) in the store:\n"
                 + (
                     "\n".join(
@@ -290,6 +333,7 @@ class Agent(AgentBase):
             model=self.model,
             temperature=0,
             timeout=60,
+            agent="accessory_generate_response",
         )
 
     def retrieval_faq(self, question: str) -> list[FAQModel]:
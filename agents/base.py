@@ -1,5 +1,7 @@
+from datetime import datetime
 from typing import Any, Literal, Optional
 
+from env import env
 from models.user_memory import UserMemoryModel
 from service.openai import _chat_model
 from openai.types.chat import ChatCompletionMessageParam
@@ -12,6 +14,11 @@ class Instruction(BaseModel):
     examples: list[str] = []
 
 
+def current_date() -> str:
+    now = datetime.now()
+    return f"Current date: {now.strftime('%A, %B %d, %Y')} ({now.strftime('%Y-%m-%d')})"
+
+
 class SystemPromptConfig(BaseModel):
     pass
 
@@ -23,6 +30,26 @@ class SystemPromptConfig(BaseModel):
             "get_openai_messages method must be implemented in subclasses"
         )
 
+    def is_cache_friendly_layout(self) -> bool:
+        return env.PROMPT_LAYOUT == "cache_friendly"
+
+    def current_date_message(self) -> ChatCompletionMessageParam:
+        return {"role": "system", "content": current_date()}
+
+    def arrange_messages(
+        self,
+        static_messages: list[ChatCompletionMessageParam | None],
+        conversation_messages: list[ChatCompletionMessageParam],
+        volatile_messages: list[ChatCompletionMessageParam | None],
+    ) -> list[ChatCompletionMessageParam]:
+        """
+        Static blocks first so that every call of an agent starts with the same bytes and
+        OpenAI's prompt caching can reuse them, then the append-only conversation, then
+        what changes every turn.
+        """
+        messages = [*static_messages, *conversation_messages, *volatile_messages]
+        return [message for message in messages if message is not None]
+
 
 class AgentResponseBase(BaseModel):
     type: Literal["finished", "navigate", "error", "message"]
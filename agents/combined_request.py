@@ -0,0 +1,283 @@
+import json
+from typing import Any, Optional
+from overrides import override
+from pydantic import ValidationError
+from openai.types.chat import ChatCompletionMessageParam
+from openai.types.chat_model import ChatModel
+from agents.base import (
+    Agent as AgentBase,
+    SystemPromptConfig as SystemPromptConfigBase,
+    AgentTemporaryMemory,
+    AgentResponseBase,
+)
+from agents.detect_demand import UserRequest, UserContactInfo
+from models.user_memory import ProductType
+from service.openai import OpenAIChatCompletionsRequest, _chat_model
+from tools.base import ToolBase
+from tools.phone.brand import Tool as PhoneBrandTool
+from tools.phone.price import Tool as PhonePriceTool
+from tools.phone.user_intent import Tool as PhoneUserIntentTool
+from tools.phone.name import Tool as PhoneNameTool
+from tools.phone.configuration import Tool as PhoneConfigurationTool
+from tools.laptop.price import Tool as LaptopPriceTool
+from tools.laptop.user_intent import Tool as LaptopUserIntentTool
+from tools.laptop.name import Tool as LaptopNameTool
+from tools.laptop.configuration import Tool as LaptopConfigurationTool
+
+# Property of the response that holds the requirements of each product type.
+REQUIREMENTS_KEYS = {
+    ProductType.MOBILE_PHONE: "phone_requirements",
+    ProductType.LAPTOP: "laptop_requirements",
+}
+
+
+class SystemPromptConfig(SystemPromptConfigBase):
+    role: str = "Agent analyzes the information in the user request."
+    task: str = (
+        "Your task is to analyze the user's request, determine the user demand, collect the user's contact information and collect the user's requirements about the product they are interested in."
+    )
+    skills: list[str] = [
+        "Understanding natural language, especially in conversations involving special situations such as abbreviations and slang.",
+        "Carefully read and accurately understand the context in the conversation.",
+        "Collect and update a diverse array of information simultaneously with precision and thoroughness.",
+    ]
+    rules: list[str] = [
+        "Just update the user's contact information if the user provides it.",
+        "Do not make any assumptions about the user's contact information.",
+        "Only fill the requirements of the product type in the user demand, set the other product types to null.",
+        "Set a requirement to null when the user's latest message does not mention it, each requirement follows the role and rules in its description.",
+        "When a user refers to a service or product without including any price details, do not collect or update the price information.",
+        "If a user asks about the price of a service or product but does not specify a particular price value, there is no need to collect or update any price information.",
+    ]
+    working_steps: list[str] = [
+        (
+            "**Step 1:** Read the user's latest message carefully (self-processing without providing any response).\n"
+            "   - Understand the acronyms, slang, and abbreviations used in the message if any.\n"
+            "   - Identify the current user demand, the user's contact information (if user provides) and the user's requirements about the product.\n"
+        ),
+        (
+            "**Step 2:** Based on Step 1, answer with the user demand, the contact information and the requirements of the demanded product type."
+        ),
+    ]
+    initialization: str = (
+        "As a/an <ROLE>, you are required to adhere to the <WORKFLOW> and follow the <RULES> strictly, using your expertise in <SKILLS> to do your task effectively."
+    )
+
+    def skills_to_string(self) -> str:
+        return "\n".join([f"- {skill}" for skill in self.skills])
+
+    def rules_to_string(self) -> str:
+        return "\n".join([f"- {rule}" for rule in self.rules])
+
+    def working_steps_to_string(self) -> str:
+        return "\n".join([f"{step}" for step in self.working_steps])
+
+    @override
+    def get_openai_messages(
+        self,
+        conversation_messages: list[ChatCompletionMessageParam],
+    ) -> list[ChatCompletionMessageParam]:
+
+        role_task_skill_message: ChatCompletionMessageParam = {
+            "role": "system",
+            "content": f"""# ROLE
+{self.role}
+
+## PROFILE:
+- Languages: Vietnamese and English.
+- Description: {self.task}
+
+## SKILLS:
+{self.skills_to_string()}""",
+        }
+        rules_message: ChatCompletionMessageParam = {
+            "role": "system",
+            "content": f"""## RULES:\n{self.rules_to_string()}""",
+        }
+        workflow_message: ChatCompletionMessageParam = {
+            "role": "system",
+            "content": f"""## WORKFLOW:\n{self.working_steps_to_string()}""",
+        }
+        initialization_message: ChatCompletionMessageParam = {
+            "role": "system",
+            "content": f"""## INITIALIZATION:\n{self.initialization}""",
+        }
+
+        latest_user_message = next(
+            (msg for msg in conversation_messages[-1::-1] if msg["role"] == "user"),
+            None,
+        )
+
+        latest_user_message_description: ChatCompletionMessageParam = {
+            "role": "system",
+            "content": f"This is the latest user's message: {(latest_user_message or {}).get('content', 'No content available')}",
+        }
+
+        if self.is_cache_friendly_layout():
+            return self.arrange_messages(
+                [
+                    role_task_skill_message,
+                    rules_message,
+                    workflow_message,
+                    initialization_message,
+                ],
+                conversation_messages,
+                [
+                    self.current_date_message(),
+                    latest_user_message_description,
+                ],
+            )
+
+        return [
+            role_task_skill_message,
+            *conversation_messages,
+            self.current_date_message(),
+            latest_user_message_description,
+            rules_message,
+            workflow_message,
+            initialization_message,
+        ]
+
+
+class AgentResponse(AgentResponseBase):
+    user_request: Optional[UserRequest] = None
+    # Tool name -> tool arguments of the demanded product type.
+    slots: dict[str, dict[str, Any]] = {}
+
+
+def _prune(value: Any) -> Any:
+    if isinstance(value, dict):
+        pruned = {key: _prune(item) for key, item in value.items()}
+        return {key: item for key, item in pruned.items() if item is not None} or None
+    return value
+
+
+class Agent(AgentBase):
+    """
+    Detects the demand, the contact information and the product requirements in one
+    structured request. The requirements are returned as the arguments of the
+    collect_and_retrieval tools, so the tools' `invoke` apply them as if the model had
+    called them.
+    """
+
+    def __init__(
+        self,
+        tools: dict[ProductType, list[ToolBase]] = {
+            ProductType.MOBILE_PHONE: [
+                PhoneUserIntentTool(),
+                PhoneNameTool(),
+                PhoneBrandTool(),
+                PhonePriceTool(),
+                PhoneConfigurationTool(),
+            ],
+            ProductType.LAPTOP: [
+                LaptopUserIntentTool(),
+                LaptopNameTool(),
+                LaptopConfigurationTool(),
+                LaptopPriceTool(),
+            ],
+        },
+        system_prompt_config: SystemPromptConfig = SystemPromptConfig(),
+        model: ChatModel = _chat_model,
+        temporary_memory: AgentTemporaryMemory = AgentTemporaryMemory(),
+    ):
+        self.tools = tools
+        self.system_prompt_config = system_prompt_config
+        self.model = model
+        self.temporary_memory = temporary_memory
+
+    def run(
+        self, messages: list[ChatCompletionMessageParam], *args, **kwargs
+    ) -> AgentResponse:
+        self.temporary_memory.chat_completions_messages = (
+            self.system_prompt_config.get_openai_messages(messages)
+        )
+        response = self._get_openai_request().create()
+        return self._to_agent_response(response.choices[0].message.content)
+
+    async def arun(
+        self, messages: list[ChatCompletionMessageParam], *args, **kwargs
+    ) -> AgentResponse:
+        self.temporary_memory.chat_completions_messages = (
+            self.system_prompt_config.get_openai_messages(messages)
+        )
+        response = await self._get_openai_request().acreate()
+        return self._to_agent_response(response.choices[0].message.content)
+
+    def _get_response_schema(self) -> dict[str, Any]:
+        user_demand = UserRequest.model_fields["user_demand"]
+        properties: dict[str, Any] = {
+            "user_demand": {
+                "type": "string",
+                "enum": [
+                    ProductType.MOBILE_PHONE.value,
+                    ProductType.LAPTOP.value,
+                    ProductType.UNDETERMINED.value,
+                ],
+                "description": user_demand.description,
+            },
+            "user_info": UserContactInfo.model_json_schema(),
+        }
+        for product_type, tools in self.tools.items():
+            properties[REQUIREMENTS_KEYS[product_type]] = {
+                "type": ["object", "null"],
+                "description": f"The user's requirements when the user demand is '{product_type.value}'.",
+                "properties": {
+                    tool.name: {
+                        "anyOf": [
+                            tool.tool_schema["function"]["parameters"],
+                            {"type": "null"},
+                        ],
+                        "description": tool.description,
+                    }
+                    for tool in tools
+                },
+            }
+        return {
+            "type": "object",
+            "properties": properties,
+            "required": ["user_demand", "user_info"],
+        }
+
+    def _get_openai_request(self) -> OpenAIChatCompletionsRequest:
+        # Not strict: the tool parameters carry examples and optional properties that
+        # strict structured outputs don't accept.
+        return OpenAIChatCompletionsRequest(
+            messages=self.temporary_memory.chat_completions_messages,
+            model=self.model,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "user_request",
+                    "schema": self._get_response_schema(),
+                    "strict": False,
+                },
+            },
+            temperature=0,
+            timeout=60,
+            agent="combined_request",
+        )
+
+    def _to_agent_response(self, content: str | None) -> AgentResponse:
+        try:
+            data = json.loads(content or "")
+            user_request = UserRequest.model_validate(data)
+        except (json.JSONDecodeError, ValidationError) as e:
+            print("Invalid combined request response:", e)
+            return AgentResponse(type="error", content="Invalid response format.")
+
+        print("Combined request:", data)
+        slots: dict[str, dict[str, Any]] = {}
+        if user_request.user_demand in REQUIREMENTS_KEYS:
+            key = REQUIREMENTS_KEYS[user_request.user_demand]
+            tool_names = {tool.name for tool in self.tools[user_request.user_demand]}
+            # Tools without any collected argument are left out, the same way the model
+            # would not call them.
+            requirements = _prune(data.get(key)) or {}
+            slots = {
+                name: arguments
+                for name, arguments in requirements.items()
+                if name in tool_names and isinstance(arguments, dict)
+            }
+
+        return AgentResponse(type="finished", user_request=user_request, slots=slots)
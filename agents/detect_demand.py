@@ -1,3 +1,4 @@
+import asyncio
 from typing import Literal, Optional
 from overrides import override
 from pydantic import BaseModel, Field
@@ -9,15 +10,19 @@ from openai.types.chat import (
 )
 from rq import Queue
 import weave
-from agents.utils import generate_response_by_instructions
+from agents.utils import (
+    generate_response_by_instructions,
+    agenerate_response_by_instructions,
+)
 from env import env
-from db import redis
+from db import queue_redis
 from models.user import UserModel
 from service.converter import (
     convert_to_standard_email,
     convert_to_standard_phone_number,
 )
 from service.email import create_message, send_message
+import service.demand_classifier as demand_classifier
 from service.openai import OpenAIChatCompletionsParse, _client, _chat_model
 from openai.types.chat_model import ChatModel
 from agents.base import (
@@ -139,6 +144,20 @@ class SystemPromptConfig(SystemPromptConfigBase):
             "content": f"This is the latest user's message: {(latest_user_message or {}).get('content', 'No content available')}",
         }
 
+        if self.is_cache_friendly_layout():
+            return self.arrange_messages(
+                [
+                    role_task_skill_message,
+                    rules_message,
+                    workflow_message,
+                    initialization_message,
+                ],
+                conversation_messages,
+                [
+                    latest_user_message_description,
+                ],
+            )
+
         messages = [
             role_task_skill_message,
             *conversation_messages,
@@ -182,19 +201,123 @@ class Agent(AgentBase):
                 content="User memory not found.",
             )
 
+        user_request = self.classify_locally(messages)
+        if user_request is None:
+            user_request = self.parse_user_request(messages)
+
+        return self._process_user_request(user_request)
+
+    async def arun(
+        self, messages: list[ChatCompletionMessageParam], *args, **kwargs
+    ) -> AgentResponse:
+        if not self.temporary_memory.user_memory:
+            return AgentResponse(
+                type="error",
+                content="User memory not found.",
+            )
+
+        # Both load files or enqueue through Redis synchronously, off the event loop.
+        user_request = await asyncio.to_thread(self.classify_locally, messages)
+        if user_request is None:
+            user_request = await self.aparse_user_request(messages)
+
+        return await asyncio.to_thread(self._process_user_request, user_request)
+
+    def parse_user_request(
+        self, messages: list[ChatCompletionMessageParam]
+    ) -> UserRequest | None:
+        """
+        Asks the LLM for the user's demand and contact information, without touching the
+        user memory.
+        """
         self.temporary_memory.chat_completions_messages = (
             self.system_prompt_config.get_openai_messages(messages)
         )
 
-        response = OpenAIChatCompletionsParse(
+        response = self._get_openai_request().parse()
+        return response.choices[0].message.parsed
+
+    async def aparse_user_request(
+        self, messages: list[ChatCompletionMessageParam]
+    ) -> UserRequest | None:
+        self.temporary_memory.chat_completions_messages = (
+            self.system_prompt_config.get_openai_messages(messages)
+        )
+
+        response = await self._get_openai_request().aparse()
+        return response.choices[0].message.parsed
+
+    def classify_locally(
+        self, messages: list[ChatCompletionMessageParam]
+    ) -> UserRequest | None:
+        """
+        Local classifier path, None when it is disabled, has no model, or is not confident
+        enough about the latest user message.
+        """
+        if not env.DEMAND_CLASSIFIER_ENABLED:
+            return None
+
+        latest_user_message = next(
+            (msg for msg in reversed(messages) if msg["role"] == "user"), None
+        )
+        content = (latest_user_message or {}).get("content")
+        if not content or not isinstance(content, str):
+            return None
+
+        contact_info = demand_classifier.extract_contact_info(content)
+        user_memory = self.temporary_memory.user_memory
+        previous_product_type = (
+            user_memory.intent.product_type
+            if user_memory and user_memory.intent
+            else None
+        )
+        prediction = demand_classifier.classify(content, previous_product_type)
+        if contact_info is None or prediction is None:
+            return None
+
+        user_demand, probability = prediction
+        if probability < env.DEMAND_CLASSIFIER_THRESHOLD:
+            return None
+
+        phone_number, email = contact_info
+        return UserRequest(
+            user_demand=user_demand,  # type: ignore
+            user_info=UserContactInfo(phone_number=phone_number, email=email),
+        )
+
+    def run_with_request(self, user_request: UserRequest) -> AgentResponse:
+        """
+        Processes a `UserRequest` already extracted by the combined request.
+        """
+        if not self.temporary_memory.user_memory:
+            return AgentResponse(
+                type="error",
+                content="User memory not found.",
+            )
+
+        return self._process_user_request(user_request)
+
+    async def arun_with_request(self, user_request: UserRequest) -> AgentResponse:
+        if not self.temporary_memory.user_memory:
+            return AgentResponse(
+                type="error",
+                content="User memory not found.",
+            )
+
+        return await asyncio.to_thread(self._process_user_request, user_request)
+
+    def _get_openai_request(self) -> OpenAIChatCompletionsParse:
+        return OpenAIChatCompletionsParse(
             model=self.model,
             messages=self.temporary_memory.chat_completions_messages,
             temperature=0,
             timeout=60,
             response_format=UserRequest,
-        ).parse()
+            agent="detect_demand",
+        )
 
-        user_request = response.choices[0].message.parsed
+    def _process_user_request(self, user_request: UserRequest | None) -> AgentResponse:
+        user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
 
         if not user_request:
             return AgentResponse(
@@ -281,7 +404,8 @@ class Agent(AgentBase):
                 f"<p><strong>Link tham chiếu:</strong> <a href='{env.CHAINLIT_HOST}/thread/{user_memory.thread_id}'>Xem cuộc trò chuyện</a></p>"
             ),
         )
-        queue = Queue(connection=redis)
+        # RQ pickles its jobs, the decoding client would fail to read them back.
+        queue = Queue(connection=queue_redis)
         queue.enqueue(send_message, email)
 
     @weave.op(name="detect_demand_agent.post_process")
@@ -291,35 +415,32 @@ class Agent(AgentBase):
         model: str = _chat_model,
     ) -> AgentResponse:
         if response.type == "message":
-            knowledge = []
-            if (
-                self.temporary_memory.user
-                and self.temporary_memory.user.gender
-                and self.temporary_memory.use_fine_tune_tone
-            ):
-                knowledge = [f"User gender: {self.temporary_memory.user.gender}"]
-            elif self.temporary_memory.use_fine_tune_tone:
-                knowledge = ["User gender: unknown"]
-            user_contact_info = (
-                f"   - Phone number: {self.temporary_memory.user_memory.phone_number}\n"
-                if self.temporary_memory.user_memory
-                and self.temporary_memory.user_memory.phone_number
-                else ""
-            ) + (
-                f"   - Email: {self.temporary_memory.user_memory.email}\n"
-                if self.temporary_memory.user_memory
-                and self.temporary_memory.user_memory.email
-                else ""
+            finished_response = generate_response_by_instructions(
+                instructions=response.instructions,
+                knowledge=self._get_post_process_knowledge(),
+                conversation_history=[],
+                model=model,
+                use_fine_tune_tone=self.temporary_memory.use_fine_tune_tone,
             )
 
-            if user_contact_info:
-                knowledge.append(
-                    f"- The user's contact information:\n{user_contact_info}"
-                )
+            return AgentResponse(
+                type="message",
+                content=finished_response,
+                instructions=response.instructions,
+            )
 
-            finished_response = generate_response_by_instructions(
+        return response
+
+    @weave.op(name="detect_demand_agent.apost_process")
+    async def apost_process(
+        self,
+        response: AgentResponse,
+        model: str = _chat_model,
+    ) -> AgentResponse:
+        if response.type == "message":
+            finished_response = await agenerate_response_by_instructions(
                 instructions=response.instructions,
-                knowledge=knowledge,
+                knowledge=self._get_post_process_knowledge(),
                 conversation_history=[],
                 model=model,
                 use_fine_tune_tone=self.temporary_memory.use_fine_tune_tone,
@@ -332,3 +453,30 @@ class Agent(AgentBase):
             )
 
         return response
+
+    def _get_post_process_knowledge(self) -> list[str]:
+        knowledge = []
+        if (
+            self.temporary_memory.user
+            and self.temporary_memory.user.gender
+            and self.temporary_memory.use_fine_tune_tone
+        ):
+            knowledge = [f"User gender: {self.temporary_memory.user.gender}"]
+        elif self.temporary_memory.use_fine_tune_tone:
+            knowledge = ["User gender: unknown"]
+        user_contact_info = (
+            f"   - Phone number: {self.temporary_memory.user_memory.phone_number}\n"
+            if self.temporary_memory.user_memory
+            and self.temporary_memory.user_memory.phone_number
+            else ""
+        ) + (
+            f"   - Email: {self.temporary_memory.user_memory.email}\n"
+            if self.temporary_memory.user_memory
+            and self.temporary_memory.user_memory.email
+            else ""
+        )
+
+        if user_contact_info:
+            knowledge.append(f"- The user's contact information:\n{user_contact_info}")
+
+        return knowledge
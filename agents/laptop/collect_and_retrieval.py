@@ -1,4 +1,3 @@
-from datetime import datetime
 import json
 from typing import Any, Callable, Literal, Optional
 
@@ -7,9 +6,10 @@ from overrides import override
 from models.laptop import LaptopModel
 from models.user import UserModel
 from models.user_memory import UserIntent, UserMemoryModel
-from repositories.redis import get_value
+from repositories.laptop import get_laptop, aget_laptop
 from service.openai import _client, _chat_model, OpenAIChatCompletionsRequest
 from openai.types.chat import (
+    ChatCompletionMessage,
     ChatCompletionMessageParam,
     ChatCompletionToolParam,
     ChatCompletionMessageToolCall,
@@ -19,13 +19,29 @@ from pydantic import BaseModel
 from tools.base import ToolBase, ToolResponse
 from openai.types.chat_model import ChatModel
 from agents.base import (
+    current_date,
     Agent as AgentBase,
     SystemPromptConfig as SystemPromptConfigBase,
     AgentTemporaryMemory as AgentTemporaryMemoryBase,
     AgentResponseBase,
     Instruction,
 )
-from service.laptop import Config, search, LaptopFilter
+from service.laptop import (
+    Config,
+    search,
+    asearch,
+    search_candidates,
+    asearch_candidates,
+    LaptopFilter,
+)
+from service.candidates import Candidates, from_cursor
+from service.page_cursor import PageCursor
+from service.suggestions import (
+    Suggestion,
+    load as load_suggestions,
+    aload as aload_suggestions,
+    find_by_name as find_suggestion_by_name,
+)
 from agents.config import BRAND_DEFAULT
 from repositories.user_memory import update as update_user_memory
 from models.user_memory import UpdateUserMemoryModel
@@ -48,9 +64,7 @@ class SystemPromptConfig(SystemPromptConfigBase):
         "Carefully read and accurately understand the user's requirements in the conversation.",
         "Collect and update a diverse array of information simultaneously with precision and thoroughness.",
     ]
-    base_knowledge: list[str] = [
-        f"Current date: {datetime.now().strftime('%A, %B %d, %Y')} ({datetime.now().strftime('%Y-%m-%d')})",
-    ]
+    base_knowledge: list[str] = []
     rules: list[str] = [
         "Your primary responsibility is to diligently collect, verify, and analyze all relevant information. Please ensure your full attention is dedicated exclusively to this task.",
         "You must collect and update the user's requirements by calling appropriate functions concurrently, ensuring that all parameters are correctly assigned.",
@@ -77,8 +91,13 @@ class SystemPromptConfig(SystemPromptConfigBase):
     def skills_to_string(self) -> str:
         return "\n".join([f"- {skill}" for skill in self.skills])
 
-    def base_knowledge_to_string(self) -> str:
-        return "\n".join([f"- {knowledge}" for knowledge in self.base_knowledge])
+    def base_knowledge_to_string(self, include_turn_knowledge: bool = True) -> str:
+        base_knowledge = (
+            [*self.base_knowledge, current_date()]
+            if include_turn_knowledge
+            else self.base_knowledge
+        )
+        return "\n".join([f"- {knowledge}" for knowledge in base_knowledge])
 
     def rules_to_string(self) -> str:
         return "\n".join([f"- {rule}" for rule in self.rules])
@@ -131,6 +150,30 @@ class SystemPromptConfig(SystemPromptConfigBase):
             "content": f"This is the latest user's message: {(latest_user_message or {}).get('content', 'No content available')}",
         }
 
+        if self.is_cache_friendly_layout():
+            static_base_knowledge_message: ChatCompletionMessageParam | None = (
+                {
+                    "role": "system",
+                    "content": f"""## BASE KNOWLEDGE:\n{self.base_knowledge_to_string(include_turn_knowledge=False)}""",
+                }
+                if self.base_knowledge
+                else None
+            )
+            return self.arrange_messages(
+                [
+                    role_task_skill_message,
+                    static_base_knowledge_message,
+                    rules_message,
+                    workflow_message,
+                    initialization_message,
+                ],
+                conversation_messages,
+                [
+                    self.current_date_message(),
+                    latest_user_message_description,
+                ],
+            )
+
         messages = [
             role_task_skill_message,
             base_knowledge_message,
@@ -145,8 +188,10 @@ class SystemPromptConfig(SystemPromptConfigBase):
 
 
 class AgentTemporaryMemory(AgentTemporaryMemoryBase):
-    offset: int = 0
+    cursor: PageCursor = PageCursor()
     user: Optional[UserModel] = None
+    # Last suggestion list shown in the thread, replaced when a new list is shown.
+    suggestions: list[Suggestion] = []
 
 
 class AgentResponse(AgentResponseBase):
@@ -186,8 +231,6 @@ class Agent(AgentBase):
         self.temporary_memory.chat_completions_messages = (
             self.system_prompt_config.get_openai_messages(messages)
         )
-
-        agent_response = None
         openai_request = self._get_openai_request()
         try:
             response = openai_request.create().choices[0].message
@@ -197,26 +240,137 @@ class Agent(AgentBase):
                 type="error",
                 content="Internal server error.",
             )
+        tool_responses = (
+            self._invoke_tools(response.tool_calls) if response.tool_calls else []
+        )
+        agent_response = self._to_agent_response(response, tool_responses)
+        return self._consult(agent_response)
+
+    def run_with_slots(self, slots: dict[str, dict[str, Any]]) -> AgentResponse:
+        """
+        Applies slots already extracted by the combined request or the slot extractor
+        (tool name -> tool arguments) with the tools' `invoke`, instead of asking the
+        model for tool calls.
+        """
+        if self.temporary_memory.user_memory is None:
+            return AgentResponse(
+                type="error",
+                content="User memory is not available.",
+            )
+
+        tool_responses = [
+            self._select_slot_tool(name).invoke(
+                temporary_memory=self.temporary_memory, **kwargs
+            )
+            for name, kwargs in slots.items()
+        ]
+        return self._consult(self._slots_to_agent_response(tool_responses))
+
+    def _consult(self, agent_response: AgentResponse) -> AgentResponse:
+        if self._should_reply_without_consulting(agent_response):
+            return agent_response
+
+        user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
+        # Set from the thread state read at the start of the turn.
+        self._update_cursor(self.temporary_memory.cursor)
+        self.temporary_memory.suggestions = load_suggestions(user_memory.thread_id)
+
+        if user_memory.product_name:
+            return self._consult_specific_laptop()
+
+        return self._consult_laptops()
+
+    async def arun(
+        self, messages: list[ChatCompletionMessageParam], *args, **kwargs
+    ) -> AgentResponse:
+        if self.temporary_memory.user_memory is None:
+            return AgentResponse(
+                type="error",
+                content="User memory is not available.",
+            )
+
+        self.temporary_memory.chat_completions_messages = (
+            self.system_prompt_config.get_openai_messages(messages)
+        )
+        openai_request = self._get_openai_request()
+        try:
+            response = (await openai_request.acreate()).choices[0].message
+        except InternalServerError as e:
+            print("Internal server error:", e)
+            return AgentResponse(
+                type="error",
+                content="Internal server error.",
+            )
+        tool_responses = (
+            await self._ainvoke_tools(response.tool_calls)
+            if response.tool_calls
+            else []
+        )
+        agent_response = self._to_agent_response(response, tool_responses)
+        return await self._aconsult(agent_response)
+
+    async def arun_with_slots(self, slots: dict[str, dict[str, Any]]) -> AgentResponse:
+        if self.temporary_memory.user_memory is None:
+            return AgentResponse(
+                type="error",
+                content="User memory is not available.",
+            )
+
+        tool_responses = []
+        # Tools mutate the same user memory, so they still run one after another.
+        for name, kwargs in slots.items():
+            tool_responses.append(
+                await self._select_slot_tool(name).ainvoke(
+                    temporary_memory=self.temporary_memory, **kwargs
+                )
+            )
+        return await self._aconsult(self._slots_to_agent_response(tool_responses))
+
+    async def _aconsult(self, agent_response: AgentResponse) -> AgentResponse:
+        if self._should_reply_without_consulting(agent_response):
+            return agent_response
+
+        user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
+        self._update_cursor(self.temporary_memory.cursor)
+        self.temporary_memory.suggestions = await aload_suggestions(
+            user_memory.thread_id
+        )
+
+        if user_memory.product_name:
+            return await self._aconsult_specific_laptop()
+
+        return await self._aconsult_laptops()
+
+    def _select_slot_tool(self, name: str) -> ToolBase:
+        return next(tool for tool in self.tools if tool.name == name)
+
+    def _slots_to_agent_response(
+        self, tool_responses: list[ToolResponse]
+    ) -> AgentResponse:
+        if not tool_responses:
+            return AgentResponse(type="finished", content="No requirements collected")
+        return self._tool_responses_post_process(tool_responses)
+
+    def _to_agent_response(
+        self, response: ChatCompletionMessage, tool_responses: list[ToolResponse]
+    ) -> AgentResponse:
         tool_choices = response.tool_calls
         if not tool_choices and not response.content:
             raise Exception("No response content from the model")
         if not tool_choices:
             print("Final response:", response.content)
-            agent_response = AgentResponse(type="finished", content=response.content)
-        else:
-            tool_responses = self._invoke_tools(tool_choices)
-            agent_response = self._tool_responses_post_process(tool_responses)
+            return AgentResponse(type="finished", content=response.content)
 
-        if not agent_response:
-            raise Exception("No agent response")
+        return self._tool_responses_post_process(tool_responses)
 
+    def _should_reply_without_consulting(self, agent_response: AgentResponse) -> bool:
         if agent_response.type == "message":
-            return agent_response
+            return True
 
         if agent_response.type != "finished":
             raise Exception("Agent did not finish successfully")
 
-        user_memory = self.temporary_memory.user_memory
+        user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
 
         if not user_memory.brand_code and not user_memory.product_name:
             user_memory.brand_code = BRAND_DEFAULT
@@ -227,10 +381,12 @@ class Agent(AgentBase):
                     content="You must ask the user for the brand of the laptop they are interested in such as Dell, HP, Lenovo, etc.",
                 )
             )
-            return agent_response
+            return True
 
-        offset = get_value(f"offset:{user_memory.thread_id}")
-        offset = int(offset) if offset else 0
+        return False
+
+    def _update_cursor(self, cursor: PageCursor):
+        user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
 
         if not user_memory.intent:
             user_memory.intent = UserIntent()
@@ -238,64 +394,62 @@ class Agent(AgentBase):
         if user_memory.intent.is_user_needs_other_suggestions:
             user_memory.product_name = None
             user_memory.current_filter.product_name = None
-            offset += self.limit
+            cursor = cursor.next_page()
             user_memory.intent.is_user_needs_other_suggestions = False
 
-        self.temporary_memory.offset = offset
+        self.temporary_memory.cursor = cursor
 
-        if user_memory.product_name:
-            agent_response = self._consult_specific_laptop()
-        else:
-            agent_response = self._consult_laptops()
+    def _consult_laptops(self) -> AgentResponse:
+        filter = self._get_consult_filter()
+        return self._candidates_to_response(search_candidates(filter))
 
-        return agent_response
+    async def _aconsult_laptops(self) -> AgentResponse:
+        filter = self._get_consult_filter()
+        return self._candidates_to_response(await asearch_candidates(filter))
 
-    def _consult_laptops(self) -> AgentResponse:
+    def _get_consult_filter(self) -> LaptopFilter:
         user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
-        offset = self.temporary_memory.offset
-        laptops = []
-        config = Config(limit=self.limit)
-        config.offset = offset
+        config = Config(
+            limit=self.limit,
+            is_recommending=user_memory.consultation_status.is_recommending,
+        )
         filter = self._get_laptop_filter_from_user_memory(config=config)
-        if not user_memory.consultation_status.is_recommending:
-            laptops = self.retrieval(filter=filter)
+        return from_cursor(filter, self.temporary_memory.cursor)
 
-        if len(laptops) > 0:
-            user_memory.consultation_status.is_recommending = False
-            user_memory.product_name = (
-                laptops[0].name if len(laptops) == 1 else user_memory.product_name
-            )
-            user_memory.current_filter.product_name = (
-                laptops[0].name if len(laptops) == 1 else None
-            )
-            return (
-                self._laptops_to_response(laptops)
-                if len(laptops) > 1
-                else self._specific_laptop_to_response(laptops[0])
+    def _candidates_to_response(
+        self, candidates: Candidates[LaptopModel]
+    ) -> AgentResponse:
+        self.temporary_memory.cursor = candidates.cursor
+        if candidates.page:
+            return self._found_laptops_to_response(
+                candidates.page, is_recommending=False
             )
 
-        if offset > 0 and not user_memory.consultation_status.is_recommending:
-            config.offset -= self.limit
-            filter.config = config
-            laptops = self.retrieval(filter=filter)
-            len_previous_page = len(laptops)
-            config.offset += len_previous_page
-            filter.config = config
-            self.temporary_memory.offset = config.offset
-
-        config.is_recommending = True
-        laptops = self.retrieval(filter=filter)
-        if len(laptops) > 0:
-            user_memory.consultation_status.is_recommending = True
-            user_memory.product_name = (
-                laptops[0].name if len(laptops) == 1 else user_memory.product_name
-            )
-            user_memory.current_filter.product_name = (
-                laptops[0].name if len(laptops) == 1 else None
+        if candidates.recommendations:
+            return self._found_laptops_to_response(
+                candidates.recommendations, is_recommending=True
             )
+
+        return self._no_laptops_to_response()
+
+    def _found_laptops_to_response(
+        self, laptops: list[LaptopModel], is_recommending: bool
+    ) -> AgentResponse:
+        user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
+        user_memory.consultation_status.is_recommending = is_recommending
+        user_memory.product_name = (
+            laptops[0].name if len(laptops) == 1 else user_memory.product_name
+        )
+        user_memory.current_filter.product_name = (
+            laptops[0].name if len(laptops) == 1 else None
+        )
+        if len(laptops) > 1 or is_recommending:
             return self._laptops_to_response(laptops)
+        return self._specific_laptop_to_response(laptops[0])
 
-        self.temporary_memory.offset = 0
+    def _no_laptops_to_response(self) -> AgentResponse:
+        user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
+        self.temporary_memory.cursor = PageCursor()
         user_memory.consultation_status.is_recommending = False
         instructions = [
             Instruction(
@@ -322,6 +476,11 @@ class Agent(AgentBase):
         )
 
     def _consult_specific_laptop(self) -> AgentResponse:
+        suggestion = self._find_referenced_suggestion()
+        laptop = get_laptop(suggestion.id) if suggestion else None
+        if laptop:
+            return self._matched_laptop_to_response(laptop)
+
         user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
 
         config = Config(limit=1)
@@ -332,12 +491,54 @@ class Agent(AgentBase):
         )
 
         if not laptops:
-            user_memory.product_name = None
-            user_memory.current_filter.product_name = None
-            user_memory.consultation_status.is_recommending = True
+            self._reset_specific_laptop()
             return self._consult_laptops()
 
-        laptop = laptops[0]
+        return self._matched_laptop_to_response(laptops[0])
+
+    async def _aconsult_specific_laptop(self) -> AgentResponse:
+        suggestion = self._find_referenced_suggestion()
+        laptop = await aget_laptop(suggestion.id) if suggestion else None
+        if laptop:
+            return self._matched_laptop_to_response(laptop)
+
+        user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
+
+        config = Config(limit=1)
+        filter = self._get_laptop_filter_from_user_memory(config=config)
+        laptops = await self.aretrieval(
+            filter=filter,
+            is_recommending=user_memory.consultation_status.is_recommending,
+        )
+
+        if not laptops:
+            self._reset_specific_laptop()
+            return await self._aconsult_laptops()
+
+        return self._matched_laptop_to_response(laptops[0])
+
+    def _find_referenced_suggestion(self) -> Optional[Suggestion]:
+        """
+        The suggested laptop the user picked this turn ("cái thứ 2" or its name), so
+        it is fetched by id instead of searched by name embedding.
+        """
+        user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
+        # A laptop already consulted on an earlier turn is searched again, so that new
+        # requirements still apply to it.
+        if user_memory.product_name == user_memory.current_filter.product_name:
+            return None
+        return find_suggestion_by_name(
+            self.temporary_memory.suggestions, user_memory.product_name
+        )
+
+    def _reset_specific_laptop(self):
+        user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
+        user_memory.product_name = None
+        user_memory.current_filter.product_name = None
+        user_memory.consultation_status.is_recommending = True
+
+    def _matched_laptop_to_response(self, laptop: LaptopModel) -> AgentResponse:
+        user_memory: UserMemoryModel = self.temporary_memory.user_memory  # type: ignore
         user_memory.current_filter.product_name = laptop.name
         return self._specific_laptop_to_response(laptop)
 
@@ -347,25 +548,52 @@ class Agent(AgentBase):
         tool_responses = []
 
         for tool_choice in tool_choices:
-            tool_name = tool_choice.function.name
-            kwargs = {} or json.loads(tool_choice.function.arguments)
-            selected_tool = next(tool for tool in self.tools if tool.name == tool_name)
+            selected_tool, kwargs = self._select_tool(tool_choice)
             tool_response = selected_tool.invoke(
                 temporary_memory=self.temporary_memory, **kwargs
             )
-            print(f"Tool response for {tool_name}:")
-            print(
-                kwargs,
-                (
-                    self.temporary_memory.user_memory.model_dump()
-                    if self.temporary_memory.user_memory
-                    else None
-                ),
+            self._log_tool_response(tool_choice, kwargs)
+            tool_responses.append(tool_response)
+
+        return tool_responses
+
+    async def _ainvoke_tools(
+        self, tool_choices: list[ChatCompletionMessageToolCall]
+    ) -> list[ToolResponse]:
+        tool_responses = []
+
+        # Tools mutate the same user memory, so they still run one after another.
+        for tool_choice in tool_choices:
+            selected_tool, kwargs = self._select_tool(tool_choice)
+            tool_response = await selected_tool.ainvoke(
+                temporary_memory=self.temporary_memory, **kwargs
             )
+            self._log_tool_response(tool_choice, kwargs)
             tool_responses.append(tool_response)
 
         return tool_responses
 
+    def _select_tool(
+        self, tool_choice: ChatCompletionMessageToolCall
+    ) -> tuple[ToolBase, dict[str, Any]]:
+        tool_name = tool_choice.function.name
+        kwargs = {} or json.loads(tool_choice.function.arguments)
+        selected_tool = next(tool for tool in self.tools if tool.name == tool_name)
+        return selected_tool, kwargs
+
+    def _log_tool_response(
+        self, tool_choice: ChatCompletionMessageToolCall, kwargs: dict[str, Any]
+    ):
+        print(f"Tool response for {tool_choice.function.name}:")
+        print(
+            kwargs,
+            (
+                self.temporary_memory.user_memory.model_dump()
+                if self.temporary_memory.user_memory
+                else None
+            ),
+        )
+
     def _get_openai_request(
         self,
         before_request: Optional[OpenAIChatCompletionsRequest] = None,
@@ -382,6 +610,7 @@ class Agent(AgentBase):
                 ),
                 temperature=0,
                 timeout=60,
+                agent="laptop_collect_and_retrieval",
             )
         if not before_tool_response:
             return OpenAIChatCompletionsRequest(
@@ -390,6 +619,7 @@ class Agent(AgentBase):
                 tools=before_request.tools,
                 temperature=before_request.temperature,
                 timeout=before_request.timeout,
+                agent=before_request.agent,
             )
 
         if before_tool_response.type == "message":
@@ -399,6 +629,7 @@ class Agent(AgentBase):
                 tools=NOT_GIVEN,
                 temperature=0,
                 timeout=60,
+                agent="laptop_collect_and_retrieval",
             )
 
         raise NotImplementedError()
@@ -477,8 +708,21 @@ class Agent(AgentBase):
 
         return laptops
 
+    async def aretrieval(
+        self, filter: LaptopFilter | None, is_recommending: bool = False
+    ) -> list[LaptopModel]:
+        if not filter:
+            filter = self._get_laptop_filter_from_user_memory()
+
+        laptops = await asearch(filter)
+
+        return laptops
+
     def _laptops_to_response(self, laptops: list[LaptopModel]) -> AgentResponse:
         user_memory: UserMemoryModel = self.temporary_memory.user_memory
+        self.temporary_memory.suggestions = [
+            Suggestion(id=laptop.id, name=laptop.name) for laptop in laptops
+        ]
         knowledge = [
             laptop.to_text(
                 include_key_selling_points=True,
@@ -1,5 +1,4 @@
-from datetime import datetime
-from typing import Literal, Optional
+from typing import AsyncIterator, Literal, Optional
 from overrides import override
 from pydantic import BaseModel, Field
 from openai.types.chat import (
@@ -13,6 +12,7 @@ from models.user import UserModel
 from service.openai import OpenAIChatCompletionsRequest, _client, _chat_model
 from openai.types.chat_model import ChatModel
 from agents.base import (
+    current_date,
     Agent as AgentBase,
     Instruction,
     SystemPromptConfig as SystemPromptConfigBase,
@@ -20,7 +20,7 @@ from agents.base import (
     AgentResponseBase,
 )
 from models.user_memory import ProductType, UserMemory, UserMemoryModel
-from service.faq import search as search_faq
+from service.faq import search as search_faq, asearch as asearch_faq
 
 
 class SystemPromptConfig(SystemPromptConfigBase):
@@ -44,7 +44,6 @@ class SystemPromptConfig(SystemPromptConfigBase):
             "   - Website: [FPTShop](https://fptshop.com.vn)\n"
             "   - Customer service email: cskh@fptshop.com\n"
         ),
-        f"Current date: {datetime.now().strftime('%A, %B %d, %Y')} ({datetime.now().strftime('%Y-%m-%d')})",
     ]
     rules: list[str] = [
         "Don't talk nonsense and make up facts.",
@@ -70,8 +69,13 @@ class SystemPromptConfig(SystemPromptConfigBase):
     def skills_to_string(self) -> str:
         return "\n".join([f"- {skill}" for skill in self.skills])
 
-    def base_knowledge_to_string(self) -> str:
-        return "\n".join([f"- {knowledge}" for knowledge in self.base_knowledge])
+    def base_knowledge_to_string(self, include_turn_knowledge: bool = True) -> str:
+        base_knowledge = (
+            [*self.base_knowledge, current_date()]
+            if include_turn_knowledge
+            else self.base_knowledge
+        )
+        return "\n".join([f"- {knowledge}" for knowledge in base_knowledge])
 
     def rules_to_string(self) -> str:
         return "\n".join([f"- {rule}" for rule in self.rules])
@@ -178,6 +182,32 @@ class SystemPromptConfig(SystemPromptConfigBase):
             "content": f"This is the latest user's message: {(latest_user_message or {}).get('content', 'No content available')}",
         }
 
+        if self.is_cache_friendly_layout():
+            static_base_knowledge_message: ChatCompletionMessageParam | None = (
+                {
+                    "role": "system",
+                    "content": f"""## BASE KNOWLEDGE:\n{self.base_knowledge_to_string(include_turn_knowledge=False)}""",
+                }
+                if self.base_knowledge
+                else None
+            )
+            return self.arrange_messages(
+                [
+                    role_task_skill_message,
+                    static_base_knowledge_message,
+                    rules_message,
+                    workflow_message,
+                    initialization_message,
+                ],
+                conversation_messages,
+                [
+                    self.current_date_message(),
+                    laptop_knowledge_message,
+                    instructions_message,
+                    latest_user_message_description,
+                ],
+            )
+
         messages = [
             role_task_skill_message,
             base_knowledge_message,
@@ -225,15 +255,65 @@ class Agent(AgentBase):
         """
         Run the agent to generate a response based on the conversation messages.
         """
+        latest_user_message = self._get_latest_user_message(conversation_messages)
+        if isinstance(latest_user_message, AgentResponse):
+            return latest_user_message
+
+        faqs = self.retrieval_faq(latest_user_message)
+        self._build_prompt(conversation_messages, instructions, laptop_knowledge, faqs)
+
+        response = self._get_openai_request().create()
+        return self._to_agent_response(response.choices[0].message.content)
+
+    async def arun(
+        self,
+        conversation_messages: list[ChatCompletionMessageParam],
+        instructions: list[Instruction] = [],
+        laptop_knowledge: list[str] = [],
+        *args,
+        **kwargs,
+    ) -> AgentResponseBase:
+        latest_user_message = self._get_latest_user_message(conversation_messages)
+        if isinstance(latest_user_message, AgentResponse):
+            return latest_user_message
+
+        faqs = await self.aretrieval_faq(latest_user_message)
+        self._build_prompt(conversation_messages, instructions, laptop_knowledge, faqs)
+
+        response = await self._get_openai_request().acreate()
+        return self._to_agent_response(response.choices[0].message.content)
+
+    async def astream(
+        self,
+        conversation_messages: list[ChatCompletionMessageParam],
+        instructions: list[Instruction] = [],
+        laptop_knowledge: list[str] = [],
+        *args,
+        **kwargs,
+    ) -> AsyncIterator[str]:
+        """
+        Same as `arun`, but yields the response tokens as they are generated.
+        """
+        latest_user_message = self._get_latest_user_message(conversation_messages)
+        if isinstance(latest_user_message, AgentResponse):
+            yield latest_user_message.content or ""
+            return
+
+        faqs = await self.aretrieval_faq(latest_user_message)
+        self._build_prompt(conversation_messages, instructions, laptop_knowledge, faqs)
+
+        async for token in self._get_openai_request().astream():
+            yield token
+
+    def _get_latest_user_message(
+        self, conversation_messages: list[ChatCompletionMessageParam]
+    ) -> str | AgentResponse:
         user_memory = self.temporary_memory.user_memory
         if not user_memory or user_memory.intent.product_type != ProductType.LAPTOP:
             return AgentResponse(
                 type="message", content="User memory is not valid for this agent."
             )
 
-        self.system_prompt_config.instructions = instructions
-        self.system_prompt_config.laptop_knowledge = laptop_knowledge
-
         latest_user_message = next(
             (msg for msg in reversed(conversation_messages) if msg["role"] == "user"),
             None,
@@ -242,6 +322,18 @@ class Agent(AgentBase):
         if not latest_user_message or not latest_user_message["content"]:
             return AgentResponse(type="message", content="No valid user message found.")
 
+        return str(latest_user_message["content"])
+
+    def _build_prompt(
+        self,
+        conversation_messages: list[ChatCompletionMessageParam],
+        instructions: list[Instruction],
+        laptop_knowledge: list[str],
+        faqs: list[FAQModel],
+    ):
+        self.system_prompt_config.instructions = instructions
+        self.system_prompt_config.laptop_knowledge = laptop_knowledge
+
         if self.temporary_memory.use_fine_tune_tone:
             self.system_prompt_config.rules = [
                 "Don't talk nonsense and make up facts.",
@@ -262,8 +354,6 @@ class Agent(AgentBase):
                 "User gender: unknown"
             ] + self.system_prompt_config.base_knowledge
 
-        faqs = self.retrieval_faq(str(latest_user_message["content"]))
-
         if faqs:
             self.system_prompt_config.base_knowledge.append(
                 f"Some frequently asked questions (FAQs) in the store:\n"
@@ -289,18 +379,15 @@ class Agent(AgentBase):
             )
         )
 
-        openai_request = self._get_openai_request()
-        response = openai_request.create()
-        response_message = response.choices[0].message
-
-        if not response_message.content:
+    def _to_agent_response(self, content: str | None) -> AgentResponse:
+        if not content:
             return AgentResponse(
                 type="message", content="No content in response message."
             )
 
         return AgentResponse(
             type="finished",
-            content=response_message.content,
+            content=content,
         )
 
     def _get_openai_request(
@@ -311,6 +398,7 @@ class Agent(AgentBase):
             model=self.model,
             temperature=0,
             timeout=60,
+            agent="laptop_generate_response",
         )
 
     def retrieval_faq(self, question: str) -> list[FAQModel]:
@@ -321,3 +409,8 @@ class Agent(AgentBase):
         faqs = search_faq(question)
 
         return faqs
+
+    async def aretrieval_faq(self, question: str) -> list[FAQModel]:
+        faqs = await asearch_faq(question)
+
+        return faqs
@@ -23,9 +23,9 @@ from agents.base import (
     SystemPromptConfig as SystemPromptConfigBase,
     AgentTemporaryMemory as AgentTemporaryMemoryBase,
     AgentResponseBase,
+    current_date,
 )
 from models.user_memory import UserMemory, UserMemoryModel, ProductType
-from datetime import datetime
 
 
 def instructions_to_string(instructions: list[Instruction]) -> str:
@@ -53,60 +53,111 @@ def generate_response_by_instructions(
     model: str = "gpt-4o-mini",
     use_fine_tune_tone: bool = False,
 ) -> str:
+    openai_request = _get_response_by_instructions_request(
+        instructions=instructions,
+        knowledge=knowledge,
+        conversation_history=conversation_history,
+        model=model,
+        use_fine_tune_tone=use_fine_tune_tone,
+    )
+
+    response = openai_request.create()
+    return response.choices[0].message.content or ""
+
+
+async def agenerate_response_by_instructions(
+    instructions: list[Instruction],
+    knowledge: list[str],
+    conversation_history: list[ChatCompletionMessageParam],
+    model: str = "gpt-4o-mini",
+    use_fine_tune_tone: bool = False,
+) -> str:
+    openai_request = _get_response_by_instructions_request(
+        instructions=instructions,
+        knowledge=knowledge,
+        conversation_history=conversation_history,
+        model=model,
+        use_fine_tune_tone=use_fine_tune_tone,
+    )
+
+    response = await openai_request.acreate()
+    return response.choices[0].message.content or ""
+
+
+def _get_response_by_instructions_request(
+    instructions: list[Instruction],
+    knowledge: list[str],
+    conversation_history: list[ChatCompletionMessageParam],
+    model: str,
+    use_fine_tune_tone: bool,
+) -> OpenAIChatCompletionsRequest:
     if not instructions:
         raise ValueError("Instructions cannot be empty.")
 
-    messages: list[ChatCompletionMessageParam] = [
-        {
-            "role": "system",
-            "content": (
-                "## KNOWLEDGE\n"
-                + ("\n".join([f"- {knowledge}" for knowledge in knowledge]))
-                + "- Information about your phone store:\n"
-                "   - Name: FPTShop\n"
-                "   - Location: https://fptshop.com.vn/cua-hang\n"
-                "   - Hotline: 1800.6601\n"
-                "   - Website: [FPTShop](https://fptshop.com.vn)\n"
-                "   - Customer service email: cskh@fptshop.com\n"
-                f"- Current date: {datetime.now().strftime('%A, %B %d, %Y')} ({datetime.now().strftime('%Y-%m-%d')})\n"
-            ),
-        },
-        {
-            "role": "system",
-            "content": ("## INSTRUCTIONS\n" + instructions_to_string(instructions)),
-        },
+    knowledge_message: ChatCompletionMessageParam = {
+        "role": "system",
+        "content": (
+            "## KNOWLEDGE\n"
+            + ("\n".join([f"- {knowledge}" for knowledge in knowledge]))
+            + "- Information about your phone store:\n"
+            "   - Name: FPTShop\n"
+            "   - Location: https://fptshop.com.vn/cua-hang\n"
+            "   - Hotline: 1800.6601\n"
+            "   - Website: [FPTShop](https://fptshop.com.vn)\n"
+            "   - Customer service email: cskh@fptshop.com\n"
+            f"- {current_date()}\n"
+        ),
+    }
+    instructions_message: ChatCompletionMessageParam = {
+        "role": "system",
+        "content": ("## INSTRUCTIONS\n" + instructions_to_string(instructions)),
+    }
+    note_message: ChatCompletionMessageParam = {
+        "role": "system",
+        "content": (
+            "# You are a helpful assistant. Your task is generate a response for the user by <INSTRUCTIONS>.\n"
+            "## NOTE\n"
+            "- Use only the Vietnamese language in your responses."
+            "- The response should be in the form of a conversation."
+            "- The response must be follow the <INSTRUCTIONS> and don't say anything else."
+        ),
+    }
+    rules_message: ChatCompletionMessageParam | None = (
         {
             "role": "system",
             "content": (
-                "# You are a helpful assistant. Your task is generate a response for the user by <INSTRUCTIONS>.\n"
-                "## NOTE\n"
-                "- Use only the Vietnamese language in your responses."
-                "- The response should be in the form of a conversation."
-                "- The response must be follow the <INSTRUCTIONS> and don't say anything else."
+                "## RULES\n"
+                "- Use only the Vietnamese language in your response. Always refer to yourself using 'em' pronoun, except when addressing the user as 'cô,' 'chú,' or 'bác,' in which case use 'con' to refer to yourself. Address the user based on how they refer to themselves: if they explicitly use 'cô' or 'chú,' address them with that term. If their preferred address term cannot be determined from their self-reference, use 'anh' for males, 'chị' for females based on their provided gender, or the polite neutral term 'anh/chị' if gender is unknown or not provided. Do not use terms like 'anh' or 'chị' for yourself, as this would imply a higher status.\n"
+                "- Format the response message as a single social media message (like on Messenger), and avoid using markdown syntax."
             ),
-        },
-    ]
-
-    if use_fine_tune_tone:
-        messages.append(
-            {
-                "role": "system",
-                "content": (
-                    "## RULES\n"
-                    "- Use only the Vietnamese language in your response. Always refer to yourself using 'em' pronoun, except when addressing the user as 'cô,' 'chú,' or 'bác,' in which case use 'con' to refer to yourself. Address the user based on how they refer to themselves: if they explicitly use 'cô' or 'chú,' address them with that term. If their preferred address term cannot be determined from their self-reference, use 'anh' for males, 'chị' for females based on their provided gender, or the polite neutral term 'anh/chị' if gender is unknown or not provided. Do not use terms like 'anh' or 'chị' for yourself, as this would imply a higher status.\n"
-                    "- Format the response message as a single social media message (like on Messenger), and avoid using markdown syntax."
-                ),
-            }
-        )
+        }
+        if use_fine_tune_tone
+        else None
+    )
 
-    messages.extend(conversation_history)
+    if env.PROMPT_LAYOUT == "cache_friendly":
+        # Static blocks first so the prompt prefix can be served from OpenAI's cache.
+        ordered_messages = [
+            note_message,
+            rules_message,
+            *conversation_history,
+            knowledge_message,
+            instructions_message,
+        ]
+    else:
+        ordered_messages = [
+            knowledge_message,
+            instructions_message,
+            note_message,
+            rules_message,
+            *conversation_history,
+        ]
+    messages = [message for message in ordered_messages if message is not None]
 
-    openai_request = OpenAIChatCompletionsRequest(
+    return OpenAIChatCompletionsRequest(
         messages=messages,
         model=model,
         temperature=0,
         timeout=60,
+        agent="response_by_instructions",
     )
-
-    response = openai_request.create()
-    return response.choices[0].message.content or ""
@@ -0,0 +1,40 @@
+"""add conversation summary to user_memory
+
+Revision ID: 3e8a6d0f4b21
+Revises: 9d41b7c2e6f0
+Create Date: 2026-10-18 14:22:41.518307
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3e8a6d0f4b21"
+down_revision: Union[str, None] = "9d41b7c2e6f0"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "user_memory",
+        sa.Column("conversation_summary", sa.Text(), nullable=True),
+    )
+    op.add_column(
+        "user_memory",
+        sa.Column(
+            "summarized_message_count",
+            sa.Integer(),
+            nullable=False,
+            server_default="0",
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("user_memory", "summarized_message_count")
+    op.drop_column("user_memory", "conversation_summary")
@@ -0,0 +1,54 @@
+"""add hnsw indexes for embeddings
+
+Revision ID: 5c2e8f1a9b37
+Revises: 7a1369d61984
+Create Date: 2026-10-18 09:12:41.518203
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c2e8f1a9b37"
+down_revision: Union[str, None] = "7a1369d61984"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+EMBEDDING_DIMENSIONS = 1536
+
+# (table, embedding column)
+EMBEDDING_COLUMNS = [
+    ("phones", "name_embedding"),
+    ("laptops", "name_embedding"),
+    ("accessories", "name_embedding"),
+    ("brands", "embedding"),
+    ("faqs", "embedding"),
+]
+
+
+def upgrade() -> None:
+    for table, column in EMBEDDING_COLUMNS:
+        # HNSW indexes need a typed dimension.
+        op.execute(
+            f"ALTER TABLE {table} ALTER COLUMN {column} "
+            f"TYPE vector({EMBEDDING_DIMENSIONS}) "
+            f"USING {column}::vector({EMBEDDING_DIMENSIONS})"
+        )
+        op.create_index(
+            f"ix_{table}_{column}_hnsw",
+            table,
+            [column],
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={column: "vector_cosine_ops"},
+        )
+
+
+def downgrade() -> None:
+    for table, column in EMBEDDING_COLUMNS:
+        op.drop_index(f"ix_{table}_{column}_hnsw", table_name=table)
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE vector")
@@ -0,0 +1,31 @@
+"""apply embedding profile
+
+Revision ID: 9d41b7c2e6f0
+Revises: 5c2e8f1a9b37
+Create Date: 2026-10-18 11:03:27.904115
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9d41b7c2e6f0"
+down_revision: Union[str, None] = "5c2e8f1a9b37"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The schema keeps the default embedding profile, vector(1536) as typed by the
+    # previous revision, whatever the environment. Another profile is applied to a
+    # database with tasks.apply_embedding_profile, which rebuilds the columns and
+    # their indexes.
+    pass
+
+
+def downgrade() -> None:
+    pass
@@ -0,0 +1,33 @@
+"""add (score, id) indexes for keyset paging
+
+Revision ID: b7d2c4e91a58
+Revises: 3e8a6d0f4b21
+Create Date: 2026-10-18 16:05:12.730114
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b7d2c4e91a58"
+down_revision: Union[str, None] = "3e8a6d0f4b21"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ["phones", "laptops", "accessories"]
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        # Serves ORDER BY score DESC, id DESC and the (score, id) < cursor
+        # condition of the next page with a backward index scan.
+        op.create_index(f"ix_{table}_score_id", table, ["score", "id"])
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.drop_index(f"ix_{table}_score_id", table_name=table)
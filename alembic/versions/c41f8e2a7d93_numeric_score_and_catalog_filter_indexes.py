@@ -0,0 +1,67 @@
+"""numeric score and catalog filter indexes
+
+Revision ID: c41f8e2a7d93
+Revises: b7d2c4e91a58
+Create Date: 2026-10-18 16:48:03.214962
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c41f8e2a7d93"
+down_revision: Union[str, None] = "b7d2c4e91a58"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, column, type)
+NUMERIC_COLUMNS = [
+    ("phones", "score", "double precision"),
+    ("laptops", "score", "double precision"),
+    ("accessories", "score", "double precision"),
+    ("accessories", "price", "bigint"),
+]
+
+# (table, columns), equality columns first so that the range or the ORDER BY that
+# follows can use the rest of the index.
+BTREE_INDEXES = [
+    # brand_code = ? ORDER BY score DESC, id DESC, and the keyset cursor.
+    ("phones", ["brand_code", "score", "id"]),
+    ("laptops", ["brand_code", "score", "id"]),
+    ("accessories", ["product_type", "brand_code", "score", "id"]),
+    # brand_code = ? AND min_price <= ? AND max_price >= ?
+    ("phones", ["brand_code", "min_price", "max_price"]),
+    ("laptops", ["brand_code", "min_price", "max_price"]),
+    ("accessories", ["product_type", "price"]),
+    # The ROM and color conditions select product ids from the variants.
+    ("phone_variants", ["phone_id"]),
+    ("laptop_variants", ["laptop_id"]),
+]
+
+
+def _index_name(table: str, columns: list[str]) -> str:
+    return f"ix_{table}_{'_'.join(columns)}"
+
+
+def upgrade() -> None:
+    for table, column, type_ in NUMERIC_COLUMNS:
+        # A no-op where the column is already numeric, databases created from the
+        # models had it as text.
+        op.execute(
+            f"ALTER TABLE {table} ALTER COLUMN {column} "
+            f"TYPE {type_} USING {column}::{type_}"
+        )
+
+    # The color_tsv columns already have GIN indexes since their tables were created.
+    for table, columns in BTREE_INDEXES:
+        op.create_index(_index_name(table, columns), table, columns)
+
+
+def downgrade() -> None:
+    for table, columns in BTREE_INDEXES:
+        op.drop_index(_index_name(table, columns), table_name=table)
+    # The columns stay numeric, the migrations before this one create them numeric.
@@ -0,0 +1,66 @@
+"""conversation lookup indexes
+
+Revision ID: d5a0b3c8e172
+Revises: c41f8e2a7d93
+Create Date: 2026-10-18 17:22:41.508317
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d5a0b3c8e172"
+down_revision: Union[str, None] = "c41f8e2a7d93"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, columns), for the lookups every chat turn makes.
+BTREE_INDEXES = [
+    # repositories.message.get_by_fb_message_id
+    ("messages", ["fb_message_id"]),
+    # repositories.message.get_all: thread_id = ? ORDER BY created_at DESC LIMIT ?
+    ("messages", ["thread_id", "created_at"]),
+    # repositories.thread.get_all_by_user_id: user_id = ? ORDER BY created_at DESC
+    ("threads", ["user_id", "created_at"]),
+    # repositories.user.get_by_fb_user_id: fb_user_id = ? AND role = ?
+    ("users", ["fb_user_id", "role"]),
+]
+
+
+def _index_name(table: str, columns: list[str]) -> str:
+    return f"ix_{table}_{'_'.join(columns)}"
+
+
+def upgrade() -> None:
+    for table, columns in BTREE_INDEXES:
+        op.create_index(_index_name(table, columns), table, columns)
+
+    # A thread has one memory. Keep the most recently updated row of any thread that
+    # got two from concurrent first turns, then let the unique index back the
+    # INSERT ... ON CONFLICT (thread_id) of repositories.user_memory.get_or_create.
+    op.execute(
+        """
+        DELETE FROM user_memory WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY thread_id ORDER BY updated_at DESC NULLS LAST, id
+                ) AS position
+                FROM user_memory
+            ) ranked
+            WHERE position > 1
+        )
+        """
+    )
+    op.create_index(
+        "ix_user_memory_thread_id", "user_memory", ["thread_id"], unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_user_memory_thread_id", table_name="user_memory")
+    for table, columns in BTREE_INDEXES:
+        op.drop_index(_index_name(table, columns), table_name=table)
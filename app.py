@@ -13,12 +13,17 @@ from controllers.fb_webhook import router as fb_webhook_router
 from service.wandb import *
 from controllers.heatlh import router as health_router
 import chainlit_process.authentication
+import service.demand_classifier as demand_classifier
+from service.conversation_window import load_encoding
 
 rq_command = ["rq", "worker", "--with-scheduler"]
 rq_process = subprocess.Popen(
     rq_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
 )
 alembic.config.main(argv=["--raiseerr", "upgrade", "head"])
+if env.DEMAND_CLASSIFIER_ENABLED:
+    demand_classifier.load()
+load_encoding()
 
 app = FastAPI(debug=True)
 
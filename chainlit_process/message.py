@@ -3,18 +3,20 @@ from uuid import UUID
 import uuid
 import chainlit as cl
 from models.message import MessageModel
-from service.store_chatbot_v2 import gen_answer
+from service.store_chatbot_v2 import agen_answer, afold_thread
 from repositories.thread import (
-    get as get_thread,
-    create as create_thread,
+    aget as aget_thread,
+    acreate as acreate_thread,
     CreateThreadModel,
 )
-from repositories.message import create as create_message, CreateMessageModel
+from repositories.message import acreate as acreate_message, CreateMessageModel
 from models.message import MessageType
 from chainlit.types import ThreadDict
+from db import aunit_of_work
 
 
 @cl.on_message
+@aunit_of_work()
 async def main(message: cl.Message):
     if not cl.context.session.user:
         raise ValueError("User is not logged in")
@@ -27,9 +29,9 @@ async def main(message: cl.Message):
     print("User ID:", user_id)
     print("Thread ID:", thread_id)
 
-    thread = get_thread(thread_id)
+    thread = await aget_thread(thread_id)
     if not thread:
-        thread = create_thread(
+        thread = await acreate_thread(
             CreateThreadModel(
                 id=thread_id,
                 user_id=user_id,
@@ -45,30 +47,52 @@ async def main(message: cl.Message):
         content=message.content,
     )
 
-    new_message = create_message(message_data)
+    new_message = await acreate_message(message_data)
 
+    response_message = cl.Message(
+        content="",
+        author="assistant_message",
+        metadata={"user_id": str(user_id)},
+        parent_id=message.id,
+    )
     try:
-        response_text = gen_answer(user_id, thread_id, conversation)
+        response_text = await agen_answer(
+            user_id,
+            thread_id,
+            conversation,
+            on_token=response_message.stream_token,
+        )
 
     except Exception as e:
         print("Error:", e)
         response_text = str(e)
+        answered = False
+    else:
+        answered = True
+
+    # Answers that are not streamed, or an error after the first tokens, replace
+    # whatever was streamed so far.
+    response_message.content = response_text
 
-    # Create a new message for the assistant
+    # Create a new message for the assistant, once with the final content
     new_assistant_message_data = CreateMessageModel(
+        id=UUID(response_message.id),
         thread_id=thread.id,
         type=MessageType.bot,
         content=response_text,
     )
-    new_assistant_message = create_message(new_assistant_message_data)
-    return await cl.Message(
-        content=response_text,
-        author="assistant_message",
-        metadata={"user_id": str(user_id)},
-        parent_id=message.id,
-        id=str(new_assistant_message.id),
-        created_at=new_assistant_message.created_at.isoformat(),
-    ).send()
+    new_assistant_message = await acreate_message(new_assistant_message_data)
+    response_message.created_at = new_assistant_message.created_at.isoformat()
+    sent = await response_message.send()
+
+    # The summary is folded once the answer is sent, off the turn's critical path.
+    if answered:
+        await afold_thread(
+            user_id,
+            thread_id,
+            [*conversation, {"role": "assistant", "content": response_text}],
+        )
+    return sent
 
 
 @cl.set_starters
@@ -1,8 +1,12 @@
+import hashlib
+import hmac
 from fastapi import FastAPI, Request, Response
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from service.messenger import messenger as messenger_service
+import service.messenger_queue as messenger_queue
 from fastapi import APIRouter
+from starlette.concurrency import run_in_threadpool
 from env import env
 
 router = APIRouter()
@@ -30,17 +34,38 @@ async def verify(request: Request):
     return Response(content="Required arguments haven't passed.", status_code=400)
 
 
+def _has_valid_signature(body: bytes, signature: Optional[str]) -> bool:
+    # Deliveries are signed with the app secret, unchecked when it isn't configured.
+    if not env.FB_APP_SECRET:
+        return True
+    digest = hmac.new(env.FB_APP_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return signature is not None and hmac.compare_digest(signature, f"sha256={digest}")
+
+
 @router.post("/webhook")
-async def webhook(data: WebhookRequestData):
+async def webhook(request: Request, data: WebhookRequestData):
     """
-    Messages handler.
+    Messages handler. With MESSENGER_QUEUE_ENABLED the messages are only queued, so
+    Facebook gets its answer at once and the turns run on the messenger workers. A
+    failure to queue them is answered with a 500, for Facebook to deliver them again.
     """
+    if not _has_valid_signature(
+        await request.body(), request.headers.get("X-Hub-Signature-256")
+    ):
+        return Response(content="Invalid signature", status_code=403)
 
-    print("Received webhook data:", data)
+    if data.object == "page" and env.MESSENGER_QUEUE_ENABLED:
+        try:
+            await run_in_threadpool(messenger_queue.enqueue, data.model_dump())
+        except Exception as e:
+            print("Error queuing webhook data:", e)
+            return Response(content="Error queuing webhook data", status_code=500)
+        return Response(content="ok")
 
     try:
         if data.object == "page":
-            messenger_service.handle(data.model_dump())
+            # The messenger flow is still synchronous, keep it off the event loop.
+            await run_in_threadpool(messenger_service.handle, data.model_dump())
     except Exception as e:
         print("Error handling webhook data:", e)
 
@@ -1,6 +1,9 @@
 from fastapi import APIRouter, Response, status
 
 import random
+from service.llm_cache import get_stats as get_llm_cache_stats
+from service.prompt_cache import get_stats as get_prompt_cache_stats
+from service.speculative_collect import get_stats as get_speculative_collect_stats
 
 router = APIRouter()
 
@@ -28,3 +31,20 @@ async def shutdown():
     global die
     die = True
     return {"shutdown": True}
+
+
+# The metrics are read with the blocking Redis client, so these endpoints are plain
+# functions that FastAPI runs in its threadpool.
+@router.get("/metrics/llm-cache")
+def llm_cache_metrics():
+    return get_llm_cache_stats()
+
+
+@router.get("/metrics/prompt-cache")
+def prompt_cache_metrics():
+    return get_prompt_cache_stats()
+
+
+@router.get("/metrics/speculative-collect")
+def speculative_collect_metrics():
+    return get_speculative_collect_stats()
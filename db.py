@@ -1,19 +1,151 @@
-from sqlalchemy import engine
-from sqlalchemy.orm import sessionmaker
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Any, Coroutine, Optional, TypeVar
+from sqlalchemy import Connection, engine, event, text
+from sqlalchemy.orm import sessionmaker, Session as SessionType
+from sqlalchemy.ext.asyncio import (
+    AsyncConnection,
+    create_async_engine,
+    async_sessionmaker,
+    AsyncSession as AsyncSessionType,
+)
+from pgvector.asyncpg import register_vector
 from env import env
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 
 db = engine.create_engine(
     f"postgresql://{env.DB_USER}:{env.DB_PASSWORD}@{env.DB_HOST}:{env.DB_PORT}/{env.DB_NAME}",
     echo=False,
     pool_pre_ping=True,
+    pool_size=env.DB_POOL_SIZE,
+    max_overflow=env.DB_MAX_OVERFLOW,
+)
+
+async_db = create_async_engine(
+    f"postgresql+asyncpg://{env.DB_USER}:{env.DB_PASSWORD}@{env.DB_HOST}:{env.DB_PORT}/{env.DB_NAME}",
+    echo=False,
+    pool_pre_ping=True,
+    pool_size=env.DB_POOL_SIZE,
+    max_overflow=env.DB_MAX_OVERFLOW,
 )
 
+
+@event.listens_for(async_db.sync_engine, "connect")
+def _register_vector(dbapi_connection, connection_record):
+    dbapi_connection.run_async(register_vector)
+
+
 vectordb_conn_str = f"postgresql+psycopg://{env.DB_USER}:{env.DB_PASSWORD}@{env.DB_HOST}:{env.DB_PORT}/{env.DB_NAME}"
-Session = sessionmaker(db)
+_sessionmaker = sessionmaker(db)
+# Objects must stay readable after commit because async sessions can't lazy load.
+_async_sessionmaker = async_sessionmaker(async_db, expire_on_commit=False)
+
+_T = TypeVar("_T")
+
+# Connection of the unit of work the caller runs in, if any.
+_connection: ContextVar[Optional[Connection]] = ContextVar("connection", default=None)
+_async_connection: ContextVar[Optional[AsyncConnection]] = ContextVar(
+    "async_connection", default=None
+)
+
+
+def Session() -> SessionType:
+    """
+    A session on the connection of the current unit of work, or on one checked out of
+    the pool outside of it. Repositories commit each session as before: the connection
+    stays checked out by the unit of work between them.
+    """
+    connection = _connection.get()
+    if connection is None:
+        return _sessionmaker()
+    return _sessionmaker(bind=connection)
+
+
+def AsyncSession() -> AsyncSessionType:
+    connection = _async_connection.get()
+    if connection is None:
+        return _async_sessionmaker()
+    return _async_sessionmaker(bind=connection)
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Runs every `Session()` of the block, e.g. a whole chat turn, on one pooled
+    connection instead of checking one out (and pinging it) per repository call. Nested
+    units of work join the outer one. Usable as a decorator.
+
+    The connection is held for the whole block, LLM calls included: the pool
+    (DB_POOL_SIZE + DB_MAX_OVERFLOW) bounds the blocks running at once, so wait for
+    locks before entering one.
+    """
+    if _connection.get() is not None:
+        yield
+        return
+
+    with db.connect() as connection:
+        token = _connection.set(connection)
+        try:
+            yield
+        finally:
+            _connection.reset(token)
+
+
+@asynccontextmanager
+async def aunit_of_work():
+    if _async_connection.get() is not None:
+        yield
+        return
+
+    async with async_db.connect() as connection:
+        token = _async_connection.set(connection)
+        try:
+            yield
+        finally:
+            _async_connection.reset(token)
+
+
+def create_detached_task(coro: Coroutine[Any, Any, _T]) -> asyncio.Task[_T]:
+    """
+    Task that runs outside of the unit of work, for work concurrent with it: a
+    connection can only serve one query at a time.
+    """
+    context = copy_context()
+    context.run(_async_connection.set, None)
+    # create_task copies the context it's called from (its `context` argument is 3.11+).
+    return context.run(asyncio.create_task, coro)
+
+
 redis = Redis(
     host=env.REDIS_HOST,
     port=env.REDIS_PORT,
     password=env.REDIS_PASSWORD,
     decode_responses=True,
 )
+async_redis = AsyncRedis(
+    host=env.REDIS_HOST,
+    port=env.REDIS_PORT,
+    password=env.REDIS_PASSWORD,
+    decode_responses=True,
+)
+# RQ stores pickled jobs, so its connection must not decode the responses.
+queue_redis = Redis(
+    host=env.REDIS_HOST,
+    port=env.REDIS_PORT,
+    password=env.REDIS_PASSWORD,
+)
+
+_set_ef_search = text("SELECT set_config('hnsw.ef_search', :ef_search, true)")
+
+
+def set_ef_search(session: SessionType, ef_search: int):
+    """
+    Size of the HNSW candidate list for the rest of the current transaction.
+    """
+    session.execute(_set_ef_search, {"ef_search": str(ef_search)})
+
+
+async def aset_ef_search(session: AsyncSessionType, ef_search: int):
+    await session.execute(_set_ef_search, {"ef_search": str(ef_search)})
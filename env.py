@@ -1,5 +1,6 @@
 import os
 from dotenv import load_dotenv
+from typing import Literal
 from pydantic import BaseModel
 
 
@@ -12,6 +13,10 @@ class Env(BaseModel):
     DB_PASSWORD: str
     DB_HOST: str
     DB_PORT: int
+    # Per engine: a turn holds a connection until it ends, so the pool size plus the
+    # overflow caps the in-flight turns of a process.
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 30
     OPENAI_API_KEY: str
     FPTSHOP_BASE_URL: str
     LITERAL_KEY: str
@@ -33,9 +38,60 @@ class Env(BaseModel):
     FB_API_URL: str
     FB_PAGE_ID: str
     FB_APP_ID: str
+    # Checks the X-Hub-Signature-256 of webhook deliveries when set.
+    FB_APP_SECRET: str = ""
     WANDB_API_KEY: str
     PROJECT_NAME: str
     WEAVE_DISABLED: bool
+    OPENAI_RPM: int = 500
+    OPENAI_TPM: int = 200000
+    OPENAI_MAX_CONNECTIONS: int = 50
+    OPENAI_CHAT_CONCURRENCY: int = 16
+    OPENAI_EMBEDDING_CONCURRENCY: int = 32
+    OPENAI_RATE_LIMIT_MAX_WAIT: float = 30
+    LLM_CACHE_TTL: int = 3600 * 24
+    LLM_CACHE_MAX_ENTRY_BYTES: int = 64 * 1024
+    LLM_CACHE_MAX_ENTRIES: int = 50_000
+    EMBEDDING_LRU_SIZE: int = 4096
+    EMBEDDING_CACHE_TTL: int = 3600 * 24 * 30
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_BATCH_WINDOW_MS: float = 5
+    # Embedding profile: text-embedding-3 dimensions and pgvector storage type.
+    EMBEDDING_DIMENSIONS: int = 1536
+    EMBEDDING_STORAGE: Literal["vector", "halfvec"] = "vector"
+    HNSW_EF_SEARCH_PRODUCT_NAME: int = 100
+    HNSW_EF_SEARCH_FAQ: int = 40
+    HNSW_EF_SEARCH_BRAND: int = 40
+    # Order of the prompt blocks, "legacy" keeps the static blocks after the conversation.
+    PROMPT_LAYOUT: Literal["legacy", "cache_friendly"] = "cache_friendly"
+    CATALOG_ENGINE_ENABLED: bool = False
+    CATALOG_ENGINE_TTL: int = 300
+    CATALOG_SNAPSHOT_DIR: str = "data/catalog"
+    # Detect the demand and collect the product requirements in one request.
+    COMBINED_REQUEST_ENABLED: bool = False
+    # Run collect_and_retrieval for the previous product type while detect_demand runs.
+    SPECULATIVE_COLLECT_ENABLED: bool = False
+    # Local demand classifier tried before the detect_demand LLM call.
+    DEMAND_CLASSIFIER_ENABLED: bool = False
+    DEMAND_CLASSIFIER_PATH: str = "data/demand_classifier.joblib"
+    DEMAND_CLASSIFIER_THRESHOLD: float = 0.9
+    SLOT_EXTRACTOR_ENABLED: bool = False
+    SLOT_EXTRACTOR_THRESHOLD: float = 0.9
+    # Conversation window: turns kept verbatim, older ones are folded into a summary.
+    CONTEXT_VERBATIM_TURNS: int = 4
+    CONTEXT_SUMMARY_BATCH_MESSAGES: int = 6
+    CONTEXT_SUMMARY_MAX_TOKENS: int = 300
+    CONTEXT_BUDGET_DETECT_DEMAND: int = 1200
+    CONTEXT_BUDGET_COLLECT_AND_RETRIEVAL: int = 600
+    CONTEXT_BUDGET_GENERATE_RESPONSE: int = 2500
+    # Write-through Redis copy of the per-turn thread state, Postgres stays the source.
+    THREAD_STATE_CACHE_ENABLED: bool = False
+    THREAD_STATE_MAX_MESSAGES: int = 40
+    # Acknowledge Messenger webhooks at once and run the turns on messenger_worker.py.
+    MESSENGER_QUEUE_ENABLED: bool = False
+    MESSENGER_QUEUE_SHARDS: int = 4
+    # Wait this long for a user's next message before answering, 0 answers at once.
+    MESSENGER_DEBOUNCE_SECONDS: float = 0
 
 
 env = Env.model_validate(os.environ)
@@ -8,7 +8,7 @@ from models.thread import ThreadModel
 from models.user import UserModel, UserRole
 from repositories.user import create as create_user, CreateUserModel
 from repositories.thread import create as create_thread, CreateThreadModel
-from service.store_chatbot_v2 import gen_answer
+from service.store_chatbot_v2 import gen_answer, fold_thread
 from service.openai import _client
 import random
 import math
@@ -783,12 +783,19 @@ class VietnameseUserSimulator(BaseModel):
             )
 
             evaluate_context = EvaluateContext()
+            history = self.get_reversed_role_in_conversation_history()
             assistant_response = gen_answer(
                 user_id=self.user.id,
                 thread_id=self.thread.id,
-                history=self.get_reversed_role_in_conversation_history(),
+                history=history,
                 evaluate_context=evaluate_context,
             )
+            # As the chat frontends do once the answer is sent.
+            fold_thread(
+                user_id=self.user.id,
+                thread_id=self.thread.id,
+                history=[*history, {"role": "assistant", "content": assistant_response}],
+            )
 
             self.conversation_history.append(
                 {
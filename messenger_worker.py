@@ -0,0 +1,22 @@
+from multiprocessing import Process
+from env import env
+from service.messenger_queue import run_worker
+
+"""
+Starts one worker per Messenger queue (MESSENGER_QUEUE_SHARDS of them) for the
+webhook events queued when MESSENGER_QUEUE_ENABLED is set. Each queue must have a
+single worker for a customer's messages to be answered in order, so run this once.
+
+How to run:
+python messenger_worker.py
+"""
+
+if __name__ == "__main__":
+    workers = [
+        Process(target=run_worker, args=(shard,))
+        for shard in range(env.MESSENGER_QUEUE_SHARDS)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -1,10 +1,9 @@
 from datetime import datetime, timezone
 from sqlalchemy.orm import mapped_column, Mapped, relationship
-from sqlalchemy import Text, DateTime, JSON, ForeignKey, String
+from sqlalchemy import Text, DateTime, JSON, ForeignKey, String, Float, BigInteger
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from pydantic import BaseModel, ConfigDict
-from pgvector.sqlalchemy import Vector
-from .base import Base
+from .base import Base, embedding_type
 from env import env
 from typing import List
 
@@ -28,9 +27,11 @@ class Accessory(Base):
     promotions: Mapped[list[dict]] = mapped_column(ARRAY(JSON), nullable=False)
     skus: Mapped[list[dict]] = mapped_column(ARRAY(JSON), nullable=False)
     key_selling_points: Mapped[list[dict]] = mapped_column(ARRAY(JSON), nullable=False)
-    price: Mapped[int] = mapped_column(Text, nullable=False)
-    score: Mapped[float] = mapped_column(Text, nullable=False)
-    name_embedding: Mapped[list[float]] = mapped_column(Vector, nullable=False)
+    price: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    score: Mapped[float] = mapped_column(Float, nullable=False)
+    name_embedding: Mapped[list[float]] = mapped_column(
+        embedding_type(), nullable=False
+    )
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.now(timezone.utc)
     )
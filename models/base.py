@@ -1,5 +1,17 @@
 from sqlalchemy.orm import DeclarativeBase
+from pgvector.sqlalchemy import HALFVEC, Vector
+from env import env
 
 
 class Base(DeclarativeBase):
     pass
+
+
+def embedding_type() -> Vector | HALFVEC:
+    """
+    Column type of the configured embedding profile. The database gets it from
+    tasks.apply_embedding_profile, the migrations leave the default one.
+    """
+    if env.EMBEDDING_STORAGE == "halfvec":
+        return HALFVEC(env.EMBEDDING_DIMENSIONS)
+    return Vector(env.EMBEDDING_DIMENSIONS)
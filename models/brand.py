@@ -1,9 +1,8 @@
-from .base import Base
+from .base import Base, embedding_type
 from datetime import datetime, timezone
 from sqlalchemy.orm import mapped_column, Mapped
 from sqlalchemy import DateTime, String
 from pydantic import BaseModel, ConfigDict
-from pgvector.sqlalchemy import Vector
 
 
 class Brand(Base):
@@ -11,7 +10,7 @@ class Brand(Base):
 
     id: Mapped[str] = mapped_column(String, primary_key=True, nullable=False)
     name: Mapped[str] = mapped_column(String, nullable=False)
-    embedding: Mapped[list[float]] = mapped_column(Vector, nullable=False)
+    embedding: Mapped[list[float]] = mapped_column(embedding_type(), nullable=False)
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.now(timezone.utc)
     )
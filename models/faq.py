@@ -1,10 +1,9 @@
-from .base import Base
+from .base import Base, embedding_type
 from datetime import datetime, timezone
 from sqlalchemy.orm import mapped_column, Mapped
 from sqlalchemy import DateTime, Text, Integer
 from sqlalchemy.dialects.postgresql import JSONB
 from pydantic import BaseModel, ConfigDict
-from pgvector.sqlalchemy import VECTOR
 
 
 class FAQ(Base):
@@ -15,7 +14,7 @@ class FAQ(Base):
     category: Mapped[str] = mapped_column(Text(), nullable=False)
     question: Mapped[str] = mapped_column(Text(), nullable=False)
     answer: Mapped[str] = mapped_column(Text(), nullable=False)
-    embedding: Mapped[list[float]] = mapped_column(VECTOR(), nullable=False)
+    embedding: Mapped[list[float]] = mapped_column(embedding_type(), nullable=False)
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.now(timezone.utc)
     )
@@ -1,10 +1,9 @@
-from .base import Base
+from .base import Base, embedding_type
 from datetime import datetime, timezone
 from sqlalchemy.orm import mapped_column, Mapped, relationship
-from sqlalchemy import Text, DateTime, JSON, Integer
+from sqlalchemy import Text, DateTime, JSON, Integer, Float
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from pydantic import BaseModel, ConfigDict
-from pgvector.sqlalchemy import Vector
 from env import env
 from typing import Optional, TYPE_CHECKING
 
@@ -40,8 +39,10 @@ class Laptop(Base):
 
     min_price: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     max_price: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
-    score: Mapped[float] = mapped_column(Text, nullable=False)
-    name_embedding: Mapped[list[float]] = mapped_column(Vector, nullable=False)
+    score: Mapped[float] = mapped_column(Float, nullable=False)
+    name_embedding: Mapped[list[float]] = mapped_column(
+        embedding_type(), nullable=False
+    )
 
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.now(timezone.utc)
@@ -2,12 +2,11 @@ from datetime import datetime, timezone
 from typing import Optional
 from unittest import result
 from sqlalchemy.orm import mapped_column, Mapped, relationship
-from sqlalchemy import ARRAY, DateTime, Integer, Text, JSON
+from sqlalchemy import ARRAY, DateTime, Integer, Text, JSON, Float
 from sqlalchemy.dialects.postgresql import JSONB
 from pydantic import BaseModel, ConfigDict
-from .base import Base
+from .base import Base, embedding_type
 from env import env
-from pgvector.sqlalchemy import Vector
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -41,8 +40,10 @@ class Phone(Base):
     key_selling_points: Mapped[list[dict]] = mapped_column(ARRAY(JSON), nullable=False)
     min_price: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     max_price: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
-    score: Mapped[float] = mapped_column(Text, nullable=False)
-    name_embedding: Mapped[list[float]] = mapped_column(Vector, nullable=False)
+    score: Mapped[float] = mapped_column(Float, nullable=False)
+    name_embedding: Mapped[list[float]] = mapped_column(
+        embedding_type(), nullable=False
+    )
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.now(timezone.utc)
     )
@@ -1,7 +1,8 @@
 from dataclasses import dataclass
 from enum import Enum
+from typing import Any
 import uuid
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, PrivateAttr
 from .base import Base
 from datetime import datetime, timezone
 from sqlalchemy.orm import mapped_column, Mapped
@@ -69,7 +70,9 @@ class UserMemory(Base):
         UUID(as_uuid=True), primary_key=True, nullable=False, default=uuid.uuid4
     )
     user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
-    thread_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    thread_id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True), nullable=False, index=True, unique=True
+    )
     user_demand: Mapped[UserDemand | None] = mapped_column(Text, nullable=True)
     product_name: Mapped[str | None] = mapped_column(Text, nullable=True)
     brand_code: Mapped[str | None] = mapped_column(Text, nullable=True)
@@ -91,6 +94,10 @@ class UserMemory(Base):
     consultation_status: Mapped[ConsultationStatus] = mapped_column(
         JSONB, nullable=False, server_default="{}"
     )
+    conversation_summary: Mapped[str | None] = mapped_column(Text, nullable=True)
+    summarized_message_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, server_default="0"
+    )
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.now(timezone.utc)
     )
@@ -122,6 +129,11 @@ class UpdateUserMemoryModel(BaseModel):
     rom: NumericConfiguration | None = None
 
 
+class UpdateConversationSummaryModel(BaseModel):
+    conversation_summary: str | None
+    summarized_message_count: int
+
+
 class UserMemoryModel(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
@@ -141,9 +153,35 @@ class UserMemoryModel(BaseModel):
     consultation_status: ConsultationStatus
     color: str | None = None
     rom: NumericConfiguration | None = None
+    conversation_summary: str | None = None
+    summarized_message_count: int = 0
 
     created_at: datetime
     updated_at: datetime
 
+    # Updatable fields as stored in the database, to write back only what changed.
+    # Nested fields are changed in place, hence a dump rather than setattr tracking.
+    _stored: dict[str, Any] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, __context: Any) -> None:
+        self.mark_stored()
+
+    def _updatable_values(self) -> dict[str, Any]:
+        return self.model_dump(include=set(UpdateUserMemoryModel.model_fields))
+
+    def mark_stored(self):
+        self._stored = self._updatable_values()
+
+    def dirty_fields(self) -> dict[str, Any]:
+        """
+        Updatable fields changed since the memory was read or last written, with their
+        values as `UpdateUserMemoryModel.model_dump` gives them.
+        """
+        return {
+            name: value
+            for name, value in self._updatable_values().items()
+            if name not in self._stored or self._stored[name] != value
+        }
+
     def has_contact_info(self) -> bool:
         return self.phone_number is not None
@@ -1,5 +1,5 @@
 from ast import stmt
-from db import Session
+from db import Session, set_ef_search
 from typing import Optional, List
 from models.accessory import CreateAccessoryModel, Accessory, AccessoryModel
 from sqlalchemy import Select, select, case
@@ -49,11 +49,27 @@ def upsert_accessory(data: CreateAccessoryModel) -> AccessoryModel:
         ).scalar_one()
         return AccessoryModel.model_validate(updated_accessory)
 
-def search(stmt: Select) -> List[AccessoryModel]:
+def search(stmt: Select, ef_search: Optional[int] = None) -> List[AccessoryModel]:
     with Session() as session:
+        if ef_search:
+            set_ef_search(session, ef_search)
         accessories = session.execute(stmt).scalars().all()
         return [AccessoryModel.model_validate(accessory) for accessory in accessories]
 
+
+def search_candidates(
+    stmt: Select, ef_search: Optional[int] = None
+) -> List[tuple[AccessoryModel, str, list]]:
+    with Session() as session:
+        if ef_search:
+            set_ef_search(session, ef_search)
+        rows = session.execute(stmt).all()
+        return [
+            (AccessoryModel.model_validate(accessory), bucket, sort_key)
+            for accessory, bucket, sort_key in rows
+        ]
+
+
 '''
 def search_accessory_by_filter(
     filter: AccessoryFilter,
@@ -1,8 +1,8 @@
 from typing import Optional
-from db import Session
+from db import Session, AsyncSession, set_ef_search, aset_ef_search
+from env import env
 from models.brand import CreateBrandModel, Brand, BrandModel
-from sqlalchemy import select
-from pgvector.sqlalchemy import Vector
+from sqlalchemy import Select, select
 
 
 def create_brand(data: CreateBrandModel) -> BrandModel:
@@ -41,23 +41,32 @@ def upsert_brand(data: CreateBrandModel) -> BrandModel:
         return BrandModel.model_validate(updated_Brand)
 
 
+def _semantic_statement(
+    brand_embedding: list[float], top_k: int, threshold: Optional[float]
+) -> Select:
+    # Same expression in ORDER BY and WHERE so the HNSW index serves both.
+    distance = Brand.embedding.cosine_distance(brand_embedding)
+    stmt = select(Brand).order_by(distance.asc()).limit(top_k)
+    if threshold:
+        stmt = stmt.where(distance < 1 - threshold)
+    return stmt
+
+
 def query_by_semantic(
     brand_embedding: list[float], top_k: int = 4, threshold: Optional[float] = None
 ) -> list[BrandModel]:
     with Session() as session:
-        stmt = (
-            select(Brand)
-            .order_by(
-                Brand.embedding.cast(Vector).cosine_distance(brand_embedding).asc()
-            )
-            .limit(top_k)
-        )
+        set_ef_search(session, env.HNSW_EF_SEARCH_BRAND)
+        stmt = _semantic_statement(brand_embedding, top_k, threshold)
+        brands = session.execute(stmt).scalars().all()
+        return [BrandModel.model_validate(brand) for brand in brands]
 
-        if threshold:
-            stmt = stmt.where(
-                Brand.embedding.cast(Vector).cosine_distance(brand_embedding)
-                < 1 - threshold
-            )
 
-        brands = session.execute(stmt).scalars().all()
+async def aquery_by_semantic(
+    brand_embedding: list[float], top_k: int = 4, threshold: Optional[float] = None
+) -> list[BrandModel]:
+    async with AsyncSession() as session:
+        await aset_ef_search(session, env.HNSW_EF_SEARCH_BRAND)
+        stmt = _semantic_statement(brand_embedding, top_k, threshold)
+        brands = (await session.execute(stmt)).scalars().all()
         return [BrandModel.model_validate(brand) for brand in brands]
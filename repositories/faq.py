@@ -1,8 +1,8 @@
 from typing import Optional
-from db import Session
+from db import Session, AsyncSession, set_ef_search, aset_ef_search
+from env import env
 from models.faq import CreateFAQModel, FAQ, FAQModel, UpdateFAQModel
-from sqlalchemy import select, update as sql_update
-from pgvector.sqlalchemy import Vector
+from sqlalchemy import Select, select, update as sql_update
 
 
 def create(data: CreateFAQModel) -> FAQModel:
@@ -42,28 +42,39 @@ def upsert(data: CreateFAQModel) -> FAQModel:
         return create(data)
 
 
+def _semantic_statement(
+    question_embedding: list[float], top_k: int, threshold: Optional[float]
+) -> Select:
+    # Same expression in ORDER BY and WHERE so the HNSW index serves both.
+    distance = FAQ.embedding.cosine_distance(question_embedding)
+    stmt = select(FAQ).order_by(distance.asc()).limit(top_k)
+    if threshold:
+        stmt = stmt.where(distance < 1 - threshold)
+    return stmt
+
+
 def search_by_semantic(
     question_embedding: list[float], top_k: int = 4, threshold: Optional[float] = None
 ) -> list[FAQModel]:
     with Session() as session:
-        stmt = (
-            select(FAQ)
-            .order_by(
-                FAQ.embedding.cast(Vector).cosine_distance(question_embedding).asc()
-            )
-            .limit(top_k)
-        )
-        if threshold:
-            stmt = stmt.where(
-                FAQ.embedding.cast(Vector).cosine_distance(question_embedding)
-                < 1 - threshold
-            )
-
+        set_ef_search(session, env.HNSW_EF_SEARCH_FAQ)
+        stmt = _semantic_statement(question_embedding, top_k, threshold)
         faqs = session.execute(stmt).scalars().all()
 
         return [FAQModel.model_validate(faq) for faq in faqs]
 
 
+async def asearch_by_semantic(
+    question_embedding: list[float], top_k: int = 4, threshold: Optional[float] = None
+) -> list[FAQModel]:
+    async with AsyncSession() as session:
+        await aset_ef_search(session, env.HNSW_EF_SEARCH_FAQ)
+        stmt = _semantic_statement(question_embedding, top_k, threshold)
+        faqs = (await session.execute(stmt)).scalars().all()
+
+        return [FAQModel.model_validate(faq) for faq in faqs]
+
+
 def get_all() -> list[FAQModel]:
     with Session() as session:
         stmt = select(FAQ)
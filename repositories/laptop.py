@@ -1,4 +1,4 @@
-from db import Session
+from db import Session, AsyncSession, set_ef_search, aset_ef_search
 from typing import Optional, List
 from models.laptop import CreateLaptopModel, Laptop, LaptopModel
 from sqlalchemy import Select, select, case, update as sql_update
@@ -22,6 +22,12 @@ def get_laptop(laptop_id: str) -> Optional[LaptopModel]:
         return LaptopModel.model_validate(laptop) if laptop else None
 
 
+async def aget_laptop(laptop_id: str) -> Optional[LaptopModel]:
+    async with AsyncSession() as session:
+        laptop = await session.get(Laptop, laptop_id)
+        return LaptopModel.model_validate(laptop) if laptop else None
+
+
 def update_laptop(data: CreateLaptopModel) -> int:
     with Session() as session:
         update_info = data.model_dump()
@@ -44,12 +50,50 @@ def upsert_laptop(data: CreateLaptopModel) -> LaptopModel:
         return LaptopModel.model_validate(updated_laptop)
 
 
-def search(stmt: Select) -> List[LaptopModel]:
+def search(stmt: Select, ef_search: Optional[int] = None) -> List[LaptopModel]:
     with Session() as session:
+        if ef_search:
+            set_ef_search(session, ef_search)
         laptops = session.execute(stmt).scalars().all()
         return [LaptopModel.model_validate(laptop) for laptop in laptops]
 
 
+async def asearch(
+    stmt: Select, ef_search: Optional[int] = None
+) -> List[LaptopModel]:
+    async with AsyncSession() as session:
+        if ef_search:
+            await aset_ef_search(session, ef_search)
+        laptops = (await session.execute(stmt)).scalars().all()
+        return [LaptopModel.model_validate(laptop) for laptop in laptops]
+
+
+def search_candidates(
+    stmt: Select, ef_search: Optional[int] = None
+) -> List[tuple[LaptopModel, str, list]]:
+    with Session() as session:
+        if ef_search:
+            set_ef_search(session, ef_search)
+        rows = session.execute(stmt).all()
+        return [
+            (LaptopModel.model_validate(laptop), bucket, sort_key)
+            for laptop, bucket, sort_key in rows
+        ]
+
+
+async def asearch_candidates(
+    stmt: Select, ef_search: Optional[int] = None
+) -> List[tuple[LaptopModel, str, list]]:
+    async with AsyncSession() as session:
+        if ef_search:
+            await aset_ef_search(session, ef_search)
+        rows = (await session.execute(stmt)).all()
+        return [
+            (LaptopModel.model_validate(laptop), bucket, sort_key)
+            for laptop, bucket, sort_key in rows
+        ]
+
+
 def search_laptop_by_laptop_name(
     laptop_name: str, top_k: int = 4, threshold: Optional[float] = None
 ) -> List[LaptopModel]:
@@ -1,5 +1,5 @@
 from uuid import UUID
-from db import Session
+from db import Session, AsyncSession
 from models.message import CreateMessageModel, Message, MessageModel, UpdateMessageModel
 from sqlalchemy import select, update as sql_update
 
@@ -14,6 +14,16 @@ def create(data: CreateMessageModel) -> MessageModel:
         return MessageModel.model_validate(message)
 
 
+async def acreate(data: CreateMessageModel) -> MessageModel:
+    async with AsyncSession() as session:
+        message = Message(**data.model_dump())
+
+        session.add(message)
+        await session.commit()
+
+        return MessageModel.model_validate(message)
+
+
 def update(id: UUID, data: UpdateMessageModel) -> MessageModel:
     with Session() as session:
         stmt = (
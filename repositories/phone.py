@@ -1,5 +1,5 @@
 from ast import stmt
-from db import Session
+from db import Session, AsyncSession, set_ef_search, aset_ef_search
 from typing import Optional, List
 from models.phone import CreatePhoneModel, Phone, PhoneModel
 from sqlalchemy import Select, select, case
@@ -28,6 +28,15 @@ def get_phone(phone_id: str) -> Optional[PhoneModel]:
         return PhoneModel.model_validate(phone)
 
 
+async def aget_phone(phone_id: str) -> Optional[PhoneModel]:
+    async with AsyncSession() as session:
+        phone = await session.get(Phone, phone_id)
+        if phone is None:
+            return None
+
+        return PhoneModel.model_validate(phone)
+
+
 def update_phone(data: CreatePhoneModel) -> int:
     with Session() as session:
         update_info = data.model_dump()
@@ -100,12 +109,50 @@ def search_phone_by_phone_name(
         return [PhoneModel.model_validate(phone) for phone in phones]
 
 
-def search(stmt: Select) -> List[PhoneModel]:
+def search(stmt: Select, ef_search: Optional[int] = None) -> List[PhoneModel]:
     with Session() as session:
+        if ef_search:
+            set_ef_search(session, ef_search)
         phones = session.execute(stmt).scalars().all()
         return [PhoneModel.model_validate(phone) for phone in phones]
 
 
+async def asearch(
+    stmt: Select, ef_search: Optional[int] = None
+) -> List[PhoneModel]:
+    async with AsyncSession() as session:
+        if ef_search:
+            await aset_ef_search(session, ef_search)
+        phones = (await session.execute(stmt)).scalars().all()
+        return [PhoneModel.model_validate(phone) for phone in phones]
+
+
+def search_candidates(
+    stmt: Select, ef_search: Optional[int] = None
+) -> List[tuple[PhoneModel, str, list]]:
+    with Session() as session:
+        if ef_search:
+            set_ef_search(session, ef_search)
+        rows = session.execute(stmt).all()
+        return [
+            (PhoneModel.model_validate(phone), bucket, sort_key)
+            for phone, bucket, sort_key in rows
+        ]
+
+
+async def asearch_candidates(
+    stmt: Select, ef_search: Optional[int] = None
+) -> List[tuple[PhoneModel, str, list]]:
+    async with AsyncSession() as session:
+        if ef_search:
+            await aset_ef_search(session, ef_search)
+        rows = (await session.execute(stmt)).all()
+        return [
+            (PhoneModel.model_validate(phone), bucket, sort_key)
+            for phone, bucket, sort_key in rows
+        ]
+
+
 def get_all_ids() -> list[str]:
     with Session() as session:
         phone_ids = session.execute(select(Phone.id)).scalars().unique().all()
@@ -1,4 +1,7 @@
-from db import redis
+from typing import Callable, Optional
+from db import redis, async_redis
+from redis.client import Pipeline
+from redis.lock import Lock
 from redis.typing import EncodableT, ResponseT
 
 
@@ -8,3 +11,103 @@ def get_value(key: str) -> ResponseT:
 
 def set_value(key: str, value: EncodableT, expire_time: int = 3600 * 24):
     redis.set(key, value, ex=expire_time)
+
+
+def set_value_if_absent(
+    key: str, value: EncodableT, expire_time: int = 3600 * 24
+) -> bool:
+    """
+    Sets the key only when it doesn't exist, returns whether it did.
+    """
+    return bool(redis.set(key, value, ex=expire_time, nx=True))
+
+
+def delete_value(key: str):
+    redis.delete(key)
+
+
+async def aget_value(key: str) -> ResponseT:
+    return await async_redis.get(key)
+
+
+async def aset_value(key: str, value: EncodableT, expire_time: int = 3600 * 24):
+    await async_redis.set(key, value, ex=expire_time)
+
+
+def increment_value(key: str, expire_time: int = 3600 * 24) -> int:
+    pipeline = redis.pipeline()
+    pipeline.incr(key)
+    pipeline.expire(key, expire_time)
+    return pipeline.execute()[0]
+
+
+def get_lock(key: str, timeout: float, blocking_timeout: float) -> Lock:
+    """
+    Lock expiring after `timeout` seconds, `acquire` waits for it at most
+    `blocking_timeout` seconds.
+    """
+    return redis.lock(key, timeout=timeout, blocking_timeout=blocking_timeout)
+
+
+def get_values(keys: list[str]) -> list:
+    return redis.mget(keys)
+
+
+def set_values(values: dict[str, EncodableT], expire_time: int = 3600 * 24):
+    pipeline = redis.pipeline()
+    for key, value in values.items():
+        pipeline.set(key, value, ex=expire_time)
+    pipeline.execute()
+
+
+def update_value(
+    key: str,
+    update: Callable[[ResponseT], Optional[EncodableT]],
+    expire_time: int = 3600 * 24,
+):
+    """
+    Sets the key to `update` of its current value, retried if the key changes in
+    between. Nothing is written when `update` returns None.
+    """
+
+    def _update(pipeline: Pipeline):
+        value = update(pipeline.get(key))
+        if value is None:
+            return
+        pipeline.multi()
+        pipeline.set(key, value, ex=expire_time)
+
+    redis.transaction(_update, key)
+
+
+def set_value_if_unchanged(
+    key: str,
+    value: EncodableT,
+    watched_key: str,
+    expected: Optional[str],
+    expire_time: int = 3600 * 24,
+) -> bool:
+    """
+    Sets the key unless `watched_key` no longer holds `expected`, checked atomically
+    with the write. Returns whether it was set.
+    """
+
+    def _set(pipeline: Pipeline) -> bool:
+        if pipeline.get(watched_key) != expected:
+            return False
+        pipeline.multi()
+        pipeline.set(key, value, ex=expire_time)
+        return True
+
+    return redis.transaction(_set, watched_key, value_from_callable=True)
+
+
+async def aget_values(keys: list[str]) -> list:
+    return await async_redis.mget(keys)
+
+
+async def aset_values(values: dict[str, EncodableT], expire_time: int = 3600 * 24):
+    pipeline = async_redis.pipeline()
+    for key, value in values.items():
+        pipeline.set(key, value, ex=expire_time)
+    await pipeline.execute()
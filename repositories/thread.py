@@ -4,7 +4,7 @@ from models.thread import (
     Thread,
     ThreadModel,
 )
-from db import Session
+from db import Session, AsyncSession
 
 
 def create(data: CreateThreadModel) -> ThreadModel:
@@ -17,6 +17,17 @@ def create(data: CreateThreadModel) -> ThreadModel:
         return ThreadModel.model_validate(thread)
 
 
+async def acreate(data: CreateThreadModel) -> ThreadModel:
+    async with AsyncSession() as session:
+        thread = Thread(**data.model_dump())
+
+        session.add(thread)
+        await session.commit()
+        await session.refresh(thread)
+
+        return ThreadModel.model_validate(thread)
+
+
 def get(id: UUID) -> ThreadModel | None:
     with Session() as session:
         thread = session.get(Thread, id)
@@ -26,6 +37,15 @@ def get(id: UUID) -> ThreadModel | None:
         return ThreadModel.model_validate(thread)
 
 
+async def aget(id: UUID) -> ThreadModel | None:
+    async with AsyncSession() as session:
+        thread = await session.get(Thread, id)
+        if thread is None:
+            return None
+
+        return ThreadModel.model_validate(thread)
+
+
 def get_all() -> list[ThreadModel]:
     with Session() as session:
         threads = session.query(Thread).order_by(Thread.created_at.desc()).all()
@@ -1,5 +1,5 @@
 from uuid import UUID
-from db import Session
+from db import Session, AsyncSession
 from typing import Optional, List
 from models.user import CreateUserModel, User, UserModel, UserRole, UpdateUserModel
 from sqlalchemy import select, case
@@ -59,6 +59,15 @@ def get(id: UUID) -> Optional[UserModel]:
         return UserModel.model_validate(user)
 
 
+async def aget(id: UUID) -> Optional[UserModel]:
+    async with AsyncSession() as session:
+        user = await session.get(User, id)
+        if user is None:
+            return None
+
+        return UserModel.model_validate(user)
+
+
 def get_by_fb_user_id(fb_user_id: str) -> Optional[UserModel]:
     with Session() as session:
         stmt = (
@@ -1,11 +1,13 @@
 from models.user_memory import (
     UpdateUserMemoryModel,
+    UpdateConversationSummaryModel,
     UserMemory,
     CreateUserMemoryModel,
     UserMemoryModel,
 )
-from db import Session
+from db import Session, AsyncSession
 from sqlalchemy import select, update as sql_update
+from sqlalchemy.dialects.postgresql import insert
 import uuid
 
 
@@ -19,6 +21,34 @@ def create(data: CreateUserMemoryModel) -> UserMemoryModel:
         return UserMemoryModel.model_validate(user_memory)
 
 
+def _get_or_create_statement(data: CreateUserMemoryModel):
+    # Nothing is written or locked when the thread already has its row: RETURNING
+    # then gives back no row and the row is selected instead.
+    return (
+        insert(UserMemory)
+        .values(**data.model_dump())
+        .on_conflict_do_nothing(index_elements=[UserMemory.thread_id])
+        .returning(UserMemory)
+    )
+
+
+def _by_thread_id_statement(thread_id: uuid.UUID):
+    return select(UserMemory).where(UserMemory.thread_id == thread_id)
+
+
+def get_or_create(data: CreateUserMemoryModel) -> UserMemoryModel:
+    with Session() as session:
+        user_memory = session.execute(
+            _get_or_create_statement(data)
+        ).scalar_one_or_none()
+        if user_memory is None:
+            user_memory = session.execute(
+                _by_thread_id_statement(data.thread_id)
+            ).scalar_one()
+        session.commit()
+        return UserMemoryModel.model_validate(user_memory)
+
+
 def get_by_thread_id(thread_id: uuid.UUID) -> UserMemoryModel | None:
     with Session() as session:
         user_memory = session.execute(
@@ -46,3 +76,121 @@ def update(id: uuid.UUID, data: UpdateUserMemoryModel) -> UserMemoryModel:
         updated_user_memory = session.execute(stmt).scalar_one()
         session.commit()
         return UserMemoryModel.model_validate(updated_user_memory)
+
+
+def save(user_memory: UserMemoryModel) -> UserMemoryModel:
+    """
+    Writes only the fields of the memory that changed since it was read or last saved,
+    without a round trip when none did.
+    """
+    values = user_memory.dirty_fields()
+    if not values:
+        return user_memory
+
+    with Session() as session:
+        session.execute(
+            sql_update(UserMemory)
+            .where(UserMemory.id == user_memory.id)
+            .values(**values)
+        )
+        session.commit()
+
+    user_memory.mark_stored()
+    return user_memory
+
+
+def update_conversation_summary(
+    id: uuid.UUID, data: UpdateConversationSummaryModel
+) -> UserMemoryModel:
+    # Kept apart from `update` so the turn's memory update never overwrites a
+    # summary folded in the meantime.
+    with Session() as session:
+        stmt = (
+            sql_update(UserMemory)
+            .where(UserMemory.id == id)
+            .values(**data.model_dump())
+            .returning(UserMemory)
+        )
+        updated_user_memory = session.execute(stmt).scalar_one()
+        session.commit()
+        return UserMemoryModel.model_validate(updated_user_memory)
+
+
+async def acreate(data: CreateUserMemoryModel) -> UserMemoryModel:
+    async with AsyncSession() as session:
+        user_memory = UserMemory(**data.model_dump())
+
+        session.add(user_memory)
+        await session.commit()
+        await session.refresh(user_memory)
+
+        return UserMemoryModel.model_validate(user_memory)
+
+
+async def aget_or_create(data: CreateUserMemoryModel) -> UserMemoryModel:
+    async with AsyncSession() as session:
+        user_memory = (
+            await session.execute(_get_or_create_statement(data))
+        ).scalar_one_or_none()
+        if user_memory is None:
+            user_memory = (
+                await session.execute(_by_thread_id_statement(data.thread_id))
+            ).scalar_one()
+        await session.commit()
+        return UserMemoryModel.model_validate(user_memory)
+
+
+async def aget_by_thread_id(thread_id: uuid.UUID) -> UserMemoryModel | None:
+    async with AsyncSession() as session:
+        user_memory = (
+            await session.execute(
+                select(UserMemory).where(UserMemory.thread_id == thread_id)
+            )
+        ).scalar_one_or_none()
+
+        return UserMemoryModel.model_validate(user_memory) if user_memory else None
+
+
+async def aupdate(id: uuid.UUID, data: UpdateUserMemoryModel) -> UserMemoryModel:
+    async with AsyncSession() as session:
+        stmt = (
+            sql_update(UserMemory)
+            .where(UserMemory.id == id)
+            .values(**data.model_dump())
+            .returning(UserMemory)
+        )
+        updated_user_memory = (await session.execute(stmt)).scalar_one()
+        await session.commit()
+        return UserMemoryModel.model_validate(updated_user_memory)
+
+
+async def asave(user_memory: UserMemoryModel) -> UserMemoryModel:
+    values = user_memory.dirty_fields()
+    if not values:
+        return user_memory
+
+    async with AsyncSession() as session:
+        await session.execute(
+            sql_update(UserMemory)
+            .where(UserMemory.id == user_memory.id)
+            .values(**values)
+        )
+        await session.commit()
+
+    user_memory.mark_stored()
+    return user_memory
+
+
+async def aupdate_conversation_summary(
+    id: uuid.UUID, data: UpdateConversationSummaryModel
+) -> UserMemoryModel:
+    async with AsyncSession() as session:
+        stmt = (
+            sql_update(UserMemory)
+            .where(UserMemory.id == id)
+            .values(**data.model_dump())
+            .returning(UserMemory)
+        )
+        updated_user_memory = (await session.execute(stmt)).scalar_one()
+        await session.commit()
+        return UserMemoryModel.model_validate(updated_user_memory)
@@ -1,14 +1,26 @@
 from enum import Enum
 from pydantic import BaseModel, ConfigDict, field_validator
-from sqlalchemy import Select, select, true, case, func, literal
+from sqlalchemy import Select, select, true, case, func, literal, tuple_
 from models.accessory import Accessory, AccessoryModel  
 from sqlalchemy.sql.expression import and_
 from sqlalchemy.sql.operators import OperatorType, ge, le, eq
 from sqlalchemy.sql.elements import ColumnElement
 from typing import Any, Generic, TypeVar
-from repositories.accessory import search as search_accessory  
-from service.embedding import get_embedding
-from pgvector.sqlalchemy import Vector
+from repositories.accessory import (
+    search as search_accessory,
+    search_candidates as search_accessory_candidates,
+)
+from service.candidates import (
+    Candidates,
+    from_rows as to_candidates,
+    to_statement as to_candidates_statement,
+)
+from service.embedding import get_embedding, with_prefix, ACCESSORY_NAME_PREFIX
+from service.catalog import (
+    search_accessories as catalog_search,
+    search_accessory_candidates as catalog_search_candidates,
+)
+from env import env
 import weave
 _T = TypeVar("_T")
 
@@ -70,7 +82,8 @@ class FilterType(str, Enum):
 class Config(BaseModel):
     threshold: float = 0.75
     limit: int = 4
-    offset: int = 0
+    # Sort key of the last row already listed, the page starts after it.
+    after: list[Any] | None = None
     is_recommending: bool = False
     recommend_priority: list[FilterType] = [
         FilterType.PRODUCT_TYPE,
@@ -88,6 +101,13 @@ class AccessoryFilter(BaseModel):
     name: str | None = None
     product_type: str | None = None  # loại phụ kiện (tai nghe, sạc, ốp lưng...)
 
+    def _name_text(self) -> str:
+        # The same prefix as the stored name embeddings, see import_accessory_data.
+        return with_prefix(ACCESSORY_NAME_PREFIX, self.name or "")
+
+    def name_embedding(self) -> list[float] | None:
+        return get_embedding(self._name_text()) if self.name else None
+
     def get_price_condition_expression(self) -> ColumnElement[bool]:
         filters = []
         if self.min_price:
@@ -135,9 +155,9 @@ class AccessoryFilter(BaseModel):
         if not self.name:
             return true()
 
-        embedding = get_embedding(self.name)
+        embedding = get_embedding(self._name_text())
         filters = FilterAttribute(
-            column=Accessory.name_embedding.cast(Vector).cosine_distance(embedding),
+            column=Accessory.name_embedding.cosine_distance(embedding),
             operator=le,
             value=1 - self.config.threshold,
         )
@@ -179,36 +199,88 @@ class AccessoryFilter(BaseModel):
 
         return score
 
-    def order_by_expressions(self) -> list[ColumnElement]:
-        is_recommending = self.config.is_recommending
-
+    def sort_key_expressions(self) -> list[ColumnElement]:
+        """
+        What the results are ranked by, the id last so that the order is total and a
+        page can start right after the last row of the previous one.
+        """
         if self.name:
             return [
-                Accessory.name_embedding.cast(Vector)
-                .cosine_distance(get_embedding(self.name))
-                .asc(),
+                Accessory.name_embedding.cosine_distance(
+                    get_embedding(self._name_text())
+                ),
+                Accessory.id,
             ] # khi cung cấp name , search accessory tương tự dựa trên consine distance
 
-        if is_recommending: # chế độ đề xuất
+        if self.config.is_recommending: # chế độ đề xuất
             return [
-                self.score_expression().desc(),
-                Accessory.score.expression.desc(),
-            ] # bỏ qua các điều kiện lọc thông thường , dùng expression score để tính điểm ưu tiên dựa trên recommend_priority
+                self.score_expression(),
+                Accessory.score.expression,
+                Accessory.id,
+            ] # dùng expression score để tính điểm ưu tiên dựa trên recommend_priority
+
+        return [Accessory.score.expression, Accessory.id] # chỉ lọc theo điểm score
+
+    def is_descending(self) -> bool:
+        # Names are ranked by ascending distance, the rest by descending score.
+        return not self.name
+
+    def order_by_expressions(self) -> list[ColumnElement]:
+        # The whole sort key, the id breaking ties of equal distances or scores, in
+        # the order `after_condition_expression` compares it.
+        sort_keys = self.sort_key_expressions()
+        if not self.is_descending():
+            if self.config.after is None:
+                # The HNSW index only serves an ORDER BY on the distance alone, kept
+                # for the first page of a name search. Rows at exactly the distance
+                # of its last row may then be skipped by the next page.
+                return [sort_keys[0].asc()]
+            return [sort_key.asc() for sort_key in sort_keys]
+        return [sort_key.desc() for sort_key in sort_keys]
+
+    def after_condition_expression(self) -> ColumnElement[bool]:
+        if self.config.after is None:
+            return true()
+
+        sort_key = tuple_(*self.sort_key_expressions())
+        after = tuple_(*(literal(value) for value in self.config.after))
+        return sort_key < after if self.is_descending() else sort_key > after
 
-        return [Accessory.score.expression.desc()] # chỉ lọc theo điểm scor
+    def ef_search(self) -> int | None:
+        # Only the first page of a name search walks the HNSW index, the next ones
+        # compare exact distances with the cursor.
+        if self.name and self.config.after is None:
+            return env.HNSW_EF_SEARCH_PRODUCT_NAME
+        return None
 
     def to_statement(self) -> Select:
         stmt = (
             select(Accessory)
-            .where(self.condition_expression())
+            .where(self.condition_expression() & self.after_condition_expression())
             .order_by(*self.order_by_expressions())
             .limit(self.config.limit)
-            .offset(self.config.offset)
         )
 
         return stmt
 
 @weave.op(name="search_accessory")
 def search(filter: AccessoryFilter) -> list[AccessoryModel]:
+    if env.CATALOG_ENGINE_ENABLED:
+        return catalog_search(filter)
     stmt = filter.to_statement()
-    return search_accessory(stmt)
\ No newline at end of file
+    return search_accessory(stmt, ef_search=filter.ef_search())
+
+
+@weave.op(name="search_accessory_candidates")
+def search_candidates(filter: AccessoryFilter) -> Candidates[AccessoryModel]:
+    """
+    The exact page after the filter's cursor and, for when it is empty, the first
+    recommendation page, in one round trip. A recommending filter only gets the
+    recommendation page.
+    """
+    if env.CATALOG_ENGINE_ENABLED:
+        return catalog_search_candidates(filter)
+    stmt = to_candidates_statement(Accessory, filter)
+    return to_candidates(
+        filter, search_accessory_candidates(stmt, ef_search=filter.ef_search())
+    )
@@ -0,0 +1,116 @@
+import hashlib
+from typing import Any, Generic, Sequence, TypeVar
+from pydantic import BaseModel
+from sqlalchemy import JSON, Select, exists, func, literal, select, union_all
+from sqlalchemy.orm import aliased
+from service.page_cursor import PageCursor
+
+_T = TypeVar("_T")
+
+EXACT = "exact"
+RECOMMENDATION = "recommendation"
+
+
+class Candidates(BaseModel, Generic[_T]):
+    """
+    Everything a consultation turn needs from the catalog: the exact matches after the
+    cursor and, when there are none, the recommendations to fall back to.
+    """
+
+    page: list[_T] = []
+    recommendations: list[_T] = []
+    # Bounds of whichever list is not empty, kept to list the same page or the next.
+    cursor: PageCursor = PageCursor()
+
+
+def with_config(filter: Any, **update) -> Any:
+    """
+    Copy of a phone, laptop or accessory filter with some config fields changed. The
+    copy shares the filter's embedding cache.
+    """
+    return filter.model_copy(update={"config": filter.config.model_copy(update=update)})
+
+
+def listing_key(filter: Any) -> str:
+    """
+    The list a filter pages through: its conditions and its sort, whatever the page's
+    start and length.
+    """
+    data = filter.model_dump_json(exclude={"config": {"after", "limit"}})
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def from_cursor(filter: Any, cursor: PageCursor) -> Any:
+    """
+    The filter starting at the cursor, or at the top of its list when the cursor comes
+    from another list.
+    """
+    if cursor.listing != listing_key(filter):
+        return with_config(filter, after=None)
+    return with_config(filter, after=cursor.start)
+
+
+def page_cursor(filter: Any, last_sort_key: list[Any] | None) -> PageCursor:
+    return PageCursor(
+        listing=listing_key(filter), start=filter.config.after, end=last_sort_key
+    )
+
+
+def recommendation_filter(filter: Any) -> Any:
+    """
+    The filter listing recommendations: from its cursor when it already recommends,
+    from the top when it falls back from the exact matches.
+    """
+    if filter.config.is_recommending:
+        return filter
+    return with_config(filter, is_recommending=True, after=None)
+
+
+def _with_sort_key(filter: Any, bucket: str) -> Select:
+    return filter.to_statement().add_columns(
+        literal(bucket).label("bucket"),
+        func.row_number()
+        .over(order_by=filter.order_by_expressions())
+        .label("position"),
+        func.json_build_array(*filter.sort_key_expressions(), type_=JSON).label(
+            "sort_key"
+        ),
+    )
+
+
+def to_statement(entity: Any, filter: Any) -> Select:
+    """
+    The page of the filter and, when it doesn't recommend and that page is empty, the
+    first recommendation page, in one statement. Recommendations leave out the exact
+    matches, which the user has already been shown. Rows are (entity, bucket,
+    sort_key), exact ones first.
+    """
+    exact = with_config(filter, is_recommending=False)
+    recommendation_page = _with_sort_key(
+        recommendation_filter(filter), RECOMMENDATION
+    ).where(~exact.condition_expression())
+
+    if filter.config.is_recommending:
+        rows = recommendation_page.subquery()
+    else:
+        exact_page = _with_sort_key(exact, EXACT).cte("exact_page")
+        rows = union_all(
+            select(exact_page),
+            recommendation_page.where(~exists(select(exact_page.c.id))),
+        ).subquery()
+
+    return select(aliased(entity, rows), rows.c.bucket, rows.c.sort_key).order_by(
+        rows.c.bucket, rows.c.position
+    )
+
+
+def from_rows(filter: Any, rows: Sequence[tuple[_T, str, list[Any]]]) -> Candidates[_T]:
+    candidates: Candidates[_T] = Candidates()
+    for item, bucket, sort_key in rows:
+        if bucket == EXACT:
+            candidates.page.append(item)
+            candidates.cursor = page_cursor(filter, sort_key)
+        else:
+            candidates.recommendations.append(item)
+            candidates.cursor = page_cursor(recommendation_filter(filter), sort_key)
+    return candidates
@@ -0,0 +1,662 @@
+import asyncio
+import json
+import os
+import re
+import shutil
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from time import monotonic
+from typing import TYPE_CHECKING, Any, Callable, Sequence
+import numpy as np
+from pydantic import BaseModel
+from sqlalchemy import select
+from db import Session
+from env import env
+from models.phone import Phone, PhoneModel
+from models.phone_variant import PhoneVariant
+from models.laptop import Laptop, LaptopModel
+from models.laptop_variant import LaptopVariant
+from models.accessory import Accessory, AccessoryModel
+from models.user_memory import NumericConfiguration
+from service.candidates import Candidates, page_cursor, recommendation_filter
+
+if TYPE_CHECKING:
+    from service.phone import PhoneFilter, Config
+    from service.laptop import LaptopFilter
+    from service.accessory import AccessoryFilter
+
+PHONE = "phone"
+LAPTOP = "laptop"
+ACCESSORY = "accessory"
+
+
+@dataclass
+class CatalogSnapshot:
+    """
+    Column arrays of one product table, row i of every array describes items[i].
+    """
+
+    items: Sequence[BaseModel]
+    ids: np.ndarray
+    brand_codes: np.ndarray
+    product_types: np.ndarray
+    min_prices: np.ndarray
+    max_prices: np.ndarray
+    scores: np.ndarray
+    # (rows, dimensions), L2-normalized so a dot product is the cosine similarity.
+    embeddings: np.ndarray
+    # One entry per variant row, pointing at the row of its product.
+    variant_owners: np.ndarray
+    variant_roms: np.ndarray
+    variant_colors: np.ndarray
+    loaded_at: float = field(default_factory=monotonic)
+    # Version of the snapshot files the arrays are mapped from, None when the
+    # snapshot was loaded from Postgres.
+    version: str | None = None
+    # Rank of each id in string order, to sort on the id with numbers.
+    id_ranks: np.ndarray = field(init=False)
+
+    def __post_init__(self):
+        self.id_ranks = np.argsort(np.argsort(self.ids, kind="stable"))
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+def normalize_color(text: str) -> str:
+    # Same tokens as to_tsvector('vietnamese_simple_unaccent', ...): lowercased,
+    # accents stripped and split on anything that is not a letter or a digit.
+    text = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _to_vector(value: Any) -> np.ndarray:
+    # halfvec columns are returned as HalfVector, vector columns as numpy arrays.
+    if hasattr(value, "to_numpy"):
+        value = value.to_numpy()
+    return np.asarray(value, dtype=np.float32)
+
+
+def _variant_columns(variants: list[dict]) -> tuple[float, str]:
+    rom = np.nan
+    colors = []
+    for variant in variants:
+        if variant.get("propertyName") == "rom" and np.isnan(rom):
+            rom = _to_float(variant.get("value"))
+        elif variant.get("propertyName") == "color":
+            colors.append(str(variant.get("value", "")))
+    # Padded with spaces so a phrase only matches whole tokens.
+    return rom, f" {normalize_color(' '.join(colors))} "
+
+
+def _build_snapshot(
+    products: Sequence[Any],
+    to_model: Callable[[Any], BaseModel],
+    prices: Callable[[Any], tuple[float, float]],
+    variants: Sequence[tuple[str, list[dict]]] = (),
+) -> CatalogSnapshot:
+    rows = {product.id: i for i, product in enumerate(products)}
+
+    embeddings = np.zeros((len(products), env.EMBEDDING_DIMENSIONS), dtype=np.float32)
+    for i, product in enumerate(products):
+        embeddings[i] = _to_vector(product.name_embedding)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings /= np.where(norms == 0, 1, norms)
+
+    variant_owners, variant_roms, variant_colors = [], [], []
+    for product_id, values in variants:
+        if product_id not in rows:
+            continue
+        rom, colors = _variant_columns(values or [])
+        variant_owners.append(rows[product_id])
+        variant_roms.append(rom)
+        variant_colors.append(colors)
+
+    price_ranges = [prices(product) for product in products]
+    return CatalogSnapshot(
+        items=[to_model(product) for product in products],
+        ids=np.array([p.id for p in products], dtype=np.str_),
+        brand_codes=np.array([p.brand_code for p in products], dtype=np.str_),
+        product_types=np.array([p.product_type for p in products], dtype=np.str_),
+        min_prices=np.array([low for low, _ in price_ranges], dtype=np.float64),
+        max_prices=np.array([high for _, high in price_ranges], dtype=np.float64),
+        scores=np.array([_to_float(p.score) for p in products], dtype=np.float64),
+        embeddings=embeddings,
+        variant_owners=np.array(variant_owners, dtype=np.int64),
+        variant_roms=np.array(variant_roms, dtype=np.float64),
+        variant_colors=np.array(variant_colors, dtype=np.str_),
+    )
+
+
+def _load_phones() -> CatalogSnapshot:
+    with Session() as session:
+        phones = session.execute(select(Phone).order_by(Phone.id)).scalars().all()
+        variants = session.execute(
+            select(PhoneVariant.phone_id, PhoneVariant.variants)
+        ).all()
+        return _build_snapshot(
+            phones,
+            PhoneModel.model_validate,
+            lambda phone: (phone.min_price, phone.max_price),
+            variants,  # type: ignore
+        )
+
+
+def _load_laptops() -> CatalogSnapshot:
+    with Session() as session:
+        laptops = session.execute(select(Laptop).order_by(Laptop.id)).scalars().all()
+        variants = session.execute(
+            select(LaptopVariant.laptop_id, LaptopVariant.variants)
+        ).all()
+        return _build_snapshot(
+            laptops,
+            LaptopModel.model_validate,
+            lambda laptop: (laptop.min_price, laptop.max_price),
+            variants,  # type: ignore
+        )
+
+
+def _load_accessories() -> CatalogSnapshot:
+    with Session() as session:
+        accessories = (
+            session.execute(select(Accessory).order_by(Accessory.id)).scalars().all()
+        )
+        return _build_snapshot(
+            accessories,
+            AccessoryModel.model_validate,
+            lambda accessory: (_to_float(accessory.price),) * 2,
+        )
+
+
+_loaders: dict[str, Callable[[], CatalogSnapshot]] = {
+    PHONE: _load_phones,
+    LAPTOP: _load_laptops,
+    ACCESSORY: _load_accessories,
+}
+_item_models: dict[str, type[BaseModel]] = {
+    PHONE: PhoneModel,
+    LAPTOP: LaptopModel,
+    ACCESSORY: AccessoryModel,
+}
+_snapshots: dict[str, CatalogSnapshot] = {}
+_snapshots_lock = threading.Lock()
+
+# Arrays written as one .npy file each, so every worker can map them.
+_COLUMNS = [
+    "ids",
+    "brand_codes",
+    "product_types",
+    "min_prices",
+    "max_prices",
+    "scores",
+    "embeddings",
+    "variant_owners",
+    "variant_roms",
+    "variant_colors",
+]
+_KEPT_VERSIONS = 2
+
+
+class _MappedItems(Sequence[BaseModel]):
+    """
+    Rows kept as JSON in the mapped file and only parsed when they are returned.
+    """
+
+    def __init__(self, model: type[BaseModel], data: np.ndarray, offsets: np.ndarray):
+        self._model = model
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):  # type: ignore
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return self._model.model_validate_json(self._data[start:end].tobytes())
+
+
+def _kind_dir(kind: str) -> str:
+    return os.path.join(env.CATALOG_SNAPSHOT_DIR, kind)
+
+
+def _current_version(kind: str) -> str | None:
+    try:
+        with open(os.path.join(_kind_dir(kind), "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_snapshot(kind: str) -> str:
+    """
+    Dump the product table into a new snapshot version and make it the current
+    one. Called by the import tasks; workers pick it up on their next reload.
+    """
+    snapshot = _loaders[kind]()
+    version = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S%f")
+    kind_dir = _kind_dir(kind)
+    tmp_dir = os.path.join(kind_dir, f".{version}.tmp")
+    os.makedirs(tmp_dir)
+
+    for column in _COLUMNS:
+        np.save(os.path.join(tmp_dir, f"{column}.npy"), getattr(snapshot, column))
+
+    rows = [item.model_dump_json().encode("utf-8") for item in snapshot.items]
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(row) for row in rows])
+    np.save(os.path.join(tmp_dir, "item_offsets.npy"), offsets)
+    np.save(
+        os.path.join(tmp_dir, "items.npy"),
+        np.frombuffer(b"".join(rows), dtype=np.uint8),
+    )
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "rows": len(rows),
+                "embedding_dimensions": env.EMBEDDING_DIMENSIONS,
+                "embedding_storage": env.EMBEDDING_STORAGE,
+            },
+            f,
+        )
+
+    os.rename(tmp_dir, os.path.join(kind_dir, version))
+    current_tmp = os.path.join(kind_dir, "CURRENT.tmp")
+    with open(current_tmp, "w") as f:
+        f.write(version)
+    os.replace(current_tmp, os.path.join(kind_dir, "CURRENT"))
+
+    # Workers still mapping an older version keep their pages after the unlink.
+    versions = sorted(
+        name for name in os.listdir(kind_dir) if name.isdigit() and name != version
+    )
+    for name in versions[: max(len(versions) - _KEPT_VERSIONS + 1, 0)]:
+        shutil.rmtree(os.path.join(kind_dir, name), ignore_errors=True)
+    return version
+
+
+def _map_snapshot(kind: str, version: str) -> CatalogSnapshot | None:
+    version_dir = os.path.join(_kind_dir(kind), version)
+    with open(os.path.join(version_dir, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["embedding_dimensions"] != env.EMBEDDING_DIMENSIONS:
+        return None
+    # Versions written before a column was added are reloaded from Postgres.
+    if not all(
+        os.path.exists(os.path.join(version_dir, f"{column}.npy"))
+        for column in _COLUMNS
+    ):
+        return None
+
+    def load(name: str) -> np.ndarray:
+        return np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode="r")
+
+    return CatalogSnapshot(
+        items=_MappedItems(_item_models[kind], load("items"), load("item_offsets")),
+        version=version,
+        **{column: load(column) for column in _COLUMNS},
+    )
+
+
+def _load(kind: str, previous: CatalogSnapshot | None) -> CatalogSnapshot:
+    version = _current_version(kind)
+    if version is not None:
+        if previous is not None and previous.version == version:
+            previous.loaded_at = monotonic()
+            return previous
+        snapshot = _map_snapshot(kind, version)
+        if snapshot is not None:
+            return snapshot
+    return _loaders[kind]()
+
+
+def _is_fresh(snapshot: CatalogSnapshot | None) -> bool:
+    return (
+        snapshot is not None
+        and monotonic() - snapshot.loaded_at < env.CATALOG_ENGINE_TTL
+    )
+
+
+def get_snapshot(kind: str) -> CatalogSnapshot:
+    """
+    The catalog of one product kind, mapped from the current snapshot files when
+    the import tasks wrote some, otherwise loaded from Postgres. It is checked
+    again once older than CATALOG_ENGINE_TTL.
+    """
+    snapshot = _snapshots.get(kind)
+    if _is_fresh(snapshot):
+        return snapshot  # type: ignore
+
+    with _snapshots_lock:
+        snapshot = _snapshots.get(kind)
+        if not _is_fresh(snapshot):
+            snapshot = _snapshots[kind] = _load(kind, snapshot)
+        return snapshot  # type: ignore
+
+
+async def aget_snapshot(kind: str) -> CatalogSnapshot:
+    snapshot = _snapshots.get(kind)
+    if _is_fresh(snapshot):
+        return snapshot  # type: ignore
+    return await asyncio.to_thread(get_snapshot, kind)
+
+
+def invalidate(kind: str | None = None):
+    with _snapshots_lock:
+        if kind is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(kind, None)
+
+
+def _all(snapshot: CatalogSnapshot) -> np.ndarray:
+    return np.ones(len(snapshot), dtype=bool)
+
+
+def _none(snapshot: CatalogSnapshot) -> np.ndarray:
+    return np.zeros(len(snapshot), dtype=bool)
+
+
+def _price_mask(
+    snapshot: CatalogSnapshot, min_price: float | None, max_price: float | None
+) -> np.ndarray:
+    mask = _all(snapshot)
+    if min_price:
+        mask &= snapshot.max_prices >= min_price
+    if max_price:
+        mask &= snapshot.min_prices <= max_price
+    return mask
+
+
+def _equal_mask(
+    snapshot: CatalogSnapshot, column: np.ndarray, value: str | None
+) -> np.ndarray:
+    if not value:
+        return _all(snapshot)
+    return column == value
+
+
+def _similarities(
+    snapshot: CatalogSnapshot, embedding: list[float] | None
+) -> np.ndarray | None:
+    if embedding is None:
+        return None
+    query = np.asarray(embedding, dtype=np.float32)
+    return snapshot.embeddings @ (query / (np.linalg.norm(query) or 1))
+
+
+def _name_mask(
+    snapshot: CatalogSnapshot, similarities: np.ndarray | None, threshold: float
+) -> np.ndarray:
+    if similarities is None:
+        return _all(snapshot)
+    return similarities >= threshold
+
+
+def _variant_mask(
+    snapshot: CatalogSnapshot,
+    rom: NumericConfiguration | None = None,
+    color: str | None = None,
+) -> np.ndarray:
+    """
+    Products with at least one variant matching both the ROM range and the color.
+    """
+    matches = np.ones(len(snapshot.variant_owners), dtype=bool)
+    if rom and rom.min_value is not None:
+        matches &= snapshot.variant_roms >= rom.min_value
+    if rom and rom.max_value is not None:
+        matches &= snapshot.variant_roms <= rom.max_value
+    if color:
+        phrase = f" {normalize_color(color)} "
+        matches &= np.char.find(snapshot.variant_colors, phrase) >= 0
+
+    mask = _none(snapshot)
+    mask[snapshot.variant_owners[matches]] = True
+    return mask
+
+
+# Conditions, priority masks and name similarities of a filter, what ranking needs.
+_Masks = tuple[np.ndarray, dict[str, np.ndarray], np.ndarray | None]
+
+
+def _sort_keys(
+    snapshot: CatalogSnapshot,
+    config: "Config",
+    priority_masks: dict[str, np.ndarray],
+    similarities: np.ndarray | None,
+) -> list[np.ndarray]:
+    # Mirrors the filters' `sort_key_expressions`.
+    if similarities is not None:
+        return [1 - similarities, snapshot.ids]
+
+    if config.is_recommending:
+        priority_score = np.zeros(len(snapshot))
+        len_priority = len(config.recommend_priority)
+        for i, filter_type in enumerate(config.recommend_priority):
+            if filter_type.value not in priority_masks:
+                raise ValueError(f"Unknown filter type: {filter_type}")
+            weight = 10 ** (len_priority - i)
+            priority_score += priority_masks[filter_type.value] * weight
+        return [priority_score, snapshot.scores, snapshot.ids]
+
+    return [snapshot.scores, snapshot.ids]
+
+
+def _after_mask(
+    sort_keys: list[np.ndarray], after: list[Any], descending: bool
+) -> np.ndarray:
+    # Row comparison of the sort keys with the cursor, like (a, b) > (x, y) in SQL.
+    beyond = np.zeros(len(sort_keys[0]), dtype=bool)
+    equal = np.ones(len(sort_keys[0]), dtype=bool)
+    for column, value in zip(sort_keys, after):
+        beyond |= equal & (column < value if descending else column > value)
+        equal &= column == value
+    return beyond
+
+
+def _page(
+    snapshot: CatalogSnapshot,
+    config: "Config",
+    mask: np.ndarray,
+    priority_masks: dict[str, np.ndarray],
+    similarities: np.ndarray | None,
+) -> tuple[list[Any], list[Any] | None]:
+    """
+    Mirrors the filters' `to_statement` on the rows of the mask: the page after the
+    config's cursor and the sort key of its last row.
+    """
+    sort_keys = _sort_keys(snapshot, config, priority_masks, similarities)
+    descending = similarities is None
+    if config.after is not None:
+        mask = mask & _after_mask(sort_keys, config.after, descending)
+
+    rows = np.flatnonzero(mask)
+    sortable = [*sort_keys[:-1], snapshot.id_ranks]
+    # lexsort sorts by its last key first.
+    order = np.lexsort(
+        [(-key if descending else key)[rows] for key in reversed(sortable)]
+    )
+    page = rows[order][: config.limit]
+    last_sort_key = [key[page[-1]].item() for key in sort_keys] if len(page) else None
+    return [snapshot.items[i].model_copy() for i in page], last_sort_key
+
+
+def _rank(
+    snapshot: CatalogSnapshot,
+    config: "Config",
+    conditions: np.ndarray,
+    priority_masks: dict[str, np.ndarray],
+    similarities: np.ndarray | None,
+) -> list[Any]:
+    mask = _all(snapshot) if config.is_recommending else conditions
+    return _page(snapshot, config, mask, priority_masks, similarities)[0]
+
+
+def _candidates(
+    snapshot: CatalogSnapshot,
+    filter: Any,
+    conditions: np.ndarray,
+    priority_masks: dict[str, np.ndarray],
+    similarities: np.ndarray | None,
+) -> Candidates:
+    # Same result as `candidates.to_statement`, from masks computed once.
+    if not filter.config.is_recommending:
+        page, last_sort_key = _page(
+            snapshot, filter.config, conditions, priority_masks, similarities
+        )
+        if page:
+            return Candidates(page=page, cursor=page_cursor(filter, last_sort_key))
+        filter = recommendation_filter(filter)
+
+    recommendations, last_sort_key = _page(
+        snapshot, filter.config, ~conditions, priority_masks, similarities
+    )
+    return Candidates(
+        recommendations=recommendations, cursor=page_cursor(filter, last_sort_key)
+    )
+
+
+def _phone_masks(snapshot: CatalogSnapshot, filter: "PhoneFilter") -> _Masks:
+    similarities = _similarities(snapshot, filter.name_embedding())
+    price = _price_mask(snapshot, filter.min_price, filter.max_price)
+    brand = _equal_mask(snapshot, snapshot.brand_codes, filter.brand_code)
+    name = _name_mask(snapshot, similarities, filter.config.threshold)
+
+    conditions = price & brand & name
+    if filter.rom or filter.color:
+        conditions &= _variant_mask(snapshot, rom=filter.rom, color=filter.color)
+
+    priority_masks = {
+        "price": price,
+        "brand": brand,
+        "name": name,
+        "rom": (
+            _variant_mask(snapshot, rom=filter.rom) if filter.rom else _none(snapshot)
+        ),
+        "color": (
+            _variant_mask(snapshot, color=filter.color)
+            if filter.color
+            else _none(snapshot)
+        ),
+    }
+    return conditions, priority_masks, similarities
+
+
+def _search_phones(snapshot: CatalogSnapshot, filter: "PhoneFilter") -> list[Any]:
+    return _rank(snapshot, filter.config, *_phone_masks(snapshot, filter))
+
+
+def _phone_candidates(snapshot: CatalogSnapshot, filter: "PhoneFilter") -> Candidates:
+    return _candidates(snapshot, filter, *_phone_masks(snapshot, filter))
+
+
+def _laptop_masks(snapshot: CatalogSnapshot, filter: "LaptopFilter") -> _Masks:
+    similarities = _similarities(snapshot, filter.name_embedding())
+    price = _price_mask(snapshot, filter.min_price, filter.max_price)
+    brand = _equal_mask(snapshot, snapshot.brand_codes, filter.brand_code)
+    name = _name_mask(snapshot, similarities, filter.config.threshold)
+    color = (
+        _variant_mask(snapshot, color=filter.color) if filter.color else _none(snapshot)
+    )
+
+    conditions = price & brand & name
+    if filter.color:
+        conditions &= color
+
+    priority_masks = {"price": price, "brand": brand, "name": name, "color": color}
+    return conditions, priority_masks, similarities
+
+
+def _search_laptops(snapshot: CatalogSnapshot, filter: "LaptopFilter") -> list[Any]:
+    return _rank(snapshot, filter.config, *_laptop_masks(snapshot, filter))
+
+
+def _laptop_candidates(
+    snapshot: CatalogSnapshot, filter: "LaptopFilter"
+) -> Candidates:
+    return _candidates(snapshot, filter, *_laptop_masks(snapshot, filter))
+
+
+def _accessory_masks(snapshot: CatalogSnapshot, filter: "AccessoryFilter") -> _Masks:
+    similarities = _similarities(snapshot, filter.name_embedding())
+    price = _price_mask(snapshot, filter.min_price, filter.max_price)
+    brand = _equal_mask(snapshot, snapshot.brand_codes, filter.brand_code)
+    name = _name_mask(snapshot, similarities, filter.config.threshold)
+    product_type = _equal_mask(snapshot, snapshot.product_types, filter.product_type)
+
+    priority_masks = {
+        "price": price,
+        "brand": brand,
+        "name": name,
+        "product_type": product_type,
+    }
+    return price & brand & name & product_type, priority_masks, similarities
+
+
+def _search_accessories(
+    snapshot: CatalogSnapshot, filter: "AccessoryFilter"
+) -> list[Any]:
+    return _rank(
+        snapshot,
+        filter.config,  # type: ignore
+        *_accessory_masks(snapshot, filter),
+    )
+
+
+def _accessory_candidates(
+    snapshot: CatalogSnapshot, filter: "AccessoryFilter"
+) -> Candidates:
+    return _candidates(snapshot, filter, *_accessory_masks(snapshot, filter))
+
+
+def search_phones(filter: "PhoneFilter") -> list[PhoneModel]:
+    return _search_phones(get_snapshot(PHONE), filter)
+
+
+async def asearch_phones(filter: "PhoneFilter") -> list[PhoneModel]:
+    return _search_phones(await aget_snapshot(PHONE), filter)
+
+
+def search_laptops(filter: "LaptopFilter") -> list[LaptopModel]:
+    return _search_laptops(get_snapshot(LAPTOP), filter)
+
+
+async def asearch_laptops(filter: "LaptopFilter") -> list[LaptopModel]:
+    return _search_laptops(await aget_snapshot(LAPTOP), filter)
+
+
+def search_accessories(filter: "AccessoryFilter") -> list[AccessoryModel]:
+    return _search_accessories(get_snapshot(ACCESSORY), filter)
+
+
+def search_phone_candidates(filter: "PhoneFilter") -> Candidates[PhoneModel]:
+    return _phone_candidates(get_snapshot(PHONE), filter)
+
+
+async def asearch_phone_candidates(filter: "PhoneFilter") -> Candidates[PhoneModel]:
+    return _phone_candidates(await aget_snapshot(PHONE), filter)
+
+
+def search_laptop_candidates(filter: "LaptopFilter") -> Candidates[LaptopModel]:
+    return _laptop_candidates(get_snapshot(LAPTOP), filter)
+
+
+async def asearch_laptop_candidates(
+    filter: "LaptopFilter",
+) -> Candidates[LaptopModel]:
+    return _laptop_candidates(await aget_snapshot(LAPTOP), filter)
+
+
+def search_accessory_candidates(
+    filter: "AccessoryFilter",
+) -> Candidates[AccessoryModel]:
+    return _accessory_candidates(get_snapshot(ACCESSORY), filter)
@@ -0,0 +1,227 @@
+from functools import lru_cache
+
+import tiktoken
+from openai.types.chat import ChatCompletionMessageParam
+from pydantic import BaseModel
+
+from env import env
+from models.user_memory import UserMemoryModel, UpdateConversationSummaryModel
+from repositories.user_memory import (
+    update_conversation_summary,
+    aupdate_conversation_summary,
+)
+from service.openai import OpenAIChatCompletionsRequest, _chat_model
+
+# Role, separators and priming tokens OpenAI adds around every chat message.
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+_SUMMARY_INSTRUCTION = (
+    "You maintain the running summary of a conversation between a customer and "
+    "the FPT Shop sales assistant. Merge the new messages into the previous "
+    "summary. Keep the products, brands, prices, configurations and contact "
+    "details the customer mentioned, the products the assistant suggested and "
+    "the questions that are still open. Drop greetings and small talk. Answer "
+    "with the summary only, in the language of the conversation, in at most "
+    "{max_tokens} tokens."
+)
+
+
+class ConversationWindows(BaseModel):
+    detect_demand: list[ChatCompletionMessageParam]
+    collect_and_retrieval: list[ChatCompletionMessageParam]
+    generate_response: list[ChatCompletionMessageParam]
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> tiktoken.Encoding:
+    # gpt-4o family tokenizer, loaded once per process.
+    return tiktoken.get_encoding("o200k_base")
+
+
+def load_encoding():
+    """
+    Loads the tokenizer at startup rather than on the first turn. tiktoken downloads
+    its BPE file on first use, then reads it from TIKTOKEN_CACHE_DIR, which the Docker
+    image fills at build time for offline containers.
+    """
+    _encoding()
+
+
+def _content_to_string(message: ChatCompletionMessageParam) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") for part in content)  # type: ignore
+
+
+def count_tokens(message: ChatCompletionMessageParam) -> int:
+    return (
+        len(_encoding().encode(_content_to_string(message)))
+        + _MESSAGE_OVERHEAD_TOKENS
+    )
+
+
+def _summary_message(summary: str) -> ChatCompletionMessageParam:
+    return {
+        "role": "system",
+        "content": f"## SUMMARY OF THE EARLIER CONVERSATION:\n{summary}",
+    }
+
+
+def _summary_state(
+    user_memory: UserMemoryModel,
+    history: list[ChatCompletionMessageParam],
+    offset: int = 0,
+) -> tuple[str | None, int]:
+    # `history` is the thread from message `offset` on, the start returned is an index
+    # into it. A history shorter than the summarized part is not the thread the summary
+    # was built from (e.g. a truncated or replayed history), so the summary is ignored.
+    if user_memory.summarized_message_count > offset + len(history):
+        return None, 0
+    return (
+        user_memory.conversation_summary,
+        max(user_memory.summarized_message_count - offset, 0),
+    )
+
+
+def build_window(
+    history: list[ChatCompletionMessageParam],
+    user_memory: UserMemoryModel,
+    budget: int,
+    offset: int = 0,
+) -> list[ChatCompletionMessageParam]:
+    """
+    Newest messages that fit in `budget` tokens, preceded by the running summary of
+    the folded ones. The latest message is always kept.
+    """
+    summary, start = _summary_state(user_memory, history, offset)
+    prefix = [_summary_message(summary)] if summary else []
+    remaining = budget - sum(count_tokens(message) for message in prefix)
+
+    window: list[ChatCompletionMessageParam] = []
+    for message in reversed(history[start:]):
+        tokens = count_tokens(message)
+        if window and tokens > remaining:
+            break
+        window.append(message)
+        remaining -= tokens
+    window.reverse()
+    return [*prefix, *window]
+
+
+def build_windows(
+    history: list[ChatCompletionMessageParam],
+    user_memory: UserMemoryModel,
+    offset: int = 0,
+) -> ConversationWindows:
+    return ConversationWindows(
+        detect_demand=build_window(
+            history, user_memory, env.CONTEXT_BUDGET_DETECT_DEMAND, offset
+        ),
+        collect_and_retrieval=build_window(
+            history, user_memory, env.CONTEXT_BUDGET_COLLECT_AND_RETRIEVAL, offset
+        ),
+        generate_response=build_window(
+            history, user_memory, env.CONTEXT_BUDGET_GENERATE_RESPONSE, offset
+        ),
+    )
+
+
+def _messages_to_fold(
+    user_memory: UserMemoryModel,
+    history: list[ChatCompletionMessageParam],
+    offset: int = 0,
+) -> tuple[str | None, list[ChatCompletionMessageParam]]:
+    summary, start = _summary_state(user_memory, history, offset)
+    end = len(history) - env.CONTEXT_VERBATIM_TURNS * 2
+    # Folding a few messages at a time keeps the summary call off most turns.
+    if end - start < env.CONTEXT_SUMMARY_BATCH_MESSAGES:
+        return summary, []
+    return summary, history[start:end]
+
+
+def _get_summary_request(
+    summary: str | None, messages: list[ChatCompletionMessageParam]
+) -> OpenAIChatCompletionsRequest:
+    transcript = "\n".join(
+        f"{message['role']}: {_content_to_string(message)}" for message in messages
+    )
+    return OpenAIChatCompletionsRequest(
+        messages=[
+            {
+                "role": "system",
+                "content": _SUMMARY_INSTRUCTION.format(
+                    max_tokens=env.CONTEXT_SUMMARY_MAX_TOKENS
+                ),
+            },
+            {
+                "role": "user",
+                "content": (
+                    f"## PREVIOUS SUMMARY:\n{summary or 'None'}\n\n"
+                    f"## NEW MESSAGES:\n{transcript}"
+                ),
+            },
+        ],
+        model=_chat_model,
+        temperature=0,
+        timeout=30,
+        agent="conversation_summary",
+    )
+
+
+def _truncate_summary(summary: str) -> str:
+    tokens = _encoding().encode(summary)
+    if len(tokens) <= env.CONTEXT_SUMMARY_MAX_TOKENS:
+        return summary
+    return _encoding().decode(tokens[: env.CONTEXT_SUMMARY_MAX_TOKENS])
+
+
+def fold(
+    user_memory: UserMemoryModel,
+    history: list[ChatCompletionMessageParam],
+    offset: int = 0,
+) -> UserMemoryModel:
+    """
+    Folds the messages older than the last CONTEXT_VERBATIM_TURNS turns into the
+    running summary of the thread once enough of them are pending. `history` is the
+    thread from its message `offset` on.
+    """
+    summary, messages = _messages_to_fold(user_memory, history, offset)
+    if not messages:
+        return user_memory
+
+    response = _get_summary_request(summary, messages).create()
+    return update_conversation_summary(
+        id=user_memory.id,
+        data=UpdateConversationSummaryModel(
+            conversation_summary=_truncate_summary(
+                response.choices[0].message.content or ""
+            ),
+            summarized_message_count=(
+                offset + len(history) - env.CONTEXT_VERBATIM_TURNS * 2
+            ),
+        ),
+    )
+
+
+async def afold(
+    user_memory: UserMemoryModel,
+    history: list[ChatCompletionMessageParam],
+    offset: int = 0,
+) -> UserMemoryModel:
+    summary, messages = _messages_to_fold(user_memory, history, offset)
+    if not messages:
+        return user_memory
+
+    response = await _get_summary_request(summary, messages).acreate()
+    return await aupdate_conversation_summary(
+        id=user_memory.id,
+        data=UpdateConversationSummaryModel(
+            conversation_summary=_truncate_summary(
+                response.choices[0].message.content or ""
+            ),
+            summarized_message_count=(
+                offset + len(history) - env.CONTEXT_VERBATIM_TURNS * 2
+            ),
+        ),
+    )
@@ -1,7 +1,12 @@
-from repositories.brand import query_by_semantic
+from repositories.brand import query_by_semantic, aquery_by_semantic
 from email_validator import EmailNotValidError, validate_email
 import phonenumbers
-from service.openai import get_embedding
+from service.embedding import (
+    get_embedding,
+    aget_embedding,
+    with_prefix,
+    BRAND_PREFIX,
+)
 import weave
 
 
@@ -14,7 +19,7 @@ def convert_band_name_to_code(
     if not brand_name:
         return None
 
-    embedding = get_embedding(f"Brand: {brand_name}")
+    embedding = get_embedding(with_prefix(BRAND_PREFIX, brand_name))
     brand = query_by_semantic(embedding, 1, threshold)
 
     if len(brand) == 0:
@@ -23,6 +28,24 @@ def convert_band_name_to_code(
     return brand[0].id
 
 
+@weave.op(
+    name="aconvert_brand_name_to_code",
+)
+async def aconvert_band_name_to_code(
+    brand_name: str | None, threshold: float = 0.7
+) -> str | None:
+    if not brand_name:
+        return None
+
+    embedding = await aget_embedding(with_prefix(BRAND_PREFIX, brand_name))
+    brand = await aquery_by_semantic(embedding, 1, threshold)
+
+    if len(brand) == 0:
+        return None
+
+    return brand[0].id
+
+
 def convert_to_standard_email(raw_email: str | None) -> str | None:
     if not raw_email:
         return None
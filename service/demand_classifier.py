@@ -0,0 +1,110 @@
+import os
+import re
+import threading
+from typing import Optional
+
+import joblib
+import phonenumbers
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline, make_pipeline
+
+from env import env
+from models.user_memory import ProductType
+from service.converter import (
+    convert_to_standard_email,
+    convert_to_standard_phone_number,
+)
+
+_email_pattern = re.compile(r"[^\s@]+@[^\s@]+")
+# Digit runs long enough to be meant as a phone number, spaces and dots allowed.
+_phone_like_pattern = re.compile(r"\+?\d[\d\s.\-]{7,}\d")
+
+_model: Optional[Pipeline] = None
+_model_mtime: Optional[float] = None
+_model_lock = threading.Lock()
+
+
+def to_features(message: str, previous_product_type: Optional[str]) -> str:
+    """
+    Classifier input: the previous turn's product type as a token, so that continuations
+    like "còn màu khác không?" follow the conversation, then the lowercased message.
+    """
+    previous = (previous_product_type or "none").replace(" ", "_")
+    return f"__previous_{previous}__ {message.lower()}"
+
+
+def build_pipeline() -> Pipeline:
+    # Character n-grams cope with the abbreviations and missing diacritics of chat text.
+    return make_pipeline(
+        TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4), sublinear_tf=True),
+        LogisticRegression(max_iter=1000, class_weight="balanced"),
+    )
+
+
+def save(model: Pipeline, path: Optional[str] = None):
+    path = path or env.DEMAND_CLASSIFIER_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load() -> Optional[Pipeline]:
+    """
+    Loads the exported model, again only when the file changed. Called at startup and
+    lazily by `classify`, a missing model disables the local path.
+    """
+    global _model, _model_mtime
+    try:
+        mtime = os.path.getmtime(env.DEMAND_CLASSIFIER_PATH)
+    except OSError:
+        return None
+
+    with _model_lock:
+        if _model is None or _model_mtime != mtime:
+            _model = joblib.load(env.DEMAND_CLASSIFIER_PATH)
+            _model_mtime = mtime
+        return _model
+
+
+def classify(
+    message: str, previous_product_type: Optional[str]
+) -> Optional[tuple[ProductType, float]]:
+    """
+    Most likely demand of the message and its probability, None without a model.
+    """
+    model = load()
+    if model is None:
+        return None
+
+    features = [to_features(message, previous_product_type)]
+    probabilities = model.predict_proba(features)[0]
+    best = probabilities.argmax()
+    return ProductType(model.classes_[best]), float(probabilities[best])
+
+
+def extract_contact_info(message: str) -> Optional[tuple[str | None, str | None]]:
+    """
+    Phone number and email found in the message. None when the message looks like it
+    carries contact information that doesn't validate, detect_demand then asks the
+    user again through the LLM path.
+    """
+    phone_number = next(
+        (
+            convert_to_standard_phone_number(match.raw_string)
+            for match in phonenumbers.PhoneNumberMatcher(message, "VN")
+        ),
+        None,
+    )
+    if phone_number is None and _phone_like_pattern.search(message):
+        return None
+
+    email = None
+    email_match = _email_pattern.search(message)
+    if email_match:
+        email = convert_to_standard_email(email_match.group(0).strip(".,;:!?()<>"))
+        if email is None:
+            return None
+
+    return phone_number, email
@@ -1,19 +1,321 @@
-from openai import OpenAI
+import asyncio
+import base64
+import hashlib
+import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import monotonic
+from typing import Any
+import unicodedata
+from array import array
+from collections import OrderedDict
+from db import redis, async_redis
 from env import env
+from service.openai import (
+    _embedding_model as _model,
+    create_embeddings,
+    acreate_embeddings,
+)
 import chainlit as cl
 
-_client = OpenAI(api_key=env.OPENAI_API_KEY)
-_model = "text-embedding-3-small"
+# Prefixes used both when importing the catalog and when querying it, so the
+# query side always embeds exactly the same text as the stored rows.
+PHONE_NAME_PREFIX = "Phone Name: "
+LAPTOP_NAME_PREFIX = "Laptop Name: "
+ACCESSORY_NAME_PREFIX = "Accessor Name: "
+BRAND_PREFIX = "Brand: "
 
+_CACHE_PREFIX = "embedding"
 
-def get_embedding(text, model=_model):
-    text = text.replace("\n", " ")
-    return _client.embeddings.create(input=[text], model=model).data[0].embedding
+_lru: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+_lru_lock = threading.Lock()
+
+
+# (texts, model, future resolved with their embeddings)
+_Request = tuple[list[str], str, Any]
+
+
+def _by_model(batch: list[_Request]) -> dict[str, list[_Request]]:
+    requests: dict[str, list[_Request]] = {}
+    for request in batch:
+        requests.setdefault(request[1], []).append(request)
+    return requests
+
+
+def _chunks(requests: list[_Request]) -> list[list[str]]:
+    texts = list(dict.fromkeys(text for request in requests for text in request[0]))
+    size = env.EMBEDDING_BATCH_SIZE
+    return [texts[i : i + size] for i in range(0, len(texts), size)]
+
+
+class _EmbeddingBatcher:
+    """
+    Collects embedding requests for a few milliseconds and sends them as one
+    `embeddings.create(input=[...])` call per model, resolving each caller's future.
+    The calls run on a pool of OPENAI_EMBEDDING_CONCURRENCY threads, so that one
+    waiting on the rate limiter or a retry doesn't hold back the batches after it.
+    """
+
+    def __init__(self):
+        self._pid: int | None = None
+        self._start_lock = threading.Lock()
+        self._queue: queue.Queue[_Request] = queue.Queue()
+        self._executor: ThreadPoolExecutor | None = None
+
+    def submit(self, texts: list[str], model: str) -> Future:
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((texts, model, future))
+        return future
+
+    def _ensure_started(self):
+        # RQ forks a process per job and the parent's threads don't survive a fork.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._executor = ThreadPoolExecutor(
+                max_workers=env.OPENAI_EMBEDDING_CONCURRENCY,
+                thread_name_prefix="embedding",
+            )
+            threading.Thread(target=self._run, daemon=True).start()
+            self._pid = os.getpid()
+
+    def _collect(self) -> list[_Request]:
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = monotonic() + env.EMBEDDING_BATCH_WINDOW_MS / 1000
+        while size < env.EMBEDDING_BATCH_SIZE:
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            for model, requests in _by_model(self._collect()).items():
+                self._executor.submit(self._dispatch, requests, model)  # type: ignore
+
+    def _dispatch(self, requests: list[_Request], model: str):
+        try:
+            embeddings: dict[str, list[float]] = {}
+            for chunk in _chunks(requests):
+                embeddings.update(
+                    zip(
+                        chunk,
+                        create_embeddings(
+                            chunk, model=model, dimensions=env.EMBEDDING_DIMENSIONS
+                        ),
+                    )
+                )
+        except Exception as e:
+            for _, _, future in requests:
+                future.set_exception(e)
+            return
+
+        for texts, _, future in requests:
+            future.set_result([embeddings[text] for text in texts])
+
+
+class _AsyncEmbeddingBatcher:
+    """
+    `_EmbeddingBatcher` on the event loop: each batch is sent by a task calling the
+    async client, so the batches are in flight together, up to the stage semaphore.
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pending: list[_Request] = []
+        self._size = 0
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, texts: list[str], model: str) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop, self._pending, self._size = loop, [], 0
+            self._flush_handle = None
+        future = loop.create_future()
+        self._pending.append((texts, model, future))
+        self._size += len(texts)
+        if self._size >= env.EMBEDDING_BATCH_SIZE:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(
+                env.EMBEDDING_BATCH_WINDOW_MS / 1000, self._flush
+            )
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending, self._size = self._pending, [], 0
+        for model, requests in _by_model(batch).items():
+            task = asyncio.ensure_future(self._dispatch(requests, model))
+            # The loop only keeps weak references to its tasks.
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, requests: list[_Request], model: str):
+        try:
+            embeddings: dict[str, list[float]] = {}
+            for chunk in _chunks(requests):
+                embeddings.update(
+                    zip(
+                        chunk,
+                        await acreate_embeddings(
+                            chunk, model=model, dimensions=env.EMBEDDING_DIMENSIONS
+                        ),
+                    )
+                )
+        except Exception as e:
+            for _, _, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for texts, _, future in requests:
+            if not future.done():
+                future.set_result([embeddings[text] for text in texts])
+
+
+_batcher = _EmbeddingBatcher()
+_async_batcher = _AsyncEmbeddingBatcher()
+
+
+def with_prefix(prefix: str, text: str) -> str:
+    return f"{prefix}{text}"
+
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
+
+def _redis_key(model: str, text: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    # Vectors of another embedding profile must never be served from the cache.
+    return f"{_CACHE_PREFIX}:{model}:{env.EMBEDDING_DIMENSIONS}:{digest}"
+
+
+def _encode(embedding: list[float]) -> str:
+    return base64.b64encode(array("f", embedding).tobytes()).decode()
+
+
+def _decode(data: str) -> list[float]:
+    embedding = array("f")
+    embedding.frombytes(base64.b64decode(data))
+    return embedding.tolist()
+
+
+def _lru_get(key: tuple[str, str]) -> list[float] | None:
+    with _lru_lock:
+        embedding = _lru.get(key)
+        if embedding is not None:
+            _lru.move_to_end(key)
+        return embedding
+
+
+def _lru_set(key: tuple[str, str], embedding: list[float]):
+    with _lru_lock:
+        _lru[key] = embedding
+        _lru.move_to_end(key)
+        while len(_lru) > env.EMBEDDING_LRU_SIZE:
+            _lru.popitem(last=False)
+
+
+def _lookup_local(
+    texts: list[str], model: str
+) -> tuple[dict[str, list[float]], list[str]]:
+    found: dict[str, list[float]] = {}
+    missing: list[str] = []
+    for text in dict.fromkeys(texts):
+        embedding = _lru_get((model, text))
+        if embedding is None:
+            missing.append(text)
+        else:
+            found[text] = embedding
+    return found, missing
+
+
+def _store_remote(
+    values: list[str | None], texts: list[str], model: str, found: dict
+) -> list[str]:
+    missing = []
+    for text, value in zip(texts, values):
+        if value is None:
+            missing.append(text)
+            continue
+        found[text] = _decode(value)
+        _lru_set((model, text), found[text])
+    return missing
+
+
+def _save(
+    texts: list[str], embeddings: list[list[float]], model: str, found: dict
+) -> dict[str, str]:
+    mapping = {}
+    for text, embedding in zip(texts, embeddings):
+        found[text] = embedding
+        _lru_set((model, text), embedding)
+        mapping[_redis_key(model, text)] = _encode(embedding)
+    return mapping
 
 
 def get_list_embedding(texts, model=_model):
-    texts = [text.replace("\n", " ") for text in texts]
-    return [
-        item.embedding
-        for item in _client.embeddings.create(input=texts, model=model).data
-    ]
+    """
+    Embeddings are looked up in the process LRU, then in Redis, and only the
+    remaining texts are sent to OpenAI, batched with concurrent callers.
+    """
+    texts = [normalize_text(text) for text in texts]
+    found, missing = _lookup_local(texts, model)
+
+    if missing:
+        values = redis.mget([_redis_key(model, text) for text in missing])
+        missing = _store_remote(values, missing, model, found)  # type: ignore
+
+    if missing:
+        embeddings = _batcher.submit(missing, model).result()
+        mapping = _save(missing, embeddings, model, found)
+        pipeline = redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipeline.set(key, value, ex=env.EMBEDDING_CACHE_TTL)
+        pipeline.execute()
+
+    return [found[text] for text in texts]
+
+
+async def aget_list_embedding(texts, model=_model):
+    texts = [normalize_text(text) for text in texts]
+    found, missing = _lookup_local(texts, model)
+
+    if missing:
+        values = await async_redis.mget([_redis_key(model, text) for text in missing])
+        missing = _store_remote(values, missing, model, found)
+
+    if missing:
+        embeddings = await _async_batcher.submit(missing, model)
+        mapping = _save(missing, embeddings, model, found)
+        pipeline = async_redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipeline.set(key, value, ex=env.EMBEDDING_CACHE_TTL)
+        await pipeline.execute()
+
+    return [found[text] for text in texts]
+
+
+def get_embedding(text, model=_model):
+    return get_list_embedding([text], model=model)[0]
+
+
+async def aget_embedding(text, model=_model):
+    return (await aget_list_embedding([text], model=model))[0]
@@ -1,6 +1,6 @@
-from repositories.faq import search_by_semantic
+from repositories.faq import search_by_semantic, asearch_by_semantic
 from models.faq import FAQModel
-from service.embedding import get_embedding
+from service.embedding import get_embedding, aget_embedding
 
 
 def search(
@@ -15,3 +15,17 @@ def search(
     )
 
     return faqs
+
+
+async def asearch(
+    question: str,
+    top_k: int = 4,
+    threshold: float = 0.4,
+) -> list[FAQModel]:
+    question_embedding = await aget_embedding(question)
+
+    faqs = await asearch_by_semantic(
+        question_embedding=question_embedding, top_k=top_k, threshold=threshold
+    )
+
+    return faqs
@@ -1,6 +1,6 @@
 from enum import Enum
-from pydantic import BaseModel, ConfigDict, field_validator
-from sqlalchemy import Select, select, true, case, func, literal
+from pydantic import BaseModel, ConfigDict, PrivateAttr, field_validator
+from sqlalchemy import Select, select, true, case, func, literal, tuple_
 from sqlalchemy.orm import contains_eager
 from models.laptop import Laptop, LaptopModel
 from sqlalchemy.sql.expression import and_
@@ -8,9 +8,30 @@ from sqlalchemy.sql.operators import OperatorType, ge, le, eq
 from sqlalchemy.sql.elements import ColumnElement
 from typing import Any, Generic, TypeVar
 from models.laptop_variant import LaptopVariant
-from repositories.laptop import search as search_laptop
-from service.embedding import get_embedding
-from pgvector.sqlalchemy import Vector
+from repositories.laptop import (
+    search as search_laptop,
+    asearch as asearch_laptop,
+    search_candidates as search_laptop_candidates,
+    asearch_candidates as asearch_laptop_candidates,
+)
+from service.candidates import (
+    Candidates,
+    from_rows as to_candidates,
+    to_statement as to_candidates_statement,
+)
+from service.embedding import (
+    get_embedding,
+    aget_embedding,
+    with_prefix,
+    LAPTOP_NAME_PREFIX,
+)
+from service.catalog import (
+    search_laptops as catalog_search,
+    asearch_laptops as catalog_asearch,
+    search_laptop_candidates as catalog_search_candidates,
+    asearch_laptop_candidates as catalog_asearch_candidates,
+)
+from env import env
 import weave
 
 _T = TypeVar("_T")
@@ -54,7 +75,8 @@ class FilterType(str, Enum):
 class Config(BaseModel):
     threshold: float = 0.75
     limit: int = 4
-    offset: int = 0
+    # Sort key of the last row already listed, the page starts after it.
+    after: list[Any] | None = None
     is_recommending: bool = False
     recommend_priority: list[FilterType] = [
         FilterType.BRAND,
@@ -70,6 +92,29 @@ class LaptopFilter(BaseModel):
     min_price: int | None = None
     name: str | None = None
     color: str | None = None
+    _embeddings: dict[str, list[float]] = PrivateAttr(default_factory=dict)
+
+    def _name_text(self) -> str:
+        return with_prefix(LAPTOP_NAME_PREFIX, self.name or "")
+
+    def _get_embedding(self, text: str) -> list[float]:
+        if text not in self._embeddings:
+            self._embeddings[text] = get_embedding(text)
+        return self._embeddings[text]
+
+    def name_embedding(self) -> list[float] | None:
+        return self._get_embedding(self._name_text()) if self.name else None
+
+    async def aload_embeddings(self) -> None:
+        """
+        Pre-compute the name embeddings so that building the statement does not block the event loop.
+        """
+        if not self.name:
+            return
+
+        text = self._name_text()
+        if text not in self._embeddings:
+            self._embeddings[text] = await aget_embedding(text)
 
     def get_price_condition_expression(self) -> ColumnElement[bool]:
         filters = []
@@ -124,9 +169,9 @@ class LaptopFilter(BaseModel):
     def get_name_condition_expression(self) -> ColumnElement[bool]:
         if not self.name:
             return true()
-        embedding = get_embedding(self.name)
+        embedding = self._get_embedding(self._name_text())
         filters = FilterAttribute(
-            column=Laptop.name_embedding.cast(Vector).cosine_distance(embedding),
+            column=Laptop.name_embedding.cosine_distance(embedding),
             operator=le,
             value=1 - self.config.threshold,
         )
@@ -191,29 +236,62 @@ class LaptopFilter(BaseModel):
             score += self.score_by_priority(filter_type, len_priority - i)
         return score
 
-    def order_by_expressions(self) -> list[ColumnElement]:
-        is_recommending = self.config.is_recommending
-
+    def sort_key_expressions(self) -> list[ColumnElement]:
+        """
+        What the results are ranked by, the id last so that the order is total and a
+        page can start right after the last row of the previous one.
+        """
         if self.name:
             return [
-                Laptop.name_embedding.cast(Vector)
-                .cosine_distance(get_embedding(f"Laptop Name: {self.name}"))
-                .asc(),
+                Laptop.name_embedding.cosine_distance(
+                    self._get_embedding(self._name_text())
+                ),
+                Laptop.id,
             ]
-        if is_recommending:
-            return [
-                self.score_expression().desc(),
-                Laptop.score.expression.desc(),
-            ]
-        return [Laptop.score.expression.desc()]
+
+        if self.config.is_recommending:
+            return [self.score_expression(), Laptop.score.expression, Laptop.id]
+
+        return [Laptop.score.expression, Laptop.id]
+
+    def is_descending(self) -> bool:
+        # Names are ranked by ascending distance, the rest by descending score.
+        return not self.name
+
+    def order_by_expressions(self) -> list[ColumnElement]:
+        # The whole sort key, the id breaking ties of equal distances or scores, in
+        # the order `after_condition_expression` compares it.
+        sort_keys = self.sort_key_expressions()
+        if not self.is_descending():
+            if self.config.after is None:
+                # The HNSW index only serves an ORDER BY on the distance alone, kept
+                # for the first page of a name search. Rows at exactly the distance
+                # of its last row may then be skipped by the next page.
+                return [sort_keys[0].asc()]
+            return [sort_key.asc() for sort_key in sort_keys]
+        return [sort_key.desc() for sort_key in sort_keys]
+
+    def after_condition_expression(self) -> ColumnElement[bool]:
+        if self.config.after is None:
+            return true()
+
+        sort_key = tuple_(*self.sort_key_expressions())
+        after = tuple_(*(literal(value) for value in self.config.after))
+        return sort_key < after if self.is_descending() else sort_key > after
+
+    def ef_search(self) -> int | None:
+        # Only the first page of a name search walks the HNSW index, the next ones
+        # compare exact distances with the cursor.
+        if self.name and self.config.after is None:
+            return env.HNSW_EF_SEARCH_PRODUCT_NAME
+        return None
 
     def to_statement(self) -> Select:
         stmt = (
             select(Laptop)
-            .where(self.condition_expression())
+            .where(self.condition_expression() & self.after_condition_expression())
             .order_by(*self.order_by_expressions())
             .limit(self.config.limit)
-            .offset(self.config.offset)
         )
 
         return stmt
@@ -221,5 +299,42 @@ class LaptopFilter(BaseModel):
 
 @weave.op(name="search_laptop")
 def search(filter: LaptopFilter) -> list[LaptopModel]:
+    if env.CATALOG_ENGINE_ENABLED:
+        return catalog_search(filter)
+    stmt = filter.to_statement()
+    return search_laptop(stmt, ef_search=filter.ef_search())
+
+
+@weave.op(name="asearch_laptop")
+async def asearch(filter: LaptopFilter) -> list[LaptopModel]:
+    await filter.aload_embeddings()
+    if env.CATALOG_ENGINE_ENABLED:
+        return await catalog_asearch(filter)
     stmt = filter.to_statement()
-    return search_laptop(stmt)
+    return await asearch_laptop(stmt, ef_search=filter.ef_search())
+
+
+@weave.op(name="search_laptop_candidates")
+def search_candidates(filter: LaptopFilter) -> Candidates[LaptopModel]:
+    """
+    The exact page after the filter's cursor and, for when it is empty, the first
+    recommendation page, in one round trip. A recommending filter only gets the
+    recommendation page.
+    """
+    if env.CATALOG_ENGINE_ENABLED:
+        return catalog_search_candidates(filter)
+    stmt = to_candidates_statement(Laptop, filter)
+    return to_candidates(
+        filter, search_laptop_candidates(stmt, ef_search=filter.ef_search())
+    )
+
+
+@weave.op(name="asearch_laptop_candidates")
+async def asearch_candidates(filter: LaptopFilter) -> Candidates[LaptopModel]:
+    await filter.aload_embeddings()
+    if env.CATALOG_ENGINE_ENABLED:
+        return await catalog_asearch_candidates(filter)
+    stmt = to_candidates_statement(Laptop, filter)
+    return to_candidates(
+        filter, await asearch_laptop_candidates(stmt, ef_search=filter.ef_search())
+    )
@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import json
+import threading
+from time import monotonic, sleep, time
+from weakref import WeakValueDictionary
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+from pydantic import BaseModel
+from db import redis, async_redis
+from env import env
+
+_T = TypeVar("_T", bound=BaseModel)
+
+_CACHE_PREFIX = "llm_cache"
+_LOCK_PREFIX = "llm_cache_lock"
+_STATS_KEY = "llm_cache_stats"
+# Cache keys scored by their last use, to evict the least recently used ones.
+_INDEX_KEY = "llm_cache_index"
+_LOCK_TIMEOUT = 60
+_POLL_INTERVAL = 0.05
+
+# Identical requests inside this process wait on the first one instead of
+# asking Redis for the lock again. A lock stays in the dict as long as a request
+# holds or waits on it, so that the requests of a key always share the same one.
+_local_locks: WeakValueDictionary[str, threading.Lock] = WeakValueDictionary()
+_local_locks_guard = threading.Lock()
+_local_futures: dict[str, asyncio.Future] = {}
+
+
+def _canonical(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, type) and issubclass(value, BaseModel):
+        return {"name": value.__name__, "schema": value.model_json_schema()}
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def make_key(**request: Any) -> str:
+    """
+    Content address of a request: the same model, messages, tools and response format
+    always give the same key, whatever the dict ordering.
+    """
+    payload = json.dumps(
+        _canonical(request), sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_key(key: str) -> str:
+    return f"{_CACHE_PREFIX}:{key}"
+
+
+def _lock_key(key: str) -> str:
+    return f"{_LOCK_PREFIX}:{key}"
+
+
+def _record(agent: Optional[str], field: str):
+    redis.hincrby(_STATS_KEY, f"{agent or 'unknown'}:{field}", 1)
+
+
+async def _arecord(agent: Optional[str], field: str):
+    await async_redis.hincrby(_STATS_KEY, f"{agent or 'unknown'}:{field}", 1)
+
+
+def _hit(agent: Optional[str], key: str):
+    pipeline = redis.pipeline()
+    pipeline.hincrby(_STATS_KEY, f"{agent or 'unknown'}:hit", 1)
+    pipeline.zadd(_INDEX_KEY, {key: time()}, xx=True)
+    pipeline.execute()
+
+
+async def _ahit(agent: Optional[str], key: str):
+    pipeline = async_redis.pipeline()
+    pipeline.hincrby(_STATS_KEY, f"{agent or 'unknown'}:hit", 1)
+    pipeline.zadd(_INDEX_KEY, {key: time()}, xx=True)
+    await pipeline.execute()
+
+
+def _store_pipeline(pipeline, key: str, data: str):
+    now = time()
+    pipeline.set(_cache_key(key), data, ex=env.LLM_CACHE_TTL)
+    pipeline.zadd(_INDEX_KEY, {key: now})
+    # Drops the index entries of responses that have expired by now.
+    pipeline.zremrangebyscore(_INDEX_KEY, 0, now - env.LLM_CACHE_TTL)
+    pipeline.zcard(_INDEX_KEY)
+
+
+def _store(key: str, data: str):
+    """
+    Caches a response, then evicts the least recently used ones beyond
+    LLM_CACHE_MAX_ENTRIES.
+    """
+    pipeline = redis.pipeline()
+    _store_pipeline(pipeline, key, data)
+    excess = pipeline.execute()[-1] - env.LLM_CACHE_MAX_ENTRIES
+    evicted = redis.zpopmin(_INDEX_KEY, excess) if excess > 0 else []
+    if evicted:
+        redis.delete(*(_cache_key(member) for member, _ in evicted))  # type: ignore
+
+
+async def _astore(key: str, data: str):
+    pipeline = async_redis.pipeline()
+    _store_pipeline(pipeline, key, data)
+    excess = (await pipeline.execute())[-1] - env.LLM_CACHE_MAX_ENTRIES
+    evicted = await async_redis.zpopmin(_INDEX_KEY, excess) if excess > 0 else []
+    if evicted:
+        await async_redis.delete(*(_cache_key(member) for member, _ in evicted))
+
+
+def _dump(value: BaseModel) -> Optional[str]:
+    data = value.model_dump_json()
+    if len(data.encode("utf-8")) > env.LLM_CACHE_MAX_ENTRY_BYTES:
+        return None
+    return data
+
+
+def get_stats() -> dict[str, dict[str, int]]:
+    """
+    Hit/miss counters grouped by agent.
+    """
+    stats: dict[str, dict[str, int]] = {}
+    for field, count in redis.hgetall(_STATS_KEY).items():  # type: ignore
+        agent, _, name = field.rpartition(":")
+        stats.setdefault(agent, {"hit": 0, "miss": 0})[name] = int(count)
+    return stats
+
+
+def get_or_create(
+    key: str,
+    create: Callable[[], _T],
+    load: Callable[[str], _T],
+    agent: Optional[str] = None,
+) -> _T:
+    with _local_locks_guard:
+        local_lock = _local_locks.get(key)
+        if local_lock is None:
+            local_lock = _local_locks[key] = threading.Lock()
+
+    with local_lock:
+        return _get_or_create(key, create, load, agent)
+
+
+def _get_or_create(
+    key: str,
+    create: Callable[[], _T],
+    load: Callable[[str], _T],
+    agent: Optional[str] = None,
+) -> _T:
+    cached = redis.get(_cache_key(key))
+    if cached is not None:
+        _hit(agent, key)
+        return load(cached)  # type: ignore
+
+    # Another worker is computing the same request, wait for its result.
+    deadline = monotonic() + _LOCK_TIMEOUT
+    while not (
+        owns_lock := redis.set(_lock_key(key), 1, nx=True, ex=_LOCK_TIMEOUT)
+    ):
+        if monotonic() > deadline:
+            break
+        sleep(_POLL_INTERVAL)
+        cached = redis.get(_cache_key(key))
+        if cached is not None:
+            _hit(agent, key)
+            return load(cached)  # type: ignore
+
+    _record(agent, "miss")
+    try:
+        value = create()
+        data = _dump(value)
+        if data is not None:
+            _store(key, data)
+        return value
+    finally:
+        if owns_lock:
+            redis.delete(_lock_key(key))
+
+
+async def aget_or_create(
+    key: str,
+    create: Callable[[], Awaitable[_T]],
+    load: Callable[[str], _T],
+    agent: Optional[str] = None,
+) -> _T:
+    while (pending := _local_futures.get(key)) is not None:
+        try:
+            value = await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            # The request this one waited on was cancelled, not this one: it asks
+            # again, and runs the request itself if nobody else has started it.
+            if not pending.cancelled():
+                raise
+            continue
+        await _arecord(agent, "hit")
+        return value
+
+    future = asyncio.get_running_loop().create_future()
+    _local_futures[key] = future
+    try:
+        value = await _aget_or_create(key, create, load, agent)
+        future.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Nobody else may be waiting, don't leave an unretrieved exception behind.
+        future.exception()
+        raise
+    finally:
+        _local_futures.pop(key, None)
+
+
+async def _aget_or_create(
+    key: str,
+    create: Callable[[], Awaitable[_T]],
+    load: Callable[[str], _T],
+    agent: Optional[str] = None,
+) -> _T:
+    cached = await async_redis.get(_cache_key(key))
+    if cached is not None:
+        await _ahit(agent, key)
+        return load(cached)
+
+    deadline = monotonic() + _LOCK_TIMEOUT
+    while not (
+        owns_lock := await async_redis.set(_lock_key(key), 1, nx=True, ex=_LOCK_TIMEOUT)
+    ):
+        if monotonic() > deadline:
+            break
+        await asyncio.sleep(_POLL_INTERVAL)
+        cached = await async_redis.get(_cache_key(key))
+        if cached is not None:
+            await _ahit(agent, key)
+            return load(cached)
+
+    await _arecord(agent, "miss")
+    try:
+        value = await create()
+        data = _dump(value)
+        if data is not None:
+            await _astore(key, data)
+        return value
+    finally:
+        if owns_lock:
+            await async_redis.delete(_lock_key(key))
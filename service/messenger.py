@@ -1,3 +1,4 @@
+import time
 from typing import Optional
 import fbmessenger as fb
 from env import env
@@ -17,7 +18,20 @@ from repositories.user import (
 )
 from models.user import UserModel, CreateUserModel, UserRole
 from models.thread import ThreadModel, CreateThreadModel
-from service.store_chatbot_v2 import gen_answer
+from service.store_chatbot_v2 import gen_answer, fold_thread
+from service.thread_state import (
+    ThreadState,
+    load as load_thread_state,
+    store_messages as store_thread_messages,
+    append_messages as append_thread_messages,
+)
+from service.thread_turns import (
+    start as start_thread_turn,
+    is_superseded as is_thread_turn_superseded,
+    lock as lock_thread,
+)
+import service.messenger_queue as messenger_queue
+from db import unit_of_work
 
 fb.DEFAULT_API_VERSION = env.FB_API_VERSION
 
@@ -44,11 +58,34 @@ class Messenger(fb.BaseMessenger):
         super().__init__(page_access_token=env.FB_PAGE_ACCESS_TOKEN)
 
     def message(self, message):
-        if self.message_is_exists(message):
+        turn = self.record_message(message)
+        if turn is None:
+            return
+
+        fb_user_id, user, thread, generation = turn
+        if env.MESSENGER_QUEUE_ENABLED:
+            messenger_queue.enqueue_answer(fb_user_id, user, thread, generation)
             return
+        # Waited out of the event's unit of work, so no connection is held meanwhile.
+        time.sleep(env.MESSENGER_DEBOUNCE_SECONDS)
+        self.answer(fb_user_id, user, thread, generation)
+
+    # One connection for the lookups and the messages of the event.
+    @unit_of_work()
+    def record_message(
+        self, message
+    ) -> Optional[tuple[str, UserModel, ThreadModel, int]]:
+        """
+        Stores the event's message, then starts the thread's turn it calls for if any:
+        the id of the user to answer, the user, the thread and the turn's generation.
+        """
+        if self.message_is_exists(message):
+            return None
 
-        sender_id = self.get_user_id()
-        recipient_id = self.get_recipient_id()
+        # Read from the event rather than from last_message: the webhook handles
+        # deliveries concurrently on this shared instance.
+        sender_id = message["sender"]["id"]
+        recipient_id = message["recipient"]["id"]
         is_echo = message.get("message", {}).get("is_echo", False)
         app_id = message.get("message", {}).get("app_id", None)
         user = None
@@ -70,25 +107,63 @@ class Messenger(fb.BaseMessenger):
             self.create_page_admin_message(message, thread)
 
         if page_admin_is_sender:
-            return
+            return None
 
         message = self.create_user_message(message, thread)
 
         if not thread.is_active:
+            return None
+
+        # Each message supersedes the turn of the one before, so a burst of messages
+        # gets one answer: the turn of its last message, which reads them all.
+        return fb_user_id, user, thread, start_thread_turn(thread.id)
+
+    def answer(
+        self, fb_user_id: str, user: UserModel, thread: ThreadModel, generation: int
+    ):
+        """
+        Answers the thread's messages, one turn of the thread at a time. Nothing is
+        answered or written once a later message superseded the turn, before it started
+        or while it ran: the later message's turn answers them all.
+        """
+        if is_thread_turn_superseded(thread.id, generation):
             return
 
-        history = self.get_openai_message(thread)
-        answer = gen_answer(thread_id=thread.id, user_id=user.id, history=history)
+        # Locked before the unit of work, so the turns waiting hold no connection.
+        with lock_thread(thread.id):
+            self.answer_turn(fb_user_id, user, thread, generation)
+
+    @unit_of_work()
+    def answer_turn(
+        self, fb_user_id: str, user: UserModel, thread: ThreadModel, generation: int
+    ):
+        # Checked again, the turn may have waited for the lock.
+        if is_thread_turn_superseded(thread.id, generation):
+            return
+        thread_state = load_thread_state(thread.id)
+        history, history_offset = self.get_history(thread, thread_state)
+        answer = gen_answer(
+            thread_id=thread.id,
+            user_id=user.id,
+            history=history,
+            history_offset=history_offset,
+            thread_state=thread_state,
+            is_superseded=lambda: is_thread_turn_superseded(thread.id, generation),
+        )
+        if is_thread_turn_superseded(thread.id, generation):
+            return
         chatbot_message = self.create_chatbot_message(answer, thread)
-        self.send(
-            {
-                "text": chatbot_message.content,
-            }
+        # Sent to the user directly, the turn may run outside of the event's handling.
+        self.client.send({"text": chatbot_message.content}, fb_user_id, "RESPONSE")
+        # Once the answer is out, still holding the lock so that the next turn reads
+        # the new summary.
+        fold_thread(
+            user.id,
+            thread.id,
+            [*history, self.to_openai_message(chatbot_message)],
+            history_offset,
         )
 
-    def get_recipient_id(self):
-        return self.last_message["recipient"]["id"]
-
     def create_page_admin_message(
         self, message: dict, thread: ThreadModel
     ) -> MessageModel:
@@ -102,7 +177,7 @@ class Messenger(fb.BaseMessenger):
             fb_message_id=mid,
         )
 
-        return create_message(new_message)
+        return self.store_message(new_message)
 
     def create_user_message(self, message: dict, thread: ThreadModel) -> MessageModel:
         text = message.get("message", {}).get("text")
@@ -115,7 +190,7 @@ class Messenger(fb.BaseMessenger):
             fb_message_id=mid,
         )
 
-        return create_message(new_message)
+        return self.store_message(new_message)
 
     def create_chatbot_message(self, message: str, thread: ThreadModel) -> MessageModel:
         new_message = CreateMessageModel(
@@ -124,7 +199,13 @@ class Messenger(fb.BaseMessenger):
             type=MessageType.bot,
         )
 
-        return create_message(new_message)
+        return self.store_message(new_message)
+
+    def store_message(self, data: CreateMessageModel) -> MessageModel:
+        # Written through to the cached messages of the thread, if they are cached.
+        message = create_message(data)
+        append_thread_messages(message.thread_id, [self.to_openai_message(message)])
+        return message
 
     def get_fb_user_profile(
         self, fb_user_id: str, fields=None, timeout=None
@@ -137,7 +218,7 @@ class Messenger(fb.BaseMessenger):
 
         if not user_profile:
             return UserProfile(
-                id=self.get_user_id(),
+                id=fb_user_id,
             )
         print(user_profile)
 
@@ -178,23 +259,39 @@ class Messenger(fb.BaseMessenger):
         return get_message_by_fb_message_id(mid) is not None
 
     def get_openai_message(
-        self, thread: ThreadModel, limit: int = 10
+        self, thread: ThreadModel, limit: int | None = None
     ) -> list[ChatCompletionMessageParam]:
-        messages = get_all_messages(thread.id)
-        return [
-            (
-                ChatCompletionUserMessageParam(
-                    role="user",
-                    content=message.content,
-                )
-                if message.type == MessageType.user
-                else ChatCompletionAssistantMessageParam(
-                    role="assistant",
-                    content=message.content,
-                )
+        # The whole thread by default: gen_answer windows it by tokens and keeps the
+        # summary's message count aligned with the thread.
+        messages = get_all_messages(thread.id, limit=limit)
+        return [self.to_openai_message(message) for message in messages]
+
+    def get_history(
+        self, thread: ThreadModel, thread_state: ThreadState
+    ) -> tuple[list[ChatCompletionMessageParam], int]:
+        """
+        Messages of the thread for gen_answer and the position of the first one in the
+        thread: the cached latest messages when they reach back to the summarized part,
+        the whole thread from Postgres otherwise, then cached for the next turns.
+        """
+        history = thread_state.history()
+        if history is not None:
+            return history
+
+        messages = self.get_openai_message(thread)
+        store_thread_messages(thread.id, messages, thread_state.messages_version)
+        return messages, 0
+
+    def to_openai_message(self, message: MessageModel) -> ChatCompletionMessageParam:
+        if message.type == MessageType.user:
+            return ChatCompletionUserMessageParam(
+                role="user",
+                content=message.content,
             )
-            for message in messages
-        ]
+        return ChatCompletionAssistantMessageParam(
+            role="assistant",
+            content=message.content,
+        )
 
 
 messenger = Messenger()
@@ -0,0 +1,105 @@
+import zlib
+from datetime import timedelta
+from typing import Any
+from rq import Queue, SimpleWorker
+from db import queue_redis
+from env import env
+from repositories.redis import set_value_if_absent, delete_value
+from models.user import UserModel
+from models.thread import ThreadModel
+import service.demand_classifier as demand_classifier
+from service.conversation_window import load_encoding
+
+
+def queue_name(shard: int) -> str:
+    return f"messenger-{shard}"
+
+
+def _customer_id(event: dict[str, Any]) -> str:
+    # A conversation is between the page and one customer, whichever of them sends.
+    sender_id = event["sender"]["id"]
+    return event["recipient"]["id"] if sender_id == env.FB_PAGE_ID else sender_id
+
+
+def _queue(customer_id: str) -> Queue:
+    # The jobs of a conversation always go to the same queue, whose single worker
+    # runs them in order. crc32 rather than hash(), which differs between processes.
+    shard = zlib.crc32(customer_id.encode()) % env.MESSENGER_QUEUE_SHARDS
+    return Queue(queue_name(shard), connection=queue_redis)
+
+
+def _event_key(event: dict[str, Any]) -> str | None:
+    mid = event["message"].get("mid")
+    return None if mid is None else f"messenger_event:{mid}"
+
+
+def _is_new(key: str | None) -> bool:
+    # Facebook delivers again the events it didn't get an answer for in time.
+    return key is None or set_value_if_absent(key, 1)
+
+
+def enqueue(payload: dict[str, Any]) -> int:
+    """
+    Queues each message event of a webhook payload not queued before, returns how
+    many were. The other events are ignored, as Messenger doesn't handle them. Raises
+    when an event couldn't be queued, which is then left for Facebook to deliver again.
+    """
+    queued = 0
+    for entry in payload.get("entry", []):
+        for event in entry.get("messaging", []):
+            if not event.get("message"):
+                continue
+            key = _event_key(event)
+            if not _is_new(key):
+                continue
+            try:
+                _queue(_customer_id(event)).enqueue(handle_event, event)
+            except Exception:
+                if key is not None:
+                    delete_value(key)
+                raise
+            queued += 1
+    return queued
+
+
+def enqueue_answer(
+    fb_user_id: str, user: UserModel, thread: ThreadModel, generation: int
+):
+    """
+    Queues the turn answering the thread once MESSENGER_DEBOUNCE_SECONDS have passed,
+    so that the messages sent meanwhile supersede it and are answered together.
+    """
+    queue = _queue(fb_user_id)
+    args = (fb_user_id, user, thread, generation)
+    delay = timedelta(seconds=env.MESSENGER_DEBOUNCE_SECONDS)
+    if delay:
+        queue.enqueue_in(delay, answer, *args)
+    else:
+        queue.enqueue(answer, *args)
+
+
+# service.messenger queues the answers through this module, the jobs import it late.
+def handle_event(event: dict[str, Any]):
+    from service.messenger import messenger
+
+    messenger.handle({"object": "page", "entry": [{"messaging": [event]}]})
+
+
+def answer(fb_user_id: str, user: UserModel, thread: ThreadModel, generation: int):
+    from service.messenger import messenger
+
+    messenger.answer(fb_user_id, user, thread, generation)
+
+
+def run_worker(shard: int):
+    """
+    Handles the events of one queue in order. A SimpleWorker runs the jobs in its own
+    process, so the database pools and loaded models are kept from one job to the next.
+    Its scheduler queues the debounced answers when they are due.
+    """
+    if env.DEMAND_CLASSIFIER_ENABLED:
+        demand_classifier.load()
+    load_encoding()
+    SimpleWorker(
+        [Queue(queue_name(shard), connection=queue_redis)], connection=queue_redis
+    ).work(with_scheduler=True)
@@ -1,39 +1,224 @@
+import asyncio
+import random
+import threading
 from time import sleep
-from typing import Iterable, Optional
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Optional,
+    TypeVar,
+)
 from uuid import UUID
 
+import httpx
 import openai
 from pydantic import BaseModel, ConfigDict
 from env import env
-from openai import NotGiven, OpenAI, NOT_GIVEN, RateLimitError, APITimeoutError
+from openai import (
+    AsyncOpenAI,
+    NotGiven,
+    OpenAI,
+    NOT_GIVEN,
+    RateLimitError,
+    APIConnectionError,
+    APIStatusError,
+)
 import json
 from openai.types.chat import (
+    ChatCompletion,
     ChatCompletionMessageParam,
     ChatCompletionToolMessageParam,
     ChatCompletionToolParam,
+    ParsedChatCompletion,
 )
+from service.rate_limiter import acquire, aacquire
+import service.llm_cache as llm_cache
+import service.prompt_cache as prompt_cache
 
+_T = TypeVar("_T")
 
 # _chat_model = "gpt-4o-mini"
 _chat_model = "gpt-4o-mini-2024-07-18"
+
+# One pooled HTTP/2 connection set per process, shared by chat and embedding calls.
+# Retries are handled below so they go through the shared rate limiter.
+_http_limits = httpx.Limits(
+    max_connections=env.OPENAI_MAX_CONNECTIONS,
+    max_keepalive_connections=env.OPENAI_MAX_CONNECTIONS,
+    keepalive_expiry=60,
+)
 _client = OpenAI(
     api_key=env.OPENAI_API_KEY,
+    max_retries=0,
+    http_client=httpx.Client(http2=True, limits=_http_limits),
+)
+_async_client = AsyncOpenAI(
+    api_key=env.OPENAI_API_KEY,
+    max_retries=0,
+    http_client=httpx.AsyncClient(http2=True, limits=_http_limits),
 )
 
 _embedding_model = "text-embedding-3-small"
 
+_stage_concurrency = {
+    "chat": env.OPENAI_CHAT_CONCURRENCY,
+    "embedding": env.OPENAI_EMBEDDING_CONCURRENCY,
+}
+_stage_semaphores = {
+    stage: threading.BoundedSemaphore(limit)
+    for stage, limit in _stage_concurrency.items()
+}
+_async_stage_semaphores = {
+    stage: asyncio.Semaphore(limit) for stage, limit in _stage_concurrency.items()
+}
+
+_MAX_BACKOFF = 20
+# The statuses the SDK retries by itself: timeout, lock conflict, rate limit and
+# server errors. Its retries are disabled so that they go through the rate limiter.
+_RETRYABLE_STATUS_CODES = {408, 409, 429}
+# Completion length isn't known before the call, reserve a typical answer size.
+_COMPLETION_TOKENS_ESTIMATE = 512
+
+
+def estimate_tokens(texts: Iterable[Any]) -> int:
+    return sum(len(str(text)) for text in texts) // 4 + 1
+
+
+def _estimate_chat_tokens(messages: list[ChatCompletionMessageParam]) -> int:
+    return (
+        estimate_tokens(message.get("content") or "" for message in messages)
+        + _COMPLETION_TOKENS_ESTIMATE
+    )
+
+
+def _should_retry(error: openai.OpenAIError) -> bool:
+    # APITimeoutError is an APIConnectionError.
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and (
+        error.status_code in _RETRYABLE_STATUS_CODES or error.status_code >= 500
+    )
+
+
+def _backoff_time(
+    error: openai.OpenAIError, retries: int, backoff_factor: float
+) -> float:
+    if isinstance(error, RateLimitError):
+        retry_after = error.response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), _MAX_BACKOFF) + random.uniform(0, 1)
+            except ValueError:
+                pass
+    # Full jitter, capped so a worker never sleeps for minutes.
+    return random.uniform(0, min(_MAX_BACKOFF, backoff_factor * 2**retries))
+
+
+def call_with_retries(
+    func: Callable[[], _T],
+    stage: str,
+    model: str,
+    tokens: int,
+    max_retries: int = 5,
+    backoff_factor: float = 1,
+) -> _T:
+    retries = 0
+    while True:
+        acquire(model, tokens)
+        try:
+            with _stage_semaphores[stage]:
+                return func()
+        except openai.OpenAIError as e:
+            if not _should_retry(e):
+                print(f"OpenAI API error: {e}")
+                raise
+            if retries >= max_retries:
+                raise Exception(
+                    f"Failed after {max_retries} retries: {type(e).__name__}."
+                ) from e
+            wait_time = _backoff_time(e, retries, backoff_factor)
+            retries += 1
+            print(
+                f"{type(e).__name__}. Retry {retries}/{max_retries} "
+                f"in {wait_time:.2f}s."
+            )
+            sleep(wait_time)
+
+
+async def acall_with_retries(
+    func: Callable[[], Awaitable[_T]],
+    stage: str,
+    model: str,
+    tokens: int,
+    max_retries: int = 5,
+    backoff_factor: float = 1,
+) -> _T:
+    retries = 0
+    while True:
+        await aacquire(model, tokens)
+        try:
+            async with _async_stage_semaphores[stage]:
+                return await func()
+        except openai.OpenAIError as e:
+            if not _should_retry(e):
+                print(f"OpenAI API error: {e}")
+                raise
+            if retries >= max_retries:
+                raise Exception(
+                    f"Failed after {max_retries} retries: {type(e).__name__}."
+                ) from e
+            wait_time = _backoff_time(e, retries, backoff_factor)
+            retries += 1
+            print(
+                f"{type(e).__name__}. Retry {retries}/{max_retries} "
+                f"in {wait_time:.2f}s."
+            )
+            await asyncio.sleep(wait_time)
+
+
+def create_embeddings(
+    texts: list[str],
+    model=_embedding_model,
+    dimensions: int | NotGiven = NOT_GIVEN,
+) -> list[list[float]]:
+    texts = [text.replace("\n", " ") for text in texts]
+    response = call_with_retries(
+        lambda: _client.embeddings.create(
+            input=texts, model=model, dimensions=dimensions
+        ),
+        stage="embedding",
+        model=model,
+        tokens=estimate_tokens(texts),
+    )
+    return [item.embedding for item in response.data]
+
+
+async def acreate_embeddings(
+    texts: list[str],
+    model=_embedding_model,
+    dimensions: int | NotGiven = NOT_GIVEN,
+) -> list[list[float]]:
+    texts = [text.replace("\n", " ") for text in texts]
+    response = await acall_with_retries(
+        lambda: _async_client.embeddings.create(
+            input=texts, model=model, dimensions=dimensions
+        ),
+        stage="embedding",
+        model=model,
+        tokens=estimate_tokens(texts),
+    )
+    return [item.embedding for item in response.data]
+
 
 def get_embedding(text, model=_embedding_model):
-    text = text.replace("\n", " ")
-    return _client.embeddings.create(input=[text], model=model).data[0].embedding
+    return create_embeddings([text], model=model)[0]
 
 
 def get_list_embedding(texts, model=_embedding_model):
-    texts = [text.replace("\n", " ") for text in texts]
-    return [
-        item.embedding
-        for item in _client.embeddings.create(input=texts, model=model).data
-    ]
+    return create_embeddings(texts, model=model)
 
 
 class OpenAIChatCompletionsRequest(BaseModel):
@@ -42,36 +227,112 @@ class OpenAIChatCompletionsRequest(BaseModel):
     messages: list[ChatCompletionMessageParam]
     model: str
     tools: list[ChatCompletionToolParam] | NotGiven = NOT_GIVEN
+    response_format: dict[str, Any] | NotGiven = NOT_GIVEN
     temperature: float
     timeout: int
+    agent: Optional[str] = None
+    use_cache: bool = True
 
-    def create(self, max_retries=5, backoff_factor=3):
-        retries = 0
-        while retries < max_retries:
-            try:
-                if not self.tools or self.tools == NOT_GIVEN:
-                    return _client.chat.completions.create(
-                        messages=self.messages,
-                        model=self.model,
-                        temperature=self.temperature,
-                        timeout=self.timeout,
-                    )
-                return _client.chat.completions.create(
-                    messages=self.messages,
-                    model=self.model,
-                    tools=self.tools,
-                    temperature=self.temperature,
-                    timeout=self.timeout,
-                )
-            except (RateLimitError, APITimeoutError) as e:
-                retries += 1
-                wait_time = backoff_factor**retries
-                print(f"Rate limit hit. Retry {retries}/{max_retries} in {wait_time}s.")
-                sleep(wait_time)
-            except openai.OpenAIError as e:
-                print(f"OpenAI API error: {e}")
-                raise
-        raise Exception(f"Failed after {max_retries} retries due to rate limit.")
+    def _get_create_kwargs(self) -> dict:
+        kwargs = {
+            "messages": self.messages,
+            "model": self.model,
+            "temperature": self.temperature,
+            "timeout": self.timeout,
+        }
+        if self.tools and self.tools != NOT_GIVEN:
+            kwargs["tools"] = self.tools
+        if self.response_format and self.response_format != NOT_GIVEN:
+            kwargs["response_format"] = self.response_format
+        return kwargs
+
+    def _is_cacheable(self) -> bool:
+        # Only deterministic requests can be answered from the cache.
+        return self.use_cache and self.temperature == 0
+
+    def _cache_key(self) -> str:
+        request: dict[str, Any] = {
+            "endpoint": "chat.completions.create",
+            "model": self.model,
+            "messages": self.messages,
+            "tools": self.tools if self.tools != NOT_GIVEN else None,
+        }
+        # Only keyed when given, so the keys of plain requests stay the same.
+        if self.response_format != NOT_GIVEN:
+            request["response_format"] = self.response_format
+        return llm_cache.make_key(**request)
+
+    def create(self, max_retries=5, backoff_factor=1) -> ChatCompletion:
+        def create() -> ChatCompletion:
+            response = call_with_retries(
+                lambda: _client.chat.completions.create(**self._get_create_kwargs()),
+                stage="chat",
+                model=self.model,
+                tokens=_estimate_chat_tokens(self.messages),
+                max_retries=max_retries,
+                backoff_factor=backoff_factor,
+            )
+            prompt_cache.record_usage(self.agent, response.usage)
+            return response
+
+        if not self._is_cacheable():
+            return create()
+
+        return llm_cache.get_or_create(
+            self._cache_key(),
+            create,
+            ChatCompletion.model_validate_json,
+            agent=self.agent,
+        )
+
+    async def acreate(self, max_retries=5, backoff_factor=1) -> ChatCompletion:
+        async def acreate() -> ChatCompletion:
+            response = await acall_with_retries(
+                lambda: _async_client.chat.completions.create(
+                    **self._get_create_kwargs()
+                ),
+                stage="chat",
+                model=self.model,
+                tokens=_estimate_chat_tokens(self.messages),
+                max_retries=max_retries,
+                backoff_factor=backoff_factor,
+            )
+            await prompt_cache.arecord_usage(self.agent, response.usage)
+            return response
+
+        if not self._is_cacheable():
+            return await acreate()
+
+        return await llm_cache.aget_or_create(
+            self._cache_key(),
+            acreate,
+            ChatCompletion.model_validate_json,
+            agent=self.agent,
+        )
+
+    async def astream(self, max_retries=5, backoff_factor=1) -> AsyncIterator[str]:
+        """
+        Yields the completion's content as it is generated. Streams are not cached, and
+        retries only cover opening the stream.
+        """
+        stream = await acall_with_retries(
+            lambda: _async_client.chat.completions.create(
+                **self._get_create_kwargs(),
+                stream=True,
+                stream_options={"include_usage": True},
+            ),
+            stage="chat",
+            model=self.model,
+            tokens=_estimate_chat_tokens(self.messages),
+            max_retries=max_retries,
+            backoff_factor=backoff_factor,
+        )
+        async for chunk in stream:
+            # The usage comes in a last chunk without choices.
+            if chunk.usage:
+                await prompt_cache.arecord_usage(self.agent, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
 
 class OpenAIChatCompletionsParse(BaseModel):
@@ -82,24 +343,72 @@ class OpenAIChatCompletionsParse(BaseModel):
     temperature: int = 0
     timeout: int = 60
     response_format: type
+    agent: Optional[str] = None
+    use_cache: bool = True
 
-    def parse(self, max_retries=5, backoff_factor=3):
-        retries = 0
-        while retries < max_retries:
-            try:
-                return _client.beta.chat.completions.parse(
-                    messages=self.messages,
-                    model=self.model,
-                    response_format=self.response_format,
-                    temperature=self.temperature,
-                    timeout=self.timeout,
-                )
-            except (RateLimitError, APITimeoutError) as e:
-                retries += 1
-                wait_time = backoff_factor**retries
-                print(f"Rate limit hit. Retry {retries}/{max_retries} in {wait_time}s.")
-                sleep(wait_time)
-            except openai.OpenAIError as e:
-                print(f"OpenAI API error: {e}")
-                raise
-        raise Exception(f"Failed after {max_retries} retries due to rate limit.")
+    def _get_parse_kwargs(self) -> dict:
+        return {
+            "messages": self.messages,
+            "model": self.model,
+            "response_format": self.response_format,
+            "temperature": self.temperature,
+            "timeout": self.timeout,
+        }
+
+    def _is_cacheable(self) -> bool:
+        return self.use_cache and self.temperature == 0
+
+    def _cache_key(self) -> str:
+        return llm_cache.make_key(
+            endpoint="beta.chat.completions.parse",
+            model=self.model,
+            messages=self.messages,
+            response_format=self.response_format,
+        )
+
+    def _load_cached(self, data: str) -> ParsedChatCompletion:
+        return ParsedChatCompletion[self.response_format].model_validate_json(data)  # type: ignore
+
+    def parse(self, max_retries=5, backoff_factor=1) -> ParsedChatCompletion:
+        def parse() -> ParsedChatCompletion:
+            response = call_with_retries(
+                lambda: _client.beta.chat.completions.parse(
+                    **self._get_parse_kwargs()
+                ),
+                stage="chat",
+                model=self.model,
+                tokens=_estimate_chat_tokens(self.messages),
+                max_retries=max_retries,
+                backoff_factor=backoff_factor,
+            )
+            prompt_cache.record_usage(self.agent, response.usage)
+            return response
+
+        if not self._is_cacheable():
+            return parse()
+
+        return llm_cache.get_or_create(
+            self._cache_key(), parse, self._load_cached, agent=self.agent
+        )
+
+    async def aparse(self, max_retries=5, backoff_factor=1) -> ParsedChatCompletion:
+        async def aparse() -> ParsedChatCompletion:
+            response = await acall_with_retries(
+                lambda: _async_client.beta.chat.completions.parse(
+                    **self._get_parse_kwargs()
+                ),
+                stage="chat",
+                model=self.model,
+                tokens=_estimate_chat_tokens(self.messages),
+                max_retries=max_retries,
+                backoff_factor=backoff_factor,
+            )
+            await prompt_cache.arecord_usage(self.agent, response.usage)
+            return response
+
+        if not self._is_cacheable():
+            return await aparse()
+
+        return await llm_cache.aget_or_create(
+            self._cache_key(), aparse, self._load_cached, agent=self.agent
+        )
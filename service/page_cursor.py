@@ -0,0 +1,48 @@
+from typing import Any, Optional
+from uuid import UUID
+
+from pydantic import BaseModel
+
+from repositories.redis import get_value, set_value, aget_value, aset_value
+
+
+class PageCursor(BaseModel):
+    """
+    Bounds of the product page shown last in the thread, as sort keys of the filter
+    that listed it (see `sort_key_expressions`). A None start is the top of the list.
+    `listing` tells which list they belong to (see `candidates.listing_key`): sort keys
+    have another shape and meaning in another list.
+    """
+
+    listing: Optional[str] = None
+    start: Optional[list[Any]] = None
+    end: Optional[list[Any]] = None
+
+    def next_page(self) -> "PageCursor":
+        return PageCursor(listing=self.listing, start=self.end)
+
+
+def key(thread_id: UUID) -> str:
+    return f"cursor:{thread_id}"
+
+
+def parse(value) -> PageCursor:
+    if not value:
+        return PageCursor()
+    return PageCursor.model_validate_json(value)
+
+
+def load(thread_id: UUID) -> PageCursor:
+    return parse(get_value(key(thread_id)))
+
+
+async def aload(thread_id: UUID) -> PageCursor:
+    return parse(await aget_value(key(thread_id)))
+
+
+def save(thread_id: UUID, cursor: PageCursor):
+    set_value(key(thread_id), cursor.model_dump_json())
+
+
+async def asave(thread_id: UUID, cursor: PageCursor):
+    await aset_value(key(thread_id), cursor.model_dump_json())
@@ -1,6 +1,7 @@
 from enum import Enum
-from pydantic import BaseModel, ConfigDict, field_validator
+from pydantic import BaseModel, ConfigDict, PrivateAttr, field_validator
 from sqlalchemy import Select, any_, select, text, true, case, func, literal, alias
+from sqlalchemy import tuple_
 from sqlalchemy.orm import noload, contains_eager
 from models.phone import Phone, PhoneModel
 from models.user_memory import NumericConfiguration
@@ -9,9 +10,30 @@ from sqlalchemy.sql.expression import and_
 from sqlalchemy.sql.operators import OperatorType, ge, le, eq, Operators
 from sqlalchemy.sql.elements import ColumnElement
 from typing import Any, Generic, TypeVar, Union
-from repositories.phone import search as search_phone
-from service.embedding import get_embedding
-from pgvector.sqlalchemy import Vector
+from repositories.phone import (
+    search as search_phone,
+    asearch as asearch_phone,
+    search_candidates as search_phone_candidates,
+    asearch_candidates as asearch_phone_candidates,
+)
+from service.candidates import (
+    Candidates,
+    from_rows as to_candidates,
+    to_statement as to_candidates_statement,
+)
+from service.embedding import (
+    get_embedding,
+    aget_embedding,
+    with_prefix,
+    PHONE_NAME_PREFIX,
+)
+from service.catalog import (
+    search_phones as catalog_search,
+    asearch_phones as catalog_asearch,
+    search_phone_candidates as catalog_search_candidates,
+    asearch_phone_candidates as catalog_asearch_candidates,
+)
+from env import env
 import weave
 
 _T = TypeVar("_T")
@@ -85,7 +107,8 @@ class FilterType(str, Enum):
 class Config(BaseModel):
     threshold: float = 0.75
     limit: int = 4
-    offset: int = 0
+    # Sort key of the last row already listed, the page starts after it.
+    after: list[Any] | None = None
     is_recommending: bool = False
     recommend_priority: list[FilterType] = [
         FilterType.BRAND,
@@ -103,6 +126,29 @@ class PhoneFilter(BaseModel):
     rom: NumericConfiguration | None = None
     color: str | None = None
     name: str | None = None
+    _embeddings: dict[str, list[float]] = PrivateAttr(default_factory=dict)
+
+    def _name_text(self) -> str:
+        return with_prefix(PHONE_NAME_PREFIX, self.name or "")
+
+    def _get_embedding(self, text: str) -> list[float]:
+        if text not in self._embeddings:
+            self._embeddings[text] = get_embedding(text)
+        return self._embeddings[text]
+
+    def name_embedding(self) -> list[float] | None:
+        return self._get_embedding(self._name_text()) if self.name else None
+
+    async def aload_embeddings(self) -> None:
+        """
+        Pre-compute the name embeddings so that building the statement does not block the event loop.
+        """
+        if not self.name:
+            return
+
+        text = self._name_text()
+        if text not in self._embeddings:
+            self._embeddings[text] = await aget_embedding(text)
 
     def get_price_condition_expression(self) -> ColumnElement[bool]:
         filters = []
@@ -191,9 +237,9 @@ class PhoneFilter(BaseModel):
         if not self.name:
             return true()
 
-        embedding = get_embedding(f"Phone Name: {self.name}")
+        embedding = self._get_embedding(self._name_text())
         filters = FilterAttribute(
-            column=Phone.name_embedding.cast(Vector).cosine_distance(embedding),
+            column=Phone.name_embedding.cosine_distance(embedding),
             operator=le,
             value=1 - self.config.threshold,
         )
@@ -287,23 +333,48 @@ class PhoneFilter(BaseModel):
 
         return score
 
-    def order_by_expressions(self) -> list[ColumnElement]:
-        is_recommending = self.config.is_recommending
-
+    def sort_key_expressions(self) -> list[ColumnElement]:
+        """
+        What the results are ranked by, the id last so that the order is total and a
+        page can start right after the last row of the previous one.
+        """
         if self.name:
             return [
-                Phone.name_embedding.cast(Vector)
-                .cosine_distance(get_embedding(f"Phone name: {self.name}"))
-                .asc(),
+                Phone.name_embedding.cosine_distance(
+                    self._get_embedding(self._name_text())
+                ),
+                Phone.id,
             ]
 
-        if is_recommending:
-            return [
-                self.score_expression().desc(),
-                Phone.score.expression.desc(),
-            ]
+        if self.config.is_recommending:
+            return [self.score_expression(), Phone.score.expression, Phone.id]
+
+        return [Phone.score.expression, Phone.id]
+
+    def is_descending(self) -> bool:
+        # Names are ranked by ascending distance, the rest by descending score.
+        return not self.name
+
+    def order_by_expressions(self) -> list[ColumnElement]:
+        # The whole sort key, the id breaking ties of equal distances or scores, in
+        # the order `after_condition_expression` compares it.
+        sort_keys = self.sort_key_expressions()
+        if not self.is_descending():
+            if self.config.after is None:
+                # The HNSW index only serves an ORDER BY on the distance alone, kept
+                # for the first page of a name search. Rows at exactly the distance
+                # of its last row may then be skipped by the next page.
+                return [sort_keys[0].asc()]
+            return [sort_key.asc() for sort_key in sort_keys]
+        return [sort_key.desc() for sort_key in sort_keys]
+
+    def after_condition_expression(self) -> ColumnElement[bool]:
+        if self.config.after is None:
+            return true()
 
-        return [Phone.score.expression.desc()]
+        sort_key = tuple_(*self.sort_key_expressions())
+        after = tuple_(*(literal(value) for value in self.config.after))
+        return sort_key < after if self.is_descending() else sort_key > after
 
     def __eq__(self, value: object) -> bool:
         if not isinstance(value, PhoneFilter):
@@ -315,13 +386,19 @@ class PhoneFilter(BaseModel):
             and self.brand_code == value.brand_code
         )
 
+    def ef_search(self) -> int | None:
+        # Only the first page of a name search walks the HNSW index, the next ones
+        # compare exact distances with the cursor.
+        if self.name and self.config.after is None:
+            return env.HNSW_EF_SEARCH_PRODUCT_NAME
+        return None
+
     def to_statement(self) -> Select:
         stmt = (
             select(Phone)
-            .where(self.condition_expression())
+            .where(self.condition_expression() & self.after_condition_expression())
             .order_by(*self.order_by_expressions())
             .limit(self.config.limit)
-            .offset(self.config.offset)
         )
 
         return stmt
@@ -329,5 +406,42 @@ class PhoneFilter(BaseModel):
 
 @weave.op(name="search_phone")
 def search(filter: PhoneFilter) -> list[PhoneModel]:
+    if env.CATALOG_ENGINE_ENABLED:
+        return catalog_search(filter)
+    stmt = filter.to_statement()
+    return search_phone(stmt, ef_search=filter.ef_search())
+
+
+@weave.op(name="asearch_phone")
+async def asearch(filter: PhoneFilter) -> list[PhoneModel]:
+    await filter.aload_embeddings()
+    if env.CATALOG_ENGINE_ENABLED:
+        return await catalog_asearch(filter)
     stmt = filter.to_statement()
-    return search_phone(stmt)
+    return await asearch_phone(stmt, ef_search=filter.ef_search())
+
+
+@weave.op(name="search_phone_candidates")
+def search_candidates(filter: PhoneFilter) -> Candidates[PhoneModel]:
+    """
+    The exact page after the filter's cursor and, for when it is empty, the first
+    recommendation page, in one round trip. A recommending filter only gets the
+    recommendation page.
+    """
+    if env.CATALOG_ENGINE_ENABLED:
+        return catalog_search_candidates(filter)
+    stmt = to_candidates_statement(Phone, filter)
+    return to_candidates(
+        filter, search_phone_candidates(stmt, ef_search=filter.ef_search())
+    )
+
+
+@weave.op(name="asearch_phone_candidates")
+async def asearch_candidates(filter: PhoneFilter) -> Candidates[PhoneModel]:
+    await filter.aload_embeddings()
+    if env.CATALOG_ENGINE_ENABLED:
+        return await catalog_asearch_candidates(filter)
+    stmt = to_candidates_statement(Phone, filter)
+    return to_candidates(
+        filter, await asearch_phone_candidates(stmt, ef_search=filter.ef_search())
+    )
@@ -0,0 +1,58 @@
+from typing import Optional
+from openai.types import CompletionUsage
+from db import redis, async_redis
+
+_STATS_KEY = "prompt_cache_stats"
+
+
+def _increments(usage: Optional[CompletionUsage]) -> dict[str, int]:
+    if usage is None:
+        return {}
+    details = usage.prompt_tokens_details
+    return {
+        "requests": 1,
+        "prompt_tokens": usage.prompt_tokens,
+        "cached_tokens": (details.cached_tokens or 0) if details else 0,
+    }
+
+
+def record_usage(agent: Optional[str], usage: Optional[CompletionUsage]):
+    """
+    Add the prompt tokens OpenAI served from its prompt prefix cache to the agent's counters.
+    """
+    increments = _increments(usage)
+    if not increments:
+        return
+    pipeline = redis.pipeline(transaction=False)
+    for name, value in increments.items():
+        pipeline.hincrby(_STATS_KEY, f"{agent or 'unknown'}:{name}", value)
+    pipeline.execute()
+
+
+async def arecord_usage(agent: Optional[str], usage: Optional[CompletionUsage]):
+    increments = _increments(usage)
+    if not increments:
+        return
+    pipeline = async_redis.pipeline(transaction=False)
+    for name, value in increments.items():
+        pipeline.hincrby(_STATS_KEY, f"{agent or 'unknown'}:{name}", value)
+    await pipeline.execute()
+
+
+def get_stats() -> dict[str, dict[str, float]]:
+    """
+    Prompt and cached token counters grouped by agent, with the cached ratio.
+    """
+    stats: dict[str, dict[str, float]] = {}
+    for field, count in redis.hgetall(_STATS_KEY).items():  # type: ignore
+        agent, _, name = field.rpartition(":")
+        stats.setdefault(
+            agent, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        )[name] = int(count)
+
+    for agent_stats in stats.values():
+        prompt_tokens = agent_stats["prompt_tokens"]
+        agent_stats["cached_ratio"] = (
+            agent_stats["cached_tokens"] / prompt_tokens if prompt_tokens else 0
+        )
+    return stats
@@ -0,0 +1,96 @@
+import asyncio
+import random
+from time import sleep, monotonic
+from db import redis, async_redis
+from env import env
+
+# Two buckets (requests and tokens) refilled continuously from the account limits.
+# The script only takes from both buckets when both can pay, otherwise it returns
+# how long the caller has to wait before trying again.
+_TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local wait = 0
+local buckets = {}
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[(i - 1) * 2 + 1])
+    local cost = tonumber(ARGV[(i - 1) * 2 + 2])
+    local rate = capacity / 60
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'updated_at')
+    local tokens = tonumber(state[1]) or capacity
+    local updated_at = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated_at) * rate)
+    cost = math.min(cost, capacity)
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+    buckets[i] = {tokens, cost}
+end
+
+if wait == 0 then
+    for i = 1, 2 do
+        buckets[i][1] = buckets[i][1] - buckets[i][2]
+    end
+end
+
+for i = 1, 2 do
+    redis.call('HSET', KEYS[i], 'tokens', buckets[i][1], 'updated_at', now)
+    redis.call('EXPIRE', KEYS[i], 120)
+end
+
+return tostring(wait)
+"""
+
+_token_bucket = redis.register_script(_TOKEN_BUCKET_SCRIPT)
+_async_token_bucket = async_redis.register_script(_TOKEN_BUCKET_SCRIPT)
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+def _keys(model: str) -> list[str]:
+    return [f"openai_rate_limit:{model}:requests", f"openai_rate_limit:{model}:tokens"]
+
+
+def _args(tokens: int) -> list[int]:
+    return [env.OPENAI_RPM, 1, env.OPENAI_TPM, tokens]
+
+
+def _jitter(wait_time: float) -> float:
+    # Spread the wake-ups so waiting workers don't hit the bucket at the same instant.
+    return wait_time + random.uniform(0, min(wait_time, 1))
+
+
+def acquire(model: str, tokens: int, max_wait: float | None = None):
+    """
+    Block until the shared bucket grants one request and `tokens` tokens for `model`.
+    """
+    max_wait = env.OPENAI_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+    deadline = monotonic() + max_wait
+    while True:
+        wait_time = float(_token_bucket(keys=_keys(model), args=_args(tokens)))
+        if wait_time <= 0:
+            return
+        if monotonic() + wait_time > deadline:
+            raise RateLimitTimeout(
+                f"Waited more than {max_wait}s for the OpenAI rate limit of {model}."
+            )
+        sleep(_jitter(wait_time))
+
+
+async def aacquire(model: str, tokens: int, max_wait: float | None = None):
+    max_wait = env.OPENAI_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+    deadline = monotonic() + max_wait
+    while True:
+        wait_time = float(
+            await _async_token_bucket(keys=_keys(model), args=_args(tokens))
+        )
+        if wait_time <= 0:
+            return
+        if monotonic() + wait_time > deadline:
+            raise RateLimitTimeout(
+                f"Waited more than {max_wait}s for the OpenAI rate limit of {model}."
+            )
+        await asyncio.sleep(_jitter(wait_time))
@@ -0,0 +1,541 @@
+import asyncio
+import re
+import threading
+import unicodedata
+from time import monotonic
+from typing import Any, Optional
+
+from openai.types.chat import ChatCompletionMessageParam
+from pydantic import BaseModel
+from rapidfuzz import fuzz, process
+from sqlalchemy import text
+
+from db import Session
+from env import env
+from models.user_memory import ProductType, UserMemoryModel
+from service.suggestions import Suggestion, at_ordinal
+
+PHONE_PRICE_TOOL = "collect_and_update_phone_price_requirements"
+PHONE_BRAND_TOOL = "collect_and_update_phone_brand"
+PHONE_CONFIGURATION_TOOL = "collect_and_update_phone_configuration"
+PHONE_NAME_TOOL = "collect_and_update_phone_name_requirements"
+LAPTOP_PRICE_TOOL = "collect_and_update_laptop_price_requirements"
+LAPTOP_CONFIGURATION_TOOL = "collect_and_update_laptop_configuration"
+LAPTOP_NAME_TOOL = "collect_and_update_laptop_name_requirements"
+
+# Words that carry no requirement, a message made only of slots and these words is
+# fully understood without the LLM. Accents are stripped, like the message.
+_FILLER_WORDS = set(
+    """
+    a ad ah anh ban cho chi cua dum em giup ho minh nha nhe nhi oi shop toi vay voi
+    xin thi la va hoac hay nao ve
+    can muon tim kiem mua xem coi tu van chon lay dat order
+    dien thoai dt dthoai smartphone phone laptop lap top may tinh xach tay cai chiec
+    con loai mau sac gia tam khoang co tien trieu tr cu trong ngan sach budget
+    rom bo nho dung luong gb tb hang thuong hieu
+    """.split()
+)
+
+_MILLION_UNITS = {"trieu", "tr", "cu", "m"}
+_THOUSAND_UNITS = {"k", "nghin", "ngan"}
+_STORAGE_SIZES = {16, 32, 64, 128, 256, 512, 1024, 2048}
+
+_NUMBER = r"\d{1,3}(?:[.,]\d{3})+(?!\d)|\d+(?:[.,]\d+)?"
+_MONEY_UNIT = r"trieu|tr|cu|k|nghin|ngan|m(?![a-z])"
+_NOT_SPEC = r"(?!\s*(?:gb|tb|g\b|inch|mah|hz|mp|w\b|%))"
+
+
+def _amount(prefix: str) -> str:
+    # "15tr", "10 triệu 5", "8.5 củ", "500k", "12.000.000" or a bare number.
+    return (
+        rf"(?P<{prefix}n>{_NUMBER}){_NOT_SPEC}\s*(?P<{prefix}u>{_MONEY_UNIT})?"
+        rf"(?:\s*(?P<{prefix}f>\d)(?!\d))?"
+    )
+
+
+_price_patterns = [
+    (
+        "range",
+        re.compile(
+            rf"(?:\b(?:gia\s+)?tu\s+)?{_amount('a')}\s*(?:-|~|den|toi)\s*{_amount('b')}"
+        ),
+    ),
+    (
+        "max_price",
+        re.compile(
+            rf"\b(?:duoi|khong qua|ko qua|k qua|toi da|nho hon|it hon|max)\s*"
+            rf"{_amount('a')}"
+        ),
+    ),
+    (
+        "min_price",
+        re.compile(rf"\b(?:tren|hon|tu|toi thieu|lon hon|min)\s*{_amount('a')}"),
+    ),
+    (
+        "approximate_price",
+        re.compile(
+            rf"(?:\b(?:tam|khoang|gia|ngan sach|budget|tam gia|xap xi)\s*)?"
+            rf"{_amount('a')}"
+        ),
+    ),
+]
+
+_storage_amount = r"(?P<{p}n>\d+)\s*(?P<{p}u>gb|tb|g(?![a-z]))"
+_storage_patterns = [
+    (
+        "range",
+        re.compile(
+            r"(?:\btu\s+)?(?P<an>\d+)\s*(?:gb|tb|g)?\s*(?:-|~|den|toi)\s*"
+            + _storage_amount.format(p="b")
+        ),
+    ),
+    (
+        "max_value",
+        re.compile(
+            r"\b(?:duoi|khong qua|toi da|nho hon)\s*" + _storage_amount.format(p="a")
+        ),
+    ),
+    (
+        "min_value",
+        re.compile(
+            r"\b(?:tren|tu|toi thieu|lon hon)\s*" + _storage_amount.format(p="a")
+        ),
+    ),
+    ("exact", re.compile(_storage_amount.format(p="a"))),
+]
+
+_color_marker = re.compile(r"\b(?:mau sac|mau)\s+")
+_ordinal_pattern = re.compile(
+    r"\b(?:(?:cai|chiec|mau|con|may|san pham|sp|dien thoai|dt|laptop|lua chon)\s+)?"
+    r"(?:(?:thu|so)\s+(?P<n>\d+|nhat|hai|ba|bon|tu|nam|sau|bay|tam|chin|muoi)"
+    r"|(?P<first>dau tien)|(?P<last>cuoi cung|cuoi))\b"
+)
+_ordinal_words = {
+    "nhat": 1,
+    "hai": 2,
+    "ba": 3,
+    "bon": 4,
+    "tu": 4,
+    "nam": 5,
+    "sau": 6,
+    "bay": 7,
+    "tam": 8,
+    "chin": 9,
+    "muoi": 10,
+}
+# Yes/no questions about a product ("có màu đen không?") are not requirements.
+_yes_no_question = re.compile(r"\b(?:khong|ko|k|hong|hok|chua)\s*\W*$")
+
+_BRAND_ALIASES = {
+    ProductType.MOBILE_PHONE: {
+        "iphone": "Apple",
+        "ip": "Apple",
+        "ss": "Samsung",
+        "sam sung": "Samsung",
+        "galaxy": "Samsung",
+        "redmi": "Xiaomi",
+        "xiaomi": "Xiaomi",
+    },
+    ProductType.LAPTOP: {
+        "macbook": "Apple",
+        "mac": "Apple",
+        "thinkpad": "Lenovo",
+        "rog": "Asus",
+    },
+}
+
+
+class Slot(BaseModel):
+    name: str
+    value: Any
+    confidence: float
+    span: tuple[int, int]
+
+
+class Extraction(BaseModel):
+    slots: list[Slot] = []
+    # Every word of the message is either a slot or a filler word.
+    covered: bool = False
+
+    def get(self, name: str) -> Optional[Slot]:
+        return next((slot for slot in self.slots if slot.name == name), None)
+
+
+class Vocabulary(BaseModel):
+    brands: list[str]
+    colors: list[str]
+    loaded_at: float
+
+
+_vocabularies: dict[ProductType, Vocabulary] = {}
+_vocabularies_lock = threading.Lock()
+
+_VOCABULARY_QUERIES = {
+    ProductType.MOBILE_PHONE: (
+        "SELECT DISTINCT b.name FROM brands b JOIN phones p ON p.brand_code = b.id",
+        "SELECT DISTINCT v->>'value' FROM phone_variants, unnest(variants) AS v "
+        "WHERE v->>'propertyName' = 'color'",
+    ),
+    ProductType.LAPTOP: (
+        "SELECT DISTINCT b.name FROM brands b JOIN laptops l ON l.brand_code = b.id",
+        "SELECT DISTINCT v->>'value' FROM laptop_variants, unnest(variants) AS v "
+        "WHERE v->>'propertyName' = 'color'",
+    ),
+}
+
+
+def normalize(message: str) -> str:
+    """
+    Lowercased message without accents, character for character, so positions in it
+    are positions in `message.lower()`.
+    """
+    return "".join(
+        unicodedata.normalize("NFD", c)[0] if c != "đ" else "d"
+        for c in message.lower()
+    )
+
+
+def _load_vocabulary(product_type: ProductType) -> Vocabulary:
+    brands_query, colors_query = _VOCABULARY_QUERIES[product_type]
+    with Session() as session:
+        brands = [name for (name,) in session.execute(text(brands_query)) if name]
+        colors = [color for (color,) in session.execute(text(colors_query)) if color]
+    return Vocabulary(brands=brands, colors=colors, loaded_at=monotonic())
+
+
+def _is_fresh(vocabulary: Optional[Vocabulary]) -> bool:
+    return (
+        vocabulary is not None
+        and monotonic() - vocabulary.loaded_at < env.CATALOG_ENGINE_TTL
+    )
+
+
+def get_vocabulary(product_type: ProductType) -> Vocabulary:
+    """
+    Brand and color names of the catalog, loaded again once older than
+    CATALOG_ENGINE_TTL.
+    """
+    vocabulary = _vocabularies.get(product_type)
+    if _is_fresh(vocabulary):
+        return vocabulary  # type: ignore
+
+    with _vocabularies_lock:
+        vocabulary = _vocabularies.get(product_type)
+        if not _is_fresh(vocabulary):
+            vocabulary = _vocabularies[product_type] = _load_vocabulary(product_type)
+        return vocabulary  # type: ignore
+
+
+def _to_number(raw: str) -> float:
+    if re.fullmatch(r"\d{1,3}(?:[.,]\d{3})+", raw):
+        return float(re.sub(r"[.,]", "", raw))
+    return float(raw.replace(",", "."))
+
+
+def _to_vnd(match: re.Match, prefix: str, unit: Optional[str]) -> Optional[int]:
+    number = _to_number(match.group(f"{prefix}n"))
+    fraction = match.group(f"{prefix}f")
+    if unit in _MILLION_UNITS:
+        return int(number * 1_000_000 + int(fraction or 0) * 100_000)
+    if fraction:
+        return None
+    if unit in _THOUSAND_UNITS:
+        return int(number * 1_000)
+    if number < 1000:
+        return int(number * 1_000_000)
+    if number >= 100_000:
+        return int(number)
+    return None
+
+
+def _extract_price(normalized: str) -> Optional[Slot]:
+    for kind, pattern in _price_patterns:
+        for match in pattern.finditer(normalized):
+            units = [match.groupdict().get(f"{p}u") for p in ("a", "b")]
+            has_keyword = not match.group(0)[:1].isdigit()
+            # A bare number is only a price next to a price word ("tầm 10").
+            if not any(units) and not has_keyword:
+                continue
+            # "10-15tr": the first amount takes the unit of the second.
+            first_unit = units[0] or units[1]
+            first = _to_vnd(match, "a", first_unit)
+            if first is None:
+                continue
+
+            # "tầm 10" is most likely millions, but not certainly.
+            in_millions = not any(units) and _to_number(match.group("an")) < 1000
+            confidence = 0.85 if in_millions else 0.95
+            if kind == "range":
+                second = _to_vnd(match, "b", units[1] or first_unit)
+                if second is None or second < first:
+                    continue
+                value = {"min_price": first, "max_price": second}
+            else:
+                value = {kind: first}
+            return Slot(
+                name="price", value=value, confidence=confidence, span=match.span()
+            )
+    return None
+
+
+def _to_gigabytes(number: str, unit: Optional[str]) -> int:
+    return int(number) * (1024 if unit == "tb" else 1)
+
+
+def _extract_storage(normalized: str) -> Optional[Slot]:
+    for kind, pattern in _storage_patterns:
+        for match in pattern.finditer(normalized):
+            start, end = match.span()
+            # RAM is not a storage requirement ("8gb ram", "ram 8gb").
+            if "ram" in normalized[max(0, start - 8) : start] or re.match(
+                r"\s*ram\b", normalized[end:]
+            ):
+                continue
+
+            unit = match.group("au") if kind != "range" else match.group("bu")
+            first = _to_gigabytes(match.group("an"), unit)
+            if unit == "g" and first not in _STORAGE_SIZES:
+                continue
+
+            if kind == "range":
+                second = _to_gigabytes(match.group("bn"), unit)
+                value = {"min_value": first, "max_value": second}
+                sizes = [first, second]
+            elif kind == "exact":
+                value = {"min_value": first, "max_value": first}
+                sizes = [first]
+            else:
+                value = {kind: first}
+                sizes = [first]
+
+            # The LLM bounds open-ended ranges itself, they are left to it.
+            confidence = 0.95 if all(size in _STORAGE_SIZES for size in sizes) else 0.7
+            if kind in ("min_value", "max_value"):
+                confidence = min(confidence, 0.8)
+            return Slot(
+                name="storage", value=value, confidence=confidence, span=match.span()
+            )
+    return None
+
+
+def _extract_color(normalized: str, colors: list[str]) -> Optional[Slot]:
+    if not colors:
+        return None
+    choices = {normalize(color): color for color in colors}
+
+    for marker in _color_marker.finditer(normalized):
+        words = list(re.finditer(r"[a-z]+", normalized[marker.end() :]))[:3]
+        best: Optional[tuple[str, float, int]] = None
+        # Longest phrase first, so "xanh duong" wins over "xanh".
+        for count in range(len(words), 0, -1):
+            phrase = " ".join(word.group(0) for word in words[:count])
+            match = process.extractOne(
+                phrase, choices.keys(), scorer=fuzz.ratio, score_cutoff=85
+            )
+            if match and (best is None or match[1] > best[1]):
+                best = (match[0], match[1], marker.end() + words[count - 1].end())
+        if best:
+            color, score, end = best
+            return Slot(
+                name="color",
+                value=choices[color],
+                confidence=score / 100,
+                span=(marker.start(), end),
+            )
+    return None
+
+
+def _extract_brand(
+    normalized: str, brands: list[str], product_type: ProductType
+) -> Optional[Slot]:
+    aliases = {
+        normalize(alias): brand
+        for alias, brand in _BRAND_ALIASES.get(product_type, {}).items()
+        if brand in brands
+    }
+    names = {normalize(brand): brand for brand in brands}
+    words = list(re.finditer(r"[a-z0-9]+", normalized))
+
+    for count in (2, 1):
+        for i in range(len(words) - count + 1):
+            start, end = words[i].start(), words[i + count - 1].end()
+            phrase = " ".join(word.group(0) for word in words[i : i + count])
+            if phrase in aliases:
+                return Slot(
+                    name="brand",
+                    value=aliases[phrase],
+                    confidence=0.95,
+                    span=(start, end),
+                )
+            if phrase in names:
+                return Slot(
+                    name="brand", value=names[phrase], confidence=1.0, span=(start, end)
+                )
+            # Short names ("hp", "msi") only match exactly.
+            if len(phrase) < 4:
+                continue
+            match = process.extractOne(
+                phrase, names.keys(), scorer=fuzz.ratio, score_cutoff=88
+            )
+            if match:
+                return Slot(
+                    name="brand",
+                    value=names[match[0]],
+                    confidence=match[1] / 100,
+                    span=(start, end),
+                )
+    return None
+
+
+def _extract_ordinal(normalized: str) -> Optional[Slot]:
+    match = _ordinal_pattern.search(normalized)
+    if not match:
+        return None
+    if match.group("first"):
+        index = 1
+    elif match.group("last"):
+        index = -1
+    else:
+        raw = match.group("n")
+        index = int(raw) if raw.isdigit() else _ordinal_words[raw]
+    return Slot(name="ordinal", value=index, confidence=0.95, span=match.span())
+
+
+def _blank(normalized: str, slots: list[Slot]) -> str:
+    remaining = list(normalized)
+    for slot in slots:
+        start, end = slot.span
+        remaining[start:end] = " " * (end - start)
+    return "".join(remaining)
+
+
+def _is_covered(normalized: str, slots: list[Slot]) -> bool:
+    words = re.findall(r"[a-z0-9]+", _blank(normalized, slots))
+    return all(word in _FILLER_WORDS for word in words)
+
+
+def extract(message: str, product_type: ProductType) -> Extraction:
+    """
+    Price, storage, color, brand and ordinal reference ("cái thứ 2") of the message,
+    each with its confidence.
+    """
+    if product_type not in _VOCABULARY_QUERIES:
+        return Extraction()
+
+    vocabulary = get_vocabulary(product_type)
+    normalized = normalize(message)
+    slots: list[Slot] = []
+
+    # Ordinals and storage first, their numbers are not prices.
+    for extract in (_extract_ordinal, _extract_storage):
+        slot = extract(normalized)
+        if slot:
+            slots.append(slot)
+    price = _extract_price(_blank(normalized, slots))
+    if price:
+        slots.append(price)
+
+    color = _extract_color(normalized, vocabulary.colors)
+    if color:
+        slots.append(color)
+    brand = _extract_brand(normalized, vocabulary.brands, product_type)
+    if brand:
+        slots.append(brand)
+
+    if _yes_no_question.search(normalized.strip()):
+        for slot in slots:
+            slot.confidence /= 2
+
+    return Extraction(slots=slots, covered=_is_covered(normalized, slots))
+
+
+async def aextract(message: str, product_type: ProductType) -> Extraction:
+    # Only loading the vocabulary blocks, the extraction itself takes microseconds.
+    if product_type in _VOCABULARY_QUERIES and not _is_fresh(
+        _vocabularies.get(product_type)
+    ):
+        await asyncio.to_thread(get_vocabulary, product_type)
+    return extract(message, product_type)
+
+
+def to_tool_arguments(
+    extraction: Extraction,
+    product_type: ProductType,
+    user_memory: Optional[UserMemoryModel] = None,
+    suggestions: Optional[list[Suggestion]] = None,
+) -> Optional[dict[str, dict[str, Any]]]:
+    """
+    The slots as collect_and_retrieval tool calls (tool name -> arguments), None when
+    a slot has no tool for the product type or an ordinal is not in `suggestions`.
+    """
+    arguments: dict[str, dict[str, Any]] = {}
+    for slot in extraction.slots:
+        suggestion = (
+            at_ordinal(suggestions or [], slot.value)
+            if slot.name == "ordinal"
+            else None
+        )
+        match product_type, slot.name:
+            case ProductType.MOBILE_PHONE, "price":
+                arguments.setdefault(PHONE_PRICE_TOOL, {}).update(slot.value)
+            case ProductType.MOBILE_PHONE, "storage":
+                arguments.setdefault(PHONE_CONFIGURATION_TOOL, {})[
+                    "phone_storage"
+                ] = slot.value
+            case ProductType.MOBILE_PHONE, "color":
+                arguments.setdefault(PHONE_CONFIGURATION_TOOL, {})[
+                    "phone_color"
+                ] = slot.value
+            case ProductType.MOBILE_PHONE, "brand":
+                arguments[PHONE_BRAND_TOOL] = {"phone_brand": slot.value}
+            case ProductType.MOBILE_PHONE, "ordinal" if suggestion:
+                arguments[PHONE_NAME_TOOL] = {"phone_name": suggestion.name}
+            case ProductType.LAPTOP, "price":
+                arguments.setdefault(LAPTOP_PRICE_TOOL, {}).update(slot.value)
+            case ProductType.LAPTOP, "color":
+                arguments.setdefault(LAPTOP_CONFIGURATION_TOOL, {})[
+                    "laptop_color"
+                ] = slot.value
+            case ProductType.LAPTOP, "brand":
+                arguments.setdefault(LAPTOP_CONFIGURATION_TOOL, {})[
+                    "laptop_brand"
+                ] = slot.value
+            case ProductType.LAPTOP, "ordinal" if suggestion:
+                arguments[LAPTOP_NAME_TOOL] = {"laptop_name": suggestion.name}
+            case _:
+                return None
+
+    # The laptop configuration tool also sets the brand, an unchanged brand keeps it.
+    if LAPTOP_CONFIGURATION_TOOL in arguments:
+        arguments[LAPTOP_CONFIGURATION_TOOL].setdefault(
+            "laptop_brand", user_memory.brand_name if user_memory else None
+        )
+    return arguments
+
+
+def confident_tool_arguments(
+    extraction: Extraction,
+    product_type: ProductType,
+    user_memory: Optional[UserMemoryModel] = None,
+    suggestions: Optional[list[Suggestion]] = None,
+) -> Optional[dict[str, dict[str, Any]]]:
+    """
+    Tool arguments that can replace the collect_and_retrieval LLM call: every word of
+    the message is understood and every slot is above SLOT_EXTRACTOR_THRESHOLD.
+    """
+    if (
+        not extraction.slots
+        or not extraction.covered
+        or any(
+            slot.confidence < env.SLOT_EXTRACTOR_THRESHOLD
+            for slot in extraction.slots
+        )
+    ):
+        return None
+    return to_tool_arguments(extraction, product_type, user_memory, suggestions)
+
+
+def latest_user_message(messages: list[ChatCompletionMessageParam]) -> Optional[str]:
+    message = next((msg for msg in reversed(messages) if msg["role"] == "user"), None)
+    content = (message or {}).get("content")
+    return content if isinstance(content, str) and content else None
@@ -0,0 +1,38 @@
+from typing import Literal
+from db import redis, async_redis
+
+_STATS_KEY = "speculative_collect_stats"
+
+Outcome = Literal["hit", "miss", "discarded"]
+_OUTCOMES: tuple[Outcome, ...] = ("hit", "miss", "discarded")
+
+
+def record(product_type: str, outcome: Outcome):
+    """
+    Count how a speculative collect_and_retrieval run started for `product_type` ended:
+    kept ("hit"), thrown away for another product type ("miss"), or thrown away because
+    the turn needed no product consultation or the run failed ("discarded").
+    """
+    redis.hincrby(_STATS_KEY, f"{product_type}:{outcome}", 1)
+
+
+async def arecord(product_type: str, outcome: Outcome):
+    await async_redis.hincrby(_STATS_KEY, f"{product_type}:{outcome}", 1)
+
+
+def get_stats() -> dict[str, dict[str, float]]:
+    """
+    Speculation outcomes grouped by product type, with the hit rate.
+    """
+    stats: dict[str, dict[str, float]] = {}
+    for field, count in redis.hgetall(_STATS_KEY).items():  # type: ignore
+        product_type, _, outcome = field.rpartition(":")
+        outcomes = stats.setdefault(product_type, dict.fromkeys(_OUTCOMES, 0))
+        outcomes[outcome] = int(count)
+
+    for product_type_stats in stats.values():
+        total = sum(product_type_stats[outcome] for outcome in _OUTCOMES)
+        product_type_stats["hit_rate"] = (
+            product_type_stats["hit"] / total if total else 0
+        )
+    return stats
@@ -1,4 +1,8 @@
-from typing import Optional
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Awaitable, Callable, Optional
 
 from pydantic import BaseModel
 import agents.phone.collect_and_retrieval as phone_collect_and_retrieval
@@ -12,6 +16,8 @@ import agents.accessory.generate_response as accessories_generate_response
 
 import agents.undetermined.generate_response as undetermined_generate_response
 import agents.detect_demand as detect_demand
+import agents.combined_request as combined_request
+from agents.base import AgentResponseBase, AgentTemporaryMemory
 from agents.utils import instructions_to_string
 from models.user import UserModel
 from service.wandb import client as wandb_client
@@ -26,17 +32,45 @@ from models.user_memory import (
     UserMemoryModel,
     ProductType,
     CreateUserMemoryModel,
-    UpdateUserMemoryModel,
 )
-from repositories.redis import set_value
 from repositories.user_memory import (
-    get_by_thread_id,
-    create as create_user_memory,
-    update as update_user_memory,
+    get_or_create as get_or_create_user_memory,
+    aget_or_create as aget_or_create_user_memory,
+    save as save_user_memory,
+    asave as asave_user_memory,
 )
 
+from service.conversation_window import (
+    ConversationWindows,
+    build_windows,
+    fold as fold_conversation,
+    afold as afold_conversation,
+)
+from env import env
+from db import unit_of_work, aunit_of_work, create_detached_task
+import service.speculative_collect as speculative_collect
+import service.slot_extractor as slot_extractor
+from service.thread_state import (
+    ThreadState,
+    load as load_thread_state,
+    aload as aload_thread_state,
+    store as store_thread_state,
+    astore as astore_thread_state,
+)
+from service.page_cursor import (
+    PageCursor,
+    save as save_page_cursor,
+    asave as asave_page_cursor,
+)
+from service.suggestions import (
+    load as load_suggestions,
+    aload as aload_suggestions,
+    save as save_suggestions,
+    asave as asave_suggestions,
+)
+from service.speculative_collect import Outcome
 from utils import EvaluateContext
-from repositories.user import get as get_user
+from repositories.user import get as get_user, aget as aget_user
 
 
 class ConfigModel(BaseModel):
@@ -46,28 +80,552 @@ class ConfigModel(BaseModel):
     use_fine_tune_tone: bool = True
 
 
+@unit_of_work()
 def gen_answer(
     user_id: UUID,
     thread_id: UUID,
     history: list[ChatCompletionMessageParam],
-    limit: int = 10,
     evaluate_context: EvaluateContext = EvaluateContext(),
     config: ConfigModel = ConfigModel(),
+    history_offset: int = 0,
+    thread_state: Optional[ThreadState] = None,
+    is_superseded: Callable[[], bool] = lambda: False,
 ) -> str:
+    """
+    `history` is the thread from its message `history_offset` on. `thread_state` is the
+    thread's cached state when the caller has already loaded it. `is_superseded` is
+    checked before the turn's writes: the memory, page cursor and suggestions of a
+    superseded turn are dropped along with its answer.
+    """
     gen_answer_call = wandb_client.create_call(
         op="gen_answer",
         inputs=locals(),
     )
-    conversation_messages = history[-limit:] if len(history) > limit else history
-    user_memory = get_by_thread_id(thread_id)
-    if user_memory is None:
-        user_memory = create_user_memory(
-            CreateUserMemoryModel(user_id=user_id, thread_id=thread_id)
+    thread_state = thread_state or load_thread_state(thread_id)
+    user_memory = thread_state.user_memory or get_or_create_user_memory(
+        CreateUserMemoryModel(user_id=user_id, thread_id=thread_id)
+    )
+    conversation_windows = build_windows(history, user_memory, history_offset)
+    conversation_messages = conversation_windows.detect_demand
+    user = thread_state.user or get_user(user_id)
+    if user is None:
+        raise ValueError(f"User with id {user_id} not found")
+
+    # Slots of the latest message for the previous turn's product type, reused below
+    # when detect_demand keeps it.
+    previous_product_type = _product_type(user_memory)
+    extracted_slots = _get_extracted_slots(
+        conversation_messages, user_memory, previous_product_type
+    )
+    speculation = _start_speculation(
+        user_memory, user, conversation_windows, thread_state.cursor, extracted_slots
+    )
+    detect_demand_agent, detect_demand_call = _init_detect_demand(
+        user_memory, user, conversation_messages, config
+    )
+    combined_response = None
+    if env.COMBINED_REQUEST_ENABLED:
+        combined_agent, combined_call = _init_combined_request(conversation_messages)
+        combined_response = combined_agent.run(messages=conversation_messages)
+        wandb_client.finish_call(combined_call, output=combined_response)
+
+    if combined_response and combined_response.user_request:
+        detect_demand_response = detect_demand_agent.run_with_request(
+            combined_response.user_request
+        )
+    else:
+        detect_demand_response = detect_demand_agent.run(messages=conversation_messages)
+    detect_demand_response = detect_demand_agent.post_process(
+        detect_demand_response, config.response
+    )
+    _finish_detect_demand(
+        detect_demand_agent, detect_demand_call, detect_demand_response
+    )
+    if detect_demand_response.type == "message":
+        if speculation:
+            _discard_speculation(speculation, "discarded")
+        evaluate_context.instruction = f"## INSTRUCTIONS:\n{instructions_to_string(detect_demand_response.instructions)}"
+        if not is_superseded():
+            _finish_turn(user, detect_demand_agent.temporary_memory.user_memory)  # type: ignore
+        wandb_client.finish_call(gen_answer_call, output=detect_demand_response)
+        return detect_demand_response.content or ""
+
+    detect_demand_agent_temp_memory_user_memory = (
+        detect_demand_agent.temporary_memory.user_memory
+    )
+    product_type = detect_demand_agent_temp_memory_user_memory.intent.product_type  # type: ignore
+
+    speculation = _resolve_speculation(speculation, product_type)
+    if speculation:
+        detect_demand_agent_temp_memory_user_memory = _adopt_speculation(
+            speculation, detect_demand_agent_temp_memory_user_memory  # type: ignore
         )
-    user = get_user(user_id)
+
+    slots = _get_combined_slots(combined_response, product_type)
+    if slots is None and speculation is None:
+        slots = (
+            extracted_slots
+            if product_type == previous_product_type
+            else _get_extracted_slots(
+                conversation_messages,
+                detect_demand_agent_temp_memory_user_memory,  # type: ignore
+                product_type,
+            )
+        )
+    match product_type:
+        case ProductType.MOBILE_PHONE:
+            handler = partial(
+                handle_phone_request,
+                slots=slots,
+                speculation=speculation,
+                cursor=thread_state.cursor,
+                is_superseded=is_superseded,
+            )
+        case ProductType.LAPTOP:
+            handler = partial(
+                handle_laptop_request,
+                slots=slots,
+                speculation=speculation,
+                cursor=thread_state.cursor,
+                is_superseded=is_superseded,
+            )
+        case _:
+            handler = handle_undetermined_request
+
+    response = handler(
+        user_memory=detect_demand_agent_temp_memory_user_memory,  # type: ignore
+        user=user,
+        conversation_windows=conversation_windows,
+        evaluate_context=evaluate_context,
+        config=config,
+    )
+    # The handlers change the memory in place, it is written once the turn is done.
+    if not is_superseded():
+        _finish_turn(user, detect_demand_agent_temp_memory_user_memory)  # type: ignore
+
+    wandb_client.finish_call(gen_answer_call, output=response)
+    return response
+
+
+@aunit_of_work()
+async def agen_answer(
+    user_id: UUID,
+    thread_id: UUID,
+    history: list[ChatCompletionMessageParam],
+    evaluate_context: EvaluateContext = EvaluateContext(),
+    config: ConfigModel = ConfigModel(),
+    on_token: Optional[Callable[[str], Awaitable[Any]]] = None,
+    history_offset: int = 0,
+    thread_state: Optional[ThreadState] = None,
+) -> str:
+    """
+    Same pipeline as `gen_answer`, but every database, Redis and OpenAI call is awaited
+    so concurrent conversations do not block the event loop.
+
+    When `on_token` is given, the final generate_response answer is streamed to it token
+    by token. Answers that don't come from a generate_response agent are only returned.
+    """
+    gen_answer_call = wandb_client.create_call(
+        op="agen_answer",
+        inputs=locals(),
+    )
+    thread_state = thread_state or await aload_thread_state(thread_id)
+    user_memory = thread_state.user_memory or await aget_or_create_user_memory(
+        CreateUserMemoryModel(user_id=user_id, thread_id=thread_id)
+    )
+    conversation_windows = build_windows(history, user_memory, history_offset)
+    conversation_messages = conversation_windows.detect_demand
+    user = thread_state.user or await aget_user(user_id)
     if user is None:
         raise ValueError(f"User with id {user_id} not found")
 
+    previous_product_type = _product_type(user_memory)
+    extracted_slots = await _aget_extracted_slots(
+        conversation_messages, user_memory, previous_product_type
+    )
+    speculation = await _astart_speculation(
+        user_memory, user, conversation_windows, thread_state.cursor, extracted_slots
+    )
+    detect_demand_agent, detect_demand_call = _init_detect_demand(
+        user_memory, user, conversation_messages, config
+    )
+    combined_response = None
+    if env.COMBINED_REQUEST_ENABLED:
+        combined_agent, combined_call = _init_combined_request(conversation_messages)
+        combined_response = await combined_agent.arun(messages=conversation_messages)
+        wandb_client.finish_call(combined_call, output=combined_response)
+
+    if combined_response and combined_response.user_request:
+        detect_demand_response = await detect_demand_agent.arun_with_request(
+            combined_response.user_request
+        )
+    else:
+        detect_demand_response = await detect_demand_agent.arun(
+            messages=conversation_messages
+        )
+    detect_demand_response = await detect_demand_agent.apost_process(
+        detect_demand_response, config.response
+    )
+    _finish_detect_demand(
+        detect_demand_agent, detect_demand_call, detect_demand_response
+    )
+    if detect_demand_response.type == "message":
+        if speculation:
+            await _adiscard_speculation(speculation, "discarded")
+        evaluate_context.instruction = f"## INSTRUCTIONS:\n{instructions_to_string(detect_demand_response.instructions)}"
+        await _afinish_turn(user, detect_demand_agent.temporary_memory.user_memory)  # type: ignore
+        wandb_client.finish_call(gen_answer_call, output=detect_demand_response)
+        return detect_demand_response.content or ""
+
+    detect_demand_agent_temp_memory_user_memory = (
+        detect_demand_agent.temporary_memory.user_memory
+    )
+    product_type = detect_demand_agent_temp_memory_user_memory.intent.product_type  # type: ignore
+
+    speculation = await _aresolve_speculation(speculation, product_type)
+    if speculation:
+        detect_demand_agent_temp_memory_user_memory = _adopt_speculation(
+            speculation, detect_demand_agent_temp_memory_user_memory  # type: ignore
+        )
+
+    slots = _get_combined_slots(combined_response, product_type)
+    if slots is None and speculation is None:
+        slots = (
+            extracted_slots
+            if product_type == previous_product_type
+            else await _aget_extracted_slots(
+                conversation_messages,
+                detect_demand_agent_temp_memory_user_memory,  # type: ignore
+                product_type,
+            )
+        )
+    match product_type:
+        case ProductType.MOBILE_PHONE:
+            handler = partial(
+                ahandle_phone_request,
+                slots=slots,
+                speculation=speculation,
+                cursor=thread_state.cursor,
+            )
+        case ProductType.LAPTOP:
+            handler = partial(
+                ahandle_laptop_request,
+                slots=slots,
+                speculation=speculation,
+                cursor=thread_state.cursor,
+            )
+        case _:
+            handler = ahandle_undetermined_request
+
+    response = await handler(
+        user_memory=detect_demand_agent_temp_memory_user_memory,  # type: ignore
+        user=user,
+        conversation_windows=conversation_windows,
+        evaluate_context=evaluate_context,
+        config=config,
+        on_token=on_token,
+    )
+    await _afinish_turn(user, detect_demand_agent_temp_memory_user_memory)  # type: ignore
+
+    wandb_client.finish_call(gen_answer_call, output=response)
+    return response
+
+
+@unit_of_work()
+def fold_thread(
+    user_id: UUID,
+    thread_id: UUID,
+    history: list[ChatCompletionMessageParam],
+    history_offset: int = 0,
+):
+    """
+    Folds the thread's older messages into its running summary, called once the turn's
+    answer is sent so that the summary call is never on the critical path: a turn
+    reads the summary the previous fold left. `history` is the thread from its message
+    `history_offset` on, the answer included.
+    """
+    thread_state = load_thread_state(thread_id)
+    user_memory = thread_state.user_memory or get_or_create_user_memory(
+        CreateUserMemoryModel(user_id=user_id, thread_id=thread_id)
+    )
+    folded = fold_conversation(user_memory, history, history_offset)
+    if folded is user_memory:
+        return
+    user = thread_state.user or get_user(user_id)
+    if user is not None:
+        store_thread_state(user, folded)
+
+
+@aunit_of_work()
+async def afold_thread(
+    user_id: UUID,
+    thread_id: UUID,
+    history: list[ChatCompletionMessageParam],
+    history_offset: int = 0,
+):
+    thread_state = await aload_thread_state(thread_id)
+    user_memory = thread_state.user_memory or await aget_or_create_user_memory(
+        CreateUserMemoryModel(user_id=user_id, thread_id=thread_id)
+    )
+    folded = await afold_conversation(user_memory, history, history_offset)
+    if folded is user_memory:
+        return
+    user = thread_state.user or await aget_user(user_id)
+    if user is not None:
+        await astore_thread_state(user, folded)
+
+
+def _finish_turn(user: UserModel, user_memory: UserMemoryModel):
+    # Postgres first, the cached thread state is written through after it.
+    save_user_memory(user_memory)
+    store_thread_state(user, user_memory)
+
+
+async def _afinish_turn(user: UserModel, user_memory: UserMemoryModel):
+    await asave_user_memory(user_memory)
+    await astore_thread_state(user, user_memory)
+
+
+# Threads of the sync speculative runs, shared by the turns of the process.
+_speculation_executor = ThreadPoolExecutor(
+    max_workers=env.OPENAI_CHAT_CONCURRENCY, thread_name_prefix="speculation"
+)
+
+
+@dataclass
+class Speculation:
+    """
+    collect_and_retrieval run started for the previous turn's product type while
+    detect_demand is in flight. It works on a copy of the user memory, so a discarded
+    run leaves nothing behind and only the kept one is written by the handler.
+    """
+
+    product_type: ProductType
+    agent: phone_collect_and_retrieval.Agent | laptop_collect_and_retrieval.Agent
+    call: Any
+    pending: Future | asyncio.Task
+    response: Optional[AgentResponseBase] = None
+
+
+def _product_type(user_memory: UserMemoryModel) -> Optional[ProductType]:
+    return user_memory.intent.product_type if user_memory.intent else None
+
+
+def _init_speculation(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_windows: ConversationWindows,
+    cursor: PageCursor,
+    extracted_slots: Optional[dict[str, dict[str, Any]]],
+):
+    # The combined request already collects the requirements in the same round-trip,
+    # and there is no LLM call to hide when the slot extractor understands the whole
+    # message.
+    if (
+        not env.SPECULATIVE_COLLECT_ENABLED
+        or env.COMBINED_REQUEST_ENABLED
+        or extracted_slots
+    ):
+        return None
+
+    product_type = _product_type(user_memory)
+    match product_type:
+        case ProductType.MOBILE_PHONE:
+            init = _init_phone_collect_and_retrieval
+        case ProductType.LAPTOP:
+            init = _init_laptop_collect_and_retrieval
+        case _:
+            return None
+
+    agent, call = init(
+        user_memory.model_copy(deep=True),
+        user,
+        conversation_windows.collect_and_retrieval,
+        cursor,
+    )
+    return product_type, agent, call
+
+
+def _start_speculation(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_windows: ConversationWindows,
+    cursor: PageCursor,
+    extracted_slots: Optional[dict[str, dict[str, Any]]],
+) -> Optional[Speculation]:
+    init = _init_speculation(
+        user_memory, user, conversation_windows, cursor, extracted_slots
+    )
+    if init is None:
+        return None
+
+    product_type, agent, call = init
+    pending = _speculation_executor.submit(
+        agent.run, messages=conversation_windows.collect_and_retrieval
+    )
+    return Speculation(product_type, agent, call, pending)
+
+
+async def _astart_speculation(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_windows: ConversationWindows,
+    cursor: PageCursor,
+    extracted_slots: Optional[dict[str, dict[str, Any]]],
+) -> Optional[Speculation]:
+    init = _init_speculation(
+        user_memory, user, conversation_windows, cursor, extracted_slots
+    )
+    if init is None:
+        return None
+
+    product_type, agent, call = init
+    # Runs next to the turn, so on connections of its own.
+    pending = create_detached_task(
+        agent.arun(messages=conversation_windows.collect_and_retrieval)
+    )
+    return Speculation(product_type, agent, call, pending)
+
+
+def _resolve_speculation(
+    speculation: Optional[Speculation], product_type: Optional[ProductType]
+) -> Optional[Speculation]:
+    if speculation is None:
+        return None
+    if speculation.product_type != product_type:
+        _discard_speculation(speculation, "miss")
+        return None
+
+    try:
+        speculation.response = speculation.pending.result()  # type: ignore
+    except Exception as e:
+        print("Speculative collect and retrieval failed:", e)
+        _discard_speculation(speculation, "discarded")
+        return None
+
+    speculative_collect.record(speculation.product_type.value, "hit")
+    return speculation
+
+
+async def _aresolve_speculation(
+    speculation: Optional[Speculation], product_type: Optional[ProductType]
+) -> Optional[Speculation]:
+    if speculation is None:
+        return None
+    if speculation.product_type != product_type:
+        await _adiscard_speculation(speculation, "miss")
+        return None
+
+    try:
+        speculation.response = await speculation.pending  # type: ignore
+    except Exception as e:
+        print("Speculative collect and retrieval failed:", e)
+        await _adiscard_speculation(speculation, "discarded")
+        return None
+
+    await speculative_collect.arecord(speculation.product_type.value, "hit")
+    return speculation
+
+
+def _discard_speculation(speculation: Speculation, outcome: Outcome):
+    # A thread that already started can't be stopped, its result is just dropped.
+    speculation.pending.cancel()
+    wandb_client.finish_call(speculation.call, output={"speculation": outcome})
+    speculative_collect.record(speculation.product_type.value, outcome)
+
+
+async def _adiscard_speculation(speculation: Speculation, outcome: Outcome):
+    speculation.pending.cancel()
+    wandb_client.finish_call(speculation.call, output={"speculation": outcome})
+    await speculative_collect.arecord(speculation.product_type.value, outcome)
+
+
+def _adopt_speculation(
+    speculation: Speculation, detected_user_memory: UserMemoryModel
+) -> UserMemoryModel:
+    # detect_demand only changes the demand and the contact information, the
+    # speculative copy has everything else.
+    user_memory: UserMemoryModel = speculation.agent.temporary_memory.user_memory  # type: ignore
+    user_memory.intent.product_type = detected_user_memory.intent.product_type
+    user_memory.phone_number = detected_user_memory.phone_number
+    user_memory.email = detected_user_memory.email
+    return user_memory
+
+
+def _init_combined_request(conversation_messages: list[ChatCompletionMessageParam]):
+    combined_request_call = wandb_client.create_call(
+        op="combined_request",
+        inputs={"messages": conversation_messages},
+    )
+    combined_request_agent = combined_request.Agent(
+        system_prompt_config=combined_request.SystemPromptConfig(),
+        temporary_memory=AgentTemporaryMemory(),
+    )
+    return combined_request_agent, combined_request_call
+
+
+def _get_combined_slots(
+    combined_response: Optional[combined_request.AgentResponse],
+    product_type: Optional[ProductType],
+) -> Optional[dict[str, dict[str, Any]]]:
+    # The product type can come from an earlier turn when this one is undetermined,
+    # the collect_and_retrieval agent then asks the model for the requirements itself.
+    if (
+        not combined_response
+        or not combined_response.user_request
+        or combined_response.user_request.user_demand != product_type
+    ):
+        return None
+    return combined_response.slots
+
+
+def _get_extracted_slots(
+    conversation_messages: list[ChatCompletionMessageParam],
+    user_memory: UserMemoryModel,
+    product_type: Optional[ProductType],
+) -> Optional[dict[str, dict[str, Any]]]:
+    # Slots of the latest message as collect_and_retrieval tool arguments, None when
+    # the LLM is still needed to understand it.
+    message = slot_extractor.latest_user_message(conversation_messages)
+    if not env.SLOT_EXTRACTOR_ENABLED or product_type is None or message is None:
+        return None
+    extraction = slot_extractor.extract(message, product_type)
+    print("Extracted slots:", extraction)
+    # Ordinal references point into the last suggestion list.
+    suggestions = (
+        load_suggestions(user_memory.thread_id) if extraction.get("ordinal") else []
+    )
+    return slot_extractor.confident_tool_arguments(
+        extraction, product_type, user_memory, suggestions
+    )
+
+
+async def _aget_extracted_slots(
+    conversation_messages: list[ChatCompletionMessageParam],
+    user_memory: UserMemoryModel,
+    product_type: Optional[ProductType],
+) -> Optional[dict[str, dict[str, Any]]]:
+    message = slot_extractor.latest_user_message(conversation_messages)
+    if not env.SLOT_EXTRACTOR_ENABLED or product_type is None or message is None:
+        return None
+    extraction = await slot_extractor.aextract(message, product_type)
+    print("Extracted slots:", extraction)
+    suggestions = (
+        await aload_suggestions(user_memory.thread_id)
+        if extraction.get("ordinal")
+        else []
+    )
+    return slot_extractor.confident_tool_arguments(
+        extraction, product_type, user_memory, suggestions
+    )
+
+
+def _init_detect_demand(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_messages: list[ChatCompletionMessageParam],
+    config: ConfigModel,
+):
     detect_demand_memory = detect_demand.AgentTemporaryMemory(
         user_memory=user_memory,
         user=user,
@@ -86,11 +644,15 @@ def gen_answer(
         temporary_memory=detect_demand_memory,
         system_prompt_config=detect_demand_system_prompt_config,
     )
+    return detect_demand_agent, detect_demand_call
 
-    detect_demand_response = detect_demand_agent.run(messages=conversation_messages)
-    detect_demand_response = detect_demand_agent.post_process(
-        detect_demand_response, config.response
-    )
+
+def _finish_detect_demand(
+    detect_demand_agent: detect_demand.Agent,
+    detect_demand_call,
+    detect_demand_response: detect_demand.AgentResponse,
+):
+    detect_demand_memory = detect_demand_agent.temporary_memory
     print(
         "Detect demand response:",
         detect_demand_response,
@@ -101,54 +663,220 @@ def gen_answer(
         ),
     )
     wandb_client.finish_call(detect_demand_call, output=detect_demand_response)
-    if detect_demand_response.type == "message":
-        evaluate_context.instruction = f"## INSTRUCTIONS:\n{instructions_to_string(detect_demand_response.instructions)}"
-        update_user_memory(
-            id=user_memory.id,
-            data=UpdateUserMemoryModel.model_validate(
-                detect_demand_memory.user_memory, from_attributes=True
-            ),
-        )
-        wandb_client.finish_call(gen_answer_call, output=detect_demand_response)
-        return detect_demand_response.content or ""
 
-    detect_demand_agent_temp_memory_user_memory = (
-        detect_demand_agent.temporary_memory.user_memory
+
+def handle_phone_request(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_windows: ConversationWindows,
+    evaluate_context: EvaluateContext,
+    config: ConfigModel = ConfigModel(),
+    slots: Optional[dict[str, dict[str, Any]]] = None,
+    speculation: Optional[Speculation] = None,
+    cursor: PageCursor = PageCursor(),
+    is_superseded: Callable[[], bool] = lambda: False,
+) -> str:
+
+    # 1. collect and retrieval phone
+    (
+        collect_and_retrieval_agent,
+        collect_and_retrieval_call,
+        collect_and_retrieval_response,
+    ) = _run_collect_and_retrieval(
+        _init_phone_collect_and_retrieval,
+        user_memory,
+        user,
+        conversation_windows,
+        slots,
+        speculation,
+        cursor,
     )
-    product_type = detect_demand_agent_temp_memory_user_memory.intent.product_type  # type: ignore
 
-    match product_type:
-        case ProductType.MOBILE_PHONE:
-            handler = handle_phone_request
-        case ProductType.LAPTOP:
-            handler = handle_laptop_request
-        case _:
-            handler = handle_undetermined_request
+    print("Phone collect and retrieval response:", collect_and_retrieval_response)
 
-    response = handler(
-        user_memory=detect_demand_agent_temp_memory_user_memory,  # type: ignore
-        user=user,
-        conversation_messages=conversation_messages,
-        evaluate_context=evaluate_context,
-        config=config,
+    _finish_collect_and_retrieval(
+        collect_and_retrieval_agent,
+        collect_and_retrieval_call,
+        collect_and_retrieval_response,
     )
 
-    wandb_client.finish_call(gen_answer_call, output=response)
+    # 2. generate response phone
+    generate_agent, generate_agent_call = _init_phone_generate_response(
+        user_memory,
+        user,
+        conversation_windows.generate_response,
+        collect_and_retrieval_response,
+        config,
+    )
+    generate_response = generate_agent.run(
+        conversation_messages=conversation_windows.generate_response,
+        instructions=collect_and_retrieval_response.instructions,
+        phone_knowledge=collect_and_retrieval_response.knowledge,
+    )  # run agent generate response about phone
+
+    response = _finish_phone_generate_response(
+        generate_agent, generate_agent_call, generate_response, evaluate_context
+    )
+    # Written once the answer is ready, unless a later message superseded the turn.
+    if not is_superseded():
+        save_page_cursor(
+            user_memory.thread_id, collect_and_retrieval_agent.temporary_memory.cursor
+        )  # lưu cursor vào redis
+        save_suggestions(
+            user_memory.thread_id,
+            collect_and_retrieval_agent.temporary_memory.suggestions,
+        )
     return response
 
 
-def handle_phone_request(
+async def ahandle_phone_request(
     user_memory: UserMemoryModel,
     user: UserModel,
-    conversation_messages: list[ChatCompletionMessageParam],
+    conversation_windows: ConversationWindows,
     evaluate_context: EvaluateContext,
     config: ConfigModel = ConfigModel(),
+    slots: Optional[dict[str, dict[str, Any]]] = None,
+    speculation: Optional[Speculation] = None,
+    cursor: PageCursor = PageCursor(),
+    on_token: Optional[Callable[[str], Awaitable[Any]]] = None,
 ) -> str:
+    (
+        collect_and_retrieval_agent,
+        collect_and_retrieval_call,
+        collect_and_retrieval_response,
+    ) = await _arun_collect_and_retrieval(
+        _init_phone_collect_and_retrieval,
+        user_memory,
+        user,
+        conversation_windows,
+        slots,
+        speculation,
+        cursor,
+    )
 
-    # 1. collect and retrieval phone
+    print("Phone collect and retrieval response:", collect_and_retrieval_response)
+
+    await asave_page_cursor(
+        user_memory.thread_id, collect_and_retrieval_agent.temporary_memory.cursor
+    )
+    await asave_suggestions(
+        user_memory.thread_id, collect_and_retrieval_agent.temporary_memory.suggestions
+    )
+
+    _finish_collect_and_retrieval(
+        collect_and_retrieval_agent,
+        collect_and_retrieval_call,
+        collect_and_retrieval_response,
+    )
+
+    generate_agent, generate_agent_call = _init_phone_generate_response(
+        user_memory,
+        user,
+        conversation_windows.generate_response,
+        collect_and_retrieval_response,
+        config,
+    )
+    generate_response = await _agenerate(
+        generate_agent,
+        on_token,
+        conversation_messages=conversation_windows.generate_response,
+        instructions=collect_and_retrieval_response.instructions,
+        phone_knowledge=collect_and_retrieval_response.knowledge,
+    )
+
+    return _finish_phone_generate_response(
+        generate_agent, generate_agent_call, generate_response, evaluate_context
+    )
+
+
+def _run_collect_and_retrieval(
+    init,
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_windows: ConversationWindows,
+    slots: Optional[dict[str, dict[str, Any]]],
+    speculation: Optional[Speculation],
+    cursor: PageCursor,
+):
+    if speculation is not None:
+        return speculation.agent, speculation.call, speculation.response
+
+    collect_and_retrieval_agent, collect_and_retrieval_call = init(
+        user_memory, user, conversation_windows.collect_and_retrieval, cursor
+    )
+    # run agent collect and retrieval to get instructions and knowledge
+    collect_and_retrieval_response = (
+        collect_and_retrieval_agent.run_with_slots(slots)
+        if slots is not None
+        else collect_and_retrieval_agent.run(
+            messages=conversation_windows.collect_and_retrieval
+        )
+    )
+    return (
+        collect_and_retrieval_agent,
+        collect_and_retrieval_call,
+        collect_and_retrieval_response,
+    )
+
+
+async def _arun_collect_and_retrieval(
+    init,
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_windows: ConversationWindows,
+    slots: Optional[dict[str, dict[str, Any]]],
+    speculation: Optional[Speculation],
+    cursor: PageCursor,
+):
+    if speculation is not None:
+        return speculation.agent, speculation.call, speculation.response
+
+    collect_and_retrieval_agent, collect_and_retrieval_call = init(
+        user_memory, user, conversation_windows.collect_and_retrieval, cursor
+    )
+    collect_and_retrieval_response = (
+        await collect_and_retrieval_agent.arun_with_slots(slots)
+        if slots is not None
+        else await collect_and_retrieval_agent.arun(
+            messages=conversation_windows.collect_and_retrieval
+        )
+    )
+    return (
+        collect_and_retrieval_agent,
+        collect_and_retrieval_call,
+        collect_and_retrieval_response,
+    )
+
+
+async def _agenerate(
+    generate_agent: (
+        phone_generate_response.Agent
+        | laptop_generate_response.Agent
+        | undetermined_generate_response.Agent
+    ),
+    on_token: Optional[Callable[[str], Awaitable[Any]]],
+    **kwargs,
+) -> AgentResponseBase:
+    if on_token is None:
+        return await generate_agent.arun(**kwargs)
+
+    content = ""
+    async for token in generate_agent.astream(**kwargs):
+        content += token
+        await on_token(token)
+    return AgentResponseBase(type="finished", content=content)
+
+
+def _init_phone_collect_and_retrieval(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_messages: list[ChatCompletionMessageParam],
+    cursor: PageCursor,
+):
     collect_and_retrieval_memory = phone_collect_and_retrieval.AgentTemporaryMemory(
         user_memory=user_memory,
         user=user,
+        cursor=cursor,
     )  # init temporary memory collect and retrieval phone
 
     collect_and_retrieval_call = wandb_client.create_call(
@@ -167,31 +895,16 @@ def handle_phone_request(
         temporary_memory=collect_and_retrieval_memory,
         system_prompt_config=collect_and_retrieval_system_prompt_config,
     )  # init agent collect and retrieval phone
+    return collect_and_retrieval_agent, collect_and_retrieval_call
 
-    # run agent collect and retrieval phone to get instructions and knowledge
-    collect_and_retrieval_response = collect_and_retrieval_agent.run(
-        messages=conversation_messages
-    )
 
-    print("Phone collect and retrieval response:", collect_and_retrieval_response)
-
-    update_user_memory(
-        id=user_memory.id,
-        data=UpdateUserMemoryModel.model_validate(user_memory, from_attributes=True),
-    )
-    set_value(
-        f"offset:{user_memory.thread_id}", collect_and_retrieval_memory.offset
-    )  # lưu offset vào redis
-
-    wandb_client.finish_call(
-        collect_and_retrieval_call,
-        output={
-            "response": collect_and_retrieval_response,
-            "temporary_memory": collect_and_retrieval_memory,
-        },
-    )
-
-    # 2. generate response phone
+def _init_phone_generate_response(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_messages: list[ChatCompletionMessageParam],
+    collect_and_retrieval_response: phone_collect_and_retrieval.AgentResponse,
+    config: ConfigModel,
+):
     generate_memory = phone_generate_response.AgentTemporaryMemory(
         user_memory=user_memory,
         user=user,
@@ -216,12 +929,15 @@ def handle_phone_request(
         temporary_memory=generate_memory,
         system_prompt_config=generate_response_system_prompt_config,
     )  # init agent generate response phone
-    generate_response = generate_agent.run(
-        conversation_messages=conversation_messages,
-        instructions=collect_and_retrieval_response.instructions,
-        phone_knowledge=collect_and_retrieval_response.knowledge,
-    )  # run agent generate response about phone
+    return generate_agent, generate_agent_call
 
+
+def _finish_phone_generate_response(
+    generate_agent: phone_generate_response.Agent,
+    generate_agent_call,
+    generate_response: AgentResponseBase,
+    evaluate_context: EvaluateContext,
+) -> str:
     if generate_agent.system_prompt_config.phone_knowledge:
         evaluate_context.knowledge.append(
             f"""## PHONE KNOWLEDGE:\n{generate_agent.system_prompt_config.phone_knowledge_to_string()}"""
@@ -237,7 +953,7 @@ def handle_phone_request(
         generate_agent_call,
         output={
             "response": generate_response,
-            "temporary_memory": generate_memory,
+            "temporary_memory": generate_agent.temporary_memory,
         },
     )
     return generate_response.content or "Not content produced"
@@ -246,13 +962,140 @@ def handle_phone_request(
 def handle_laptop_request(
     user_memory: UserMemoryModel,
     user: UserModel,
-    conversation_messages: list[ChatCompletionMessageParam],
+    conversation_windows: ConversationWindows,
     evaluate_context: EvaluateContext,
     config: ConfigModel = ConfigModel(),
+    slots: Optional[dict[str, dict[str, Any]]] = None,
+    speculation: Optional[Speculation] = None,
+    cursor: PageCursor = PageCursor(),
+    is_superseded: Callable[[], bool] = lambda: False,
 ) -> str:
+    (
+        collect_and_retrieval_agent,
+        collect_and_retrieval_call,
+        collect_and_retrieval_response,
+    ) = _run_collect_and_retrieval(
+        _init_laptop_collect_and_retrieval,
+        user_memory,
+        user,
+        conversation_windows,
+        slots,
+        speculation,
+        cursor,
+    )
+
+    print(
+        "Laptop collect and retrieval response:",
+        collect_and_retrieval_response,
+    )
+
+    _finish_collect_and_retrieval(
+        collect_and_retrieval_agent,
+        collect_and_retrieval_call,
+        collect_and_retrieval_response,
+    )
+
+    generate_agent, generate_agent_call = _init_laptop_generate_response(
+        user_memory,
+        user,
+        conversation_windows.generate_response,
+        collect_and_retrieval_response,
+        config,
+    )
+    generate_response = generate_agent.run(
+        conversation_messages=conversation_windows.generate_response,
+        instructions=collect_and_retrieval_response.instructions,
+        laptop_knowledge=collect_and_retrieval_response.knowledge,
+    )  # run agent generate response about laptop
+
+    response = _finish_laptop_generate_response(
+        generate_agent, generate_agent_call, generate_response, evaluate_context
+    )
+    # Written once the answer is ready, unless a later message superseded the turn.
+    if not is_superseded():
+        save_page_cursor(
+            user_memory.thread_id, collect_and_retrieval_agent.temporary_memory.cursor
+        )
+        save_suggestions(
+            user_memory.thread_id,
+            collect_and_retrieval_agent.temporary_memory.suggestions,
+        )
+    return response
+
+
+async def ahandle_laptop_request(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_windows: ConversationWindows,
+    evaluate_context: EvaluateContext,
+    config: ConfigModel = ConfigModel(),
+    slots: Optional[dict[str, dict[str, Any]]] = None,
+    speculation: Optional[Speculation] = None,
+    cursor: PageCursor = PageCursor(),
+    on_token: Optional[Callable[[str], Awaitable[Any]]] = None,
+) -> str:
+    (
+        collect_and_retrieval_agent,
+        collect_and_retrieval_call,
+        collect_and_retrieval_response,
+    ) = await _arun_collect_and_retrieval(
+        _init_laptop_collect_and_retrieval,
+        user_memory,
+        user,
+        conversation_windows,
+        slots,
+        speculation,
+        cursor,
+    )
+
+    print(
+        "Laptop collect and retrieval response:",
+        collect_and_retrieval_response,
+    )
+
+    await asave_page_cursor(
+        user_memory.thread_id, collect_and_retrieval_agent.temporary_memory.cursor
+    )
+    await asave_suggestions(
+        user_memory.thread_id, collect_and_retrieval_agent.temporary_memory.suggestions
+    )
+
+    _finish_collect_and_retrieval(
+        collect_and_retrieval_agent,
+        collect_and_retrieval_call,
+        collect_and_retrieval_response,
+    )
+
+    generate_agent, generate_agent_call = _init_laptop_generate_response(
+        user_memory,
+        user,
+        conversation_windows.generate_response,
+        collect_and_retrieval_response,
+        config,
+    )
+    generate_response = await _agenerate(
+        generate_agent,
+        on_token,
+        conversation_messages=conversation_windows.generate_response,
+        instructions=collect_and_retrieval_response.instructions,
+        laptop_knowledge=collect_and_retrieval_response.knowledge,
+    )
+
+    return _finish_laptop_generate_response(
+        generate_agent, generate_agent_call, generate_response, evaluate_context
+    )
+
+
+def _init_laptop_collect_and_retrieval(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_messages: list[ChatCompletionMessageParam],
+    cursor: PageCursor,
+):
     collect_and_retrieval_memory = laptop_collect_and_retrieval.AgentTemporaryMemory(
         user_memory=user_memory,
         user=user,
+        cursor=cursor,
     )
 
     collect_and_retrieval_system_prompt_config = (
@@ -271,29 +1114,16 @@ def handle_laptop_request(
         temporary_memory=collect_and_retrieval_memory,
         system_prompt_config=collect_and_retrieval_system_prompt_config,
     )
-    collect_and_retrieval_response = collect_and_retrieval_agent.run(
-        messages=conversation_messages
-    )
+    return collect_and_retrieval_agent, collect_and_retrieval_call
 
-    print(
-        "Laptop collect and retrieval response:",
-        collect_and_retrieval_response,
-    )
-
-    update_user_memory(
-        id=user_memory.id,
-        data=UpdateUserMemoryModel.model_validate(user_memory, from_attributes=True),
-    )
-    set_value(f"offset:{user_memory.thread_id}", collect_and_retrieval_memory.offset)
-
-    wandb_client.finish_call(
-        collect_and_retrieval_call,
-        output={
-            "response": collect_and_retrieval_response,
-            "temporary_memory": collect_and_retrieval_memory,
-        },
-    )
 
+def _init_laptop_generate_response(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_messages: list[ChatCompletionMessageParam],
+    collect_and_retrieval_response: laptop_collect_and_retrieval.AgentResponse,
+    config: ConfigModel,
+):
     generate_memory = laptop_generate_response.AgentTemporaryMemory(
         user_memory=user_memory,
         user=user,
@@ -317,11 +1147,15 @@ def handle_laptop_request(
         temporary_memory=generate_memory,
         system_prompt_config=generate_response_system_prompt_config,
     )  # init agent generate response laptop
-    generate_response = generate_agent.run(
-        conversation_messages=conversation_messages,
-        instructions=collect_and_retrieval_response.instructions,
-        laptop_knowledge=collect_and_retrieval_response.knowledge,
-    )  # run agent generate response about laptop
+    return generate_agent, generate_agent_call
+
+
+def _finish_laptop_generate_response(
+    generate_agent: laptop_generate_response.Agent,
+    generate_agent_call,
+    generate_response: AgentResponseBase,
+    evaluate_context: EvaluateContext,
+) -> str:
     print("Laptop generate response:", generate_response)
     if generate_agent.system_prompt_config.laptop_knowledge:
         evaluate_context.knowledge.append(
@@ -337,21 +1171,76 @@ def handle_laptop_request(
         generate_agent_call,
         output={
             "response": generate_response,
-            "temporary_memory": generate_memory,
+            "temporary_memory": generate_agent.temporary_memory,
         },
     )
 
     return generate_response.content or "Not content produced"
 
 
+def _finish_collect_and_retrieval(
+    collect_and_retrieval_agent: (
+        phone_collect_and_retrieval.Agent | laptop_collect_and_retrieval.Agent
+    ),
+    collect_and_retrieval_call,
+    collect_and_retrieval_response: AgentResponseBase,
+):
+    wandb_client.finish_call(
+        collect_and_retrieval_call,
+        output={
+            "response": collect_and_retrieval_response,
+            "temporary_memory": collect_and_retrieval_agent.temporary_memory,
+        },
+    )
+
+
 def handle_undetermined_request(
     user_memory: UserMemoryModel,
     user: UserModel,
-    conversation_messages: list[ChatCompletionMessageParam],
+    conversation_windows: ConversationWindows,
     evaluate_context: EvaluateContext,
     config: ConfigModel = ConfigModel(),
 ) -> str:
+    generate_agent, generate_agent_call = _init_undetermined_generate_response(
+        user_memory, user, conversation_windows.generate_response, config
+    )
+    generate_response = generate_agent.run(
+        conversation_messages=conversation_windows.generate_response,
+    )
+    _set_undetermined_evaluate_context(generate_agent, evaluate_context)
+    return _finish_undetermined_generate_response(
+        generate_agent, generate_agent_call, generate_response
+    )
+
+
+async def ahandle_undetermined_request(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_windows: ConversationWindows,
+    evaluate_context: EvaluateContext,
+    config: ConfigModel = ConfigModel(),
+    on_token: Optional[Callable[[str], Awaitable[Any]]] = None,
+) -> str:
+    generate_agent, generate_agent_call = _init_undetermined_generate_response(
+        user_memory, user, conversation_windows.generate_response, config
+    )
+    generate_response = await _agenerate(
+        generate_agent,
+        on_token,
+        conversation_messages=conversation_windows.generate_response,
+    )
+    _set_undetermined_evaluate_context(generate_agent, evaluate_context)
+    return _finish_undetermined_generate_response(
+        generate_agent, generate_agent_call, generate_response
+    )
+
 
+def _init_undetermined_generate_response(
+    user_memory: UserMemoryModel,
+    user: UserModel,
+    conversation_messages: list[ChatCompletionMessageParam],
+    config: ConfigModel,
+):
     generate_agent_call = wandb_client.create_call(
         op="generate_response_undetermined",
         inputs={
@@ -371,24 +1260,31 @@ def handle_undetermined_request(
         temporary_memory=generate_memory,
         system_prompt_config=generate_response_system_prompt_config,
     )
-    generate_response = generate_agent.run(
-        conversation_messages=conversation_messages,
-    )
+    return generate_agent, generate_agent_call
+
+
+def _set_undetermined_evaluate_context(
+    generate_agent: undetermined_generate_response.Agent,
+    evaluate_context: EvaluateContext,
+):
     evaluate_context.knowledge = [
         f"""## BASE KNOWLEDGE:\n{generate_agent.system_prompt_config.base_knowledge_to_string()}"""
     ]
     evaluate_context.instruction = f"""## INSTRUCTION:\n{generate_agent.system_prompt_config.working_steps_to_string()}"""
-    update_user_memory(
-        id=user_memory.id,
-        data=UpdateUserMemoryModel.model_validate(user_memory, from_attributes=True),
-    )
+
+
+def _finish_undetermined_generate_response(
+    generate_agent: undetermined_generate_response.Agent,
+    generate_agent_call,
+    generate_response: AgentResponseBase,
+) -> str:
     print("Undetermined generate response:", generate_response)
 
     wandb_client.finish_call(
         generate_agent_call,
         output={
             "response": generate_response,
-            "temporary_memory": generate_memory,
+            "temporary_memory": generate_agent.temporary_memory,
         },
     )
     return generate_response.content or "Not content produced"
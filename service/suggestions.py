@@ -0,0 +1,75 @@
+from typing import Optional
+from uuid import UUID
+
+from pydantic import BaseModel, TypeAdapter
+
+from repositories.redis import get_value, set_value, aget_value, aset_value
+
+
+class Suggestion(BaseModel):
+    id: str
+    name: str
+
+
+_suggestions_adapter = TypeAdapter(list[Suggestion])
+
+
+def _key(thread_id: UUID) -> str:
+    return f"suggestions:{thread_id}"
+
+
+def _parse(value) -> list[Suggestion]:
+    if not value:
+        return []
+    return _suggestions_adapter.validate_json(value)
+
+
+def load(thread_id: UUID) -> list[Suggestion]:
+    """
+    Products of the last suggestion list shown in the thread, in the order shown.
+    """
+    return _parse(get_value(_key(thread_id)))
+
+
+async def aload(thread_id: UUID) -> list[Suggestion]:
+    return _parse(await aget_value(_key(thread_id)))
+
+
+def save(thread_id: UUID, suggestions: list[Suggestion]):
+    if suggestions:
+        set_value(_key(thread_id), _suggestions_adapter.dump_json(suggestions))
+
+
+async def asave(thread_id: UUID, suggestions: list[Suggestion]):
+    if suggestions:
+        await aset_value(_key(thread_id), _suggestions_adapter.dump_json(suggestions))
+
+
+def _normalize_name(name: str) -> str:
+    return " ".join(name.casefold().split())
+
+
+def find_by_name(
+    suggestions: list[Suggestion], name: Optional[str]
+) -> Optional[Suggestion]:
+    if not name:
+        return None
+    name = _normalize_name(name)
+    return next(
+        (
+            suggestion
+            for suggestion in suggestions
+            if _normalize_name(suggestion.name) == name
+        ),
+        None,
+    )
+
+
+def at_ordinal(suggestions: list[Suggestion], ordinal: int) -> Optional[Suggestion]:
+    """
+    The suggestion at a 1-based position, -1 being the last one.
+    """
+    index = ordinal - 1 if ordinal > 0 else ordinal
+    if ordinal == 0 or not -len(suggestions) <= index < len(suggestions):
+        return None
+    return suggestions[index]
@@ -0,0 +1,180 @@
+from typing import Any, Optional
+from uuid import UUID
+
+from openai.types.chat import ChatCompletionMessageParam
+from pydantic import BaseModel
+
+from env import env
+from models.user import UserModel
+from models.user_memory import UserMemoryModel
+import service.page_cursor as page_cursor
+from service.page_cursor import PageCursor
+from repositories.redis import (
+    get_values,
+    aget_values,
+    set_values,
+    aset_values,
+    update_value,
+    increment_value,
+    set_value_if_unchanged,
+)
+
+
+class ThreadMessages(BaseModel):
+    """
+    Latest messages of a thread in OpenAI format and the number of messages the whole
+    thread has, so that positions stay those of the thread (see `offset`).
+    """
+
+    messages: list[dict[str, Any]] = []
+    count: int = 0
+
+    @property
+    def offset(self) -> int:
+        # Position in the thread of the first message kept.
+        return self.count - len(self.messages)
+
+
+class ThreadState(BaseModel):
+    """
+    What every turn reads about its thread, None where it isn't cached. Postgres stays
+    the source of truth, the copies here are written after it.
+    """
+
+    user: Optional[UserModel] = None
+    user_memory: Optional[UserMemoryModel] = None
+    cursor: PageCursor = PageCursor()
+    messages: Optional[ThreadMessages] = None
+    # Changes whenever a message is added to the thread, cached or not.
+    messages_version: Optional[str] = None
+
+    def history(self) -> Optional[tuple[list[ChatCompletionMessageParam], int]]:
+        """
+        The cached messages and the position of the first one in the thread, when they
+        reach back to the part folded into the user memory's summary.
+        """
+        if self.messages is None or self.user_memory is None:
+            return None
+        if self.messages.offset > self.user_memory.summarized_message_count:
+            return None
+        return self.messages.messages, self.messages.offset  # type: ignore
+
+
+def _user_key(thread_id: UUID) -> str:
+    return f"thread_user:{thread_id}"
+
+
+def _user_memory_key(thread_id: UUID) -> str:
+    return f"thread_user_memory:{thread_id}"
+
+
+def _messages_key(thread_id: UUID) -> str:
+    return f"thread_messages:{thread_id}"
+
+
+def _messages_version_key(thread_id: UUID) -> str:
+    return f"thread_messages_version:{thread_id}"
+
+
+def _keys(thread_id: UUID) -> list[str]:
+    return [
+        _user_key(thread_id),
+        _user_memory_key(thread_id),
+        page_cursor.key(thread_id),
+        _messages_key(thread_id),
+        _messages_version_key(thread_id),
+    ]
+
+
+def _parse(values: list) -> ThreadState:
+    user, user_memory, cursor, messages, messages_version = values
+    return ThreadState(
+        user=UserModel.model_validate_json(user) if user else None,
+        user_memory=(
+            UserMemoryModel.model_validate_json(user_memory) if user_memory else None
+        ),
+        cursor=page_cursor.parse(cursor),
+        messages=ThreadMessages.model_validate_json(messages) if messages else None,
+        messages_version=messages_version,
+    )
+
+
+def load(thread_id: UUID) -> ThreadState:
+    """
+    The thread's state in one round trip. With the cache disabled, only the page cursor
+    that is always kept in Redis.
+    """
+    if not env.THREAD_STATE_CACHE_ENABLED:
+        return ThreadState(cursor=page_cursor.load(thread_id))
+    return _parse(get_values(_keys(thread_id)))
+
+
+async def aload(thread_id: UUID) -> ThreadState:
+    if not env.THREAD_STATE_CACHE_ENABLED:
+        return ThreadState(cursor=await page_cursor.aload(thread_id))
+    return _parse(await aget_values(_keys(thread_id)))
+
+
+def _values(user: UserModel, user_memory: UserMemoryModel) -> dict[str, str]:
+    return {
+        _user_key(user_memory.thread_id): user.model_dump_json(exclude={"password"}),
+        _user_memory_key(user_memory.thread_id): user_memory.model_dump_json(),
+    }
+
+
+def store(user: UserModel, user_memory: UserMemoryModel):
+    """
+    Writes the user and the user memory through once they are stored in Postgres.
+    """
+    if env.THREAD_STATE_CACHE_ENABLED:
+        set_values(_values(user, user_memory))
+
+
+async def astore(user: UserModel, user_memory: UserMemoryModel):
+    if env.THREAD_STATE_CACHE_ENABLED:
+        await aset_values(_values(user, user_memory))
+
+
+def _capped(messages: list, count: int) -> str:
+    return ThreadMessages(
+        messages=messages[-env.THREAD_STATE_MAX_MESSAGES :], count=count
+    ).model_dump_json()
+
+
+def store_messages(
+    thread_id: UUID,
+    messages: list[ChatCompletionMessageParam],
+    messages_version: Optional[str],
+):
+    """
+    Caches the latest of `messages`, all the messages of the thread as read from
+    Postgres after `messages_version` was loaded. Nothing is written when a message was
+    added since: it may be missing from `messages`, the next read caches them.
+    """
+    if env.THREAD_STATE_CACHE_ENABLED:
+        set_value_if_unchanged(
+            _messages_key(thread_id),
+            _capped(messages, len(messages)),
+            _messages_version_key(thread_id),
+            messages_version,
+        )
+
+
+def append_messages(thread_id: UUID, messages: list[ChatCompletionMessageParam]):
+    """
+    Adds messages just stored in Postgres to the cached ones. Nothing is written when
+    the thread's messages aren't cached: the next read caches them from Postgres. The
+    version changes either way, so that a read from before them isn't cached.
+    """
+    if not env.THREAD_STATE_CACHE_ENABLED:
+        return
+
+    increment_value(_messages_version_key(thread_id))
+
+    def _append(value) -> Optional[str]:
+        if not value:
+            return None
+        cached = ThreadMessages.model_validate_json(value)
+        return _capped([*cached.messages, *messages], cached.count + len(messages))
+
+    update_value(_messages_key(thread_id), _append)
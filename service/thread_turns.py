@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+from uuid import UUID
+
+from redis.exceptions import LockError
+
+from repositories.redis import get_value, increment_value, get_lock
+
+# Longer than any turn, so that the lock only expires when its holder crashed.
+_LOCK_TIMEOUT = 300
+
+
+def _generation_key(thread_id: UUID) -> str:
+    return f"thread_generation:{thread_id}"
+
+
+def _lock_key(thread_id: UUID) -> str:
+    return f"thread_lock:{thread_id}"
+
+
+def start(thread_id: UUID) -> int:
+    """
+    Registers a new user message of the thread and returns the generation of the turn
+    answering it. Any later message supersedes that turn.
+    """
+    return increment_value(_generation_key(thread_id))
+
+
+def is_superseded(thread_id: UUID, generation: int) -> bool:
+    return int(get_value(_generation_key(thread_id)) or 0) != generation
+
+
+@contextmanager
+def lock(thread_id: UUID):
+    """
+    Runs the block alone among all the processes answering the thread, so that two
+    turns never read and write its user memory and Redis state at the same time.
+    """
+    thread_lock = get_lock(
+        _lock_key(thread_id), timeout=_LOCK_TIMEOUT, blocking_timeout=_LOCK_TIMEOUT
+    )
+    if not thread_lock.acquire():
+        raise TimeoutError(f"Thread {thread_id} is still locked")
+    try:
+        yield
+    finally:
+        try:
+            thread_lock.release()
+        except LockError:
+            # Expired while the block ran, another turn may hold it by now.
+            pass
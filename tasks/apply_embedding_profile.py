@@ -0,0 +1,103 @@
+import re
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from db import Session
+from env import env
+
+"""
+Rebuilds the embedding columns and their HNSW indexes for an embedding profile,
+EMBEDDING_STORAGE x EMBEDDING_DIMENSIONS by default. The migrations always leave the
+default profile, vector(1536); run this after changing the profile in .env and before
+starting the app with it, as the models type the columns from the same settings.
+
+text-embedding-3 vectors are Matryoshka trained, so the leading dimensions
+re-normalized are the same vector the API returns for `dimensions=N`: rows are
+converted in place instead of re-embedded. That only goes down, getting more
+dimensions back needs the catalog to be imported again.
+
+Needs pgvector >= 0.7 (halfvec, subvector, l2_normalize). All the columns are
+rebuilt in one transaction.
+
+How to run:
+python
+from tasks.apply_embedding_profile import run
+run()
+"""
+
+# (table, embedding column)
+EMBEDDING_COLUMNS = [
+    ("phones", "name_embedding"),
+    ("laptops", "name_embedding"),
+    ("accessories", "name_embedding"),
+    ("brands", "embedding"),
+    ("faqs", "embedding"),
+]
+
+_type_pattern = re.compile(r"(\w+)\((\d+)\)")
+
+
+def _column_type(connection: Connection, table: str, column: str) -> tuple[str, int]:
+    column_type = connection.execute(
+        text(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = CAST(:table AS regclass) AND attname = :column"
+        ),
+        {"table": table, "column": column},
+    ).scalar_one()
+    match = _type_pattern.fullmatch(column_type)
+    if match is None:
+        raise ValueError(f"{table}.{column} is {column_type}, not a sized vector")
+    return match.group(1), int(match.group(2))
+
+
+def _rebuild(
+    connection: Connection,
+    table: str,
+    column: str,
+    storage: str,
+    dimensions: int,
+    current_dimensions: int,
+):
+    index = f"ix_{table}_{column}_hnsw"
+    column_type = f"{storage}({dimensions})"
+    expression = f"{column}::vector"
+    if dimensions < current_dimensions:
+        expression = f"l2_normalize(subvector({expression}, 1, {dimensions}))"
+
+    connection.execute(text(f"DROP INDEX IF EXISTS {index}"))
+    connection.execute(
+        text(
+            f"ALTER TABLE {table} ALTER COLUMN {column} "
+            f"TYPE {column_type} USING {expression}::{column_type}"
+        )
+    )
+    connection.execute(
+        text(
+            f"CREATE INDEX {index} ON {table} "
+            f"USING hnsw ({column} {storage}_cosine_ops) "
+            "WITH (m = 16, ef_construction = 64)"
+        )
+    )
+
+
+def run(
+    storage: str = env.EMBEDDING_STORAGE, dimensions: int = env.EMBEDDING_DIMENSIONS
+):
+    with Session() as session:
+        connection = session.connection()
+        for table, column in EMBEDDING_COLUMNS:
+            current_storage, current_dimensions = _column_type(
+                connection, table, column
+            )
+            current = f"{current_storage}({current_dimensions})"
+            if (current_storage, current_dimensions) == (storage, dimensions):
+                print(f"ok      {table}.{column}: {current}")
+                continue
+            if dimensions > current_dimensions:
+                raise ValueError(
+                    f"{table}.{column} has {current_dimensions} dimensions, "
+                    f"{dimensions} need the catalog to be imported again"
+                )
+            _rebuild(connection, table, column, storage, dimensions, current_dimensions)
+            print(f"rebuilt {table}.{column}: {current} -> {storage}({dimensions})")
+        session.commit()
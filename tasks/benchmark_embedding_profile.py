@@ -0,0 +1,188 @@
+import json
+import re
+import time
+from glob import glob
+from statistics import mean, quantiles
+from sqlalchemy import text
+from db import Session
+from service.openai import create_embeddings
+from service.embedding import (
+    normalize_text,
+    with_prefix,
+    PHONE_NAME_PREFIX,
+    LAPTOP_NAME_PREFIX,
+)
+
+"""
+Compares recall@k, latency and index size of the embedding profiles
+(EMBEDDING_DIMENSIONS x EMBEDDING_STORAGE) on the current catalog before
+switching the profile in .env.
+
+Needs pgvector >= 0.7 and the columns still at the full 1536 dimensions: every
+profile is derived server side from the stored vectors, so no catalog row is
+re-embedded.
+
+How to run:
+python
+from tasks.benchmark_embedding_profile import run
+run()
+"""
+
+FULL_DIMENSIONS = 1536
+DIMENSIONS = [1536, 1024, 512, 256]
+STORAGES = ["vector", "halfvec"]
+EF_SEARCH = {"faq": 40, "product_name": 100}
+
+_question_pattern = re.compile(r"Câu hỏi: (.*?)\nCâu trả lời:", re.DOTALL)
+
+
+def _faq_queries(session, golden_glob: str) -> list[tuple[str, str]]:
+    ids_by_question = {
+        normalize_text(question): str(id)
+        for id, question in session.execute(text("SELECT id, question FROM faqs"))
+    }
+    queries = []
+    for file_path in glob(golden_glob):
+        with open(file_path) as f:
+            goldens = json.load(f)
+        for golden in goldens:
+            for context in golden.get("context") or []:
+                match = _question_pattern.search(context)
+                id = match and ids_by_question.get(normalize_text(match.group(1)))
+                if id:
+                    queries.append((golden["input"], id))
+                    break
+    return queries
+
+
+def _product_name_queries(session, limit: int) -> list[tuple[str, str]]:
+    # Lowercased names, the way users type them in the chat.
+    queries = []
+    sources = [("phones", PHONE_NAME_PREFIX), ("laptops", LAPTOP_NAME_PREFIX)]
+    for table, prefix in sources:
+        rows = session.execute(
+            text(f"SELECT id, name FROM {table} ORDER BY random() LIMIT :limit"),
+            {"limit": limit},
+        )
+        queries += [(with_prefix(prefix, name.lower()), str(id)) for id, name in rows]
+    return queries
+
+
+def _embed(queries: list[tuple[str, str]]) -> list[list[float]]:
+    texts = [normalize_text(query) for query, _ in queries]
+    embeddings = []
+    for i in range(0, len(texts), 100):
+        embeddings += create_embeddings(texts[i : i + 100])
+    return embeddings
+
+
+def _reduce(embedding: list[float], dimensions: int) -> list[float]:
+    embedding = embedding[:dimensions]
+    norm = sum(x * x for x in embedding) ** 0.5
+    return [x / norm for x in embedding]
+
+
+def _build_table(session, source: str, column: str, storage: str, dimensions: int):
+    column_type = f"{storage}({dimensions})"
+    expression = f"{column}::vector"
+    if dimensions < FULL_DIMENSIONS:
+        expression = f"l2_normalize(subvector({expression}, 1, {dimensions}))"
+    session.execute(text("DROP TABLE IF EXISTS embedding_profile_benchmark"))
+    session.execute(
+        text(
+            f"CREATE TEMP TABLE embedding_profile_benchmark AS "
+            f"SELECT id::text AS id, {expression}::{column_type} AS embedding "
+            f"FROM {source}"
+        )
+    )
+    session.execute(
+        text(
+            f"CREATE INDEX ON embedding_profile_benchmark USING hnsw "
+            f"(embedding {storage}_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        )
+    )
+    session.execute(text("ANALYZE embedding_profile_benchmark"))
+    index_size = session.execute(
+        text(
+            "SELECT sum(pg_relation_size(indexrelid)) FROM pg_index "
+            "WHERE indrelid = 'embedding_profile_benchmark'::regclass"
+        )
+    ).scalar_one()
+    return int(index_size)
+
+
+def _evaluate(
+    session,
+    queries: list[tuple[str, str]],
+    embeddings: list[list[float]],
+    storage: str,
+    dimensions: int,
+    top_k: int,
+) -> tuple[float, list[float]]:
+    stmt = text(
+        f"SELECT id FROM embedding_profile_benchmark "
+        f"ORDER BY embedding <=> CAST(:embedding AS {storage}({dimensions})) "
+        f"LIMIT :top_k"
+    )
+    hits = 0
+    latencies = []
+    for (_, expected_id), embedding in zip(queries, embeddings):
+        params = {"embedding": str(_reduce(embedding, dimensions)), "top_k": top_k}
+        start = time.perf_counter()
+        ids = session.execute(stmt, params).scalars().all()
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += expected_id in ids
+    return hits / max(len(queries), 1), latencies
+
+
+def _benchmark(session, name, source, column, queries, ef_search, top_k):
+    print(f"\n{name}: {len(queries)} queries, recall@{top_k}")
+    print("storage  dims  recall   p50 ms   p95 ms   index kB")
+    embeddings = _embed(queries)
+    session.execute(
+        text("SELECT set_config('hnsw.ef_search', :ef_search, false)"),
+        {"ef_search": str(ef_search)},
+    )
+    for storage in STORAGES:
+        for dimensions in DIMENSIONS:
+            index_size = _build_table(session, source, column, storage, dimensions)
+            recall, latencies = _evaluate(
+                session, queries, embeddings, storage, dimensions, top_k
+            )
+            p50, p95 = (
+                quantiles(latencies, n=20)[9::9]
+                if len(latencies) > 1
+                else [mean(latencies or [0])] * 2
+            )
+            print(
+                f"{storage:<8} {dimensions:>5}  {recall:.3f}  {p50:>7.2f}  "
+                f"{p95:>7.2f}  {index_size / 1024:>9.0f}"
+            )
+
+
+def run(
+    golden_glob: str = "goldens.json/*.json",
+    product_limit: int = 200,
+    top_k: int = 4,
+):
+    with Session() as session:
+        faq_queries = _faq_queries(session, golden_glob)
+        _benchmark(
+            session, "FAQ", "faqs", "embedding", faq_queries, EF_SEARCH["faq"], top_k
+        )
+
+        name_queries = _product_name_queries(session, product_limit)
+        source = (
+            "(SELECT id, name_embedding FROM phones "
+            "UNION ALL SELECT id, name_embedding FROM laptops) AS products"
+        )
+        _benchmark(
+            session,
+            "Product name",
+            source,
+            "name_embedding",
+            name_queries,
+            EF_SEARCH["product_name"],
+            top_k,
+        )
+        session.rollback()
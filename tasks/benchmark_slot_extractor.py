@@ -0,0 +1,162 @@
+import csv
+import json
+import time
+from collections import Counter
+from statistics import mean
+from typing import Any
+from openai.types.chat import ChatCompletionMessageParam
+import agents.detect_demand as detect_demand
+import agents.phone.collect_and_retrieval as phone_collect_and_retrieval
+import agents.laptop.collect_and_retrieval as laptop_collect_and_retrieval
+from models.user_memory import ProductType, PriceRequirement
+import service.slot_extractor as slot_extractor
+
+"""
+Runs the slot extractor and the collect_and_retrieval LLM call on the user messages of
+input_conversation_data.csv, then reports how many turns the extractor covers, how
+often it agrees with the LLM's tool calls and the latency the skipped calls save.
+
+The product type of each message is detected with the detect_demand LLM, messages
+without a phone or laptop demand are left out.
+
+How to run:
+python
+from tasks.benchmark_slot_extractor import run
+run()
+"""
+
+_collect_agents = {
+    ProductType.MOBILE_PHONE: phone_collect_and_retrieval.Agent,
+    ProductType.LAPTOP: laptop_collect_and_retrieval.Agent,
+}
+
+
+def _messages(csv_path: str) -> list[str]:
+    with open(csv_path, encoding="utf-8-sig") as f:
+        messages = [row["user_message"].strip() for row in csv.DictReader(f)]
+    return list(dict.fromkeys(message for message in messages if message))
+
+
+def _llm_tool_arguments(
+    product_type: ProductType, messages: list[ChatCompletionMessageParam]
+) -> tuple[dict[str, dict[str, Any]], float]:
+    agent = _collect_agents[product_type]()
+    agent.temporary_memory.chat_completions_messages = (
+        agent.system_prompt_config.get_openai_messages(messages)
+    )
+    start = time.perf_counter()
+    response = agent._get_openai_request().create().choices[0].message
+    latency = time.perf_counter() - start
+    return {
+        tool_call.function.name: json.loads(tool_call.function.arguments or "{}")
+        for tool_call in response.tool_calls or []
+    }, latency
+
+
+def _comparable(tool_arguments: dict[str, dict[str, Any]]) -> dict[str, Any]:
+    """
+    The values the tools store in the user memory, keyed by slot.
+    """
+    values: dict[str, Any] = {}
+    for name, arguments in tool_arguments.items():
+        if name.endswith("_price_requirements"):
+            price = PriceRequirement(
+                arguments.get("approximate_price"),
+                arguments.get("min_price"),
+                arguments.get("max_price"),
+            )
+            if price.min_price is not None or price.max_price is not None:
+                values["price"] = (price.min_price, price.max_price)
+        for key, value in arguments.items():
+            if value in (None, {}, ""):
+                continue
+            if key.endswith("_storage"):
+                values["storage"] = (value.get("min_value"), value.get("max_value"))
+            elif key.endswith("_color"):
+                values["color"] = slot_extractor.normalize(value)
+            elif key.endswith("_brand"):
+                values["brand"] = slot_extractor.normalize(value)
+        # Tools the extractor has no slot for, a call with values means the LLM
+        # understood more than the extractor.
+        if name.endswith(("_name_requirements", "_user_intent")) and any(
+            arguments.values()
+        ):
+            values[name] = arguments
+    return values
+
+
+def run(
+    csv_path: str = "input_conversation_data.csv",
+    limit: int | None = None,
+):
+    detect_demand_agent = detect_demand.Agent(
+        temporary_memory=detect_demand.AgentTemporaryMemory()
+    )
+    for product_type in _collect_agents:
+        slot_extractor.get_vocabulary(product_type)
+    slot_counts, slot_compared, slot_agreements = Counter(), Counter(), Counter()
+    skipped, skipped_agreements = 0, 0
+    local_latencies, llm_latencies = [], []
+    turns = 0
+
+    for message in _messages(csv_path)[:limit]:
+        messages: list[ChatCompletionMessageParam] = [
+            {"role": "user", "content": message}
+        ]
+        user_request = detect_demand_agent.parse_user_request(messages)
+        if not user_request or user_request.user_demand not in _collect_agents:
+            continue
+        product_type = user_request.user_demand
+        turns += 1
+
+        start = time.perf_counter()
+        extraction = slot_extractor.extract(message, product_type)
+        local_arguments = slot_extractor.confident_tool_arguments(
+            extraction, product_type
+        )
+        local_latencies.append(time.perf_counter() - start)
+
+        llm_arguments, llm_latency = _llm_tool_arguments(product_type, messages)
+        llm_latencies.append(llm_latency)
+        llm_values = _comparable(llm_arguments)
+
+        local_values = _comparable(
+            slot_extractor.to_tool_arguments(extraction, product_type) or {}
+        )
+        for slot in extraction.slots:
+            slot_counts[slot.name] += 1
+            if slot.name in local_values:
+                slot_compared[slot.name] += 1
+                slot_agreements[slot.name] += (
+                    local_values[slot.name] == llm_values.get(slot.name)
+                )
+
+        if local_arguments is not None:
+            skipped += 1
+            agrees = _comparable(local_arguments) == llm_values
+            skipped_agreements += agrees
+            if not agrees:
+                print(f"Disagreement on {message!r}:", local_arguments, llm_arguments)
+
+    print(f"{turns} phone or laptop turns")
+    for name, count in slot_counts.most_common():
+        # Ordinals have no tool argument until the suggestions are known.
+        compared = slot_compared[name]
+        agreement = (
+            f"{slot_agreements[name] / compared:.1%} agree with the LLM"
+            if compared
+            else "not compared"
+        )
+        print(f"{name}: extracted in {count} turns, {agreement}")
+    if not turns:
+        return
+    print(
+        f"coverage: {skipped / turns:.1%} of the turns skip the LLM, "
+        f"{skipped_agreements / max(skipped, 1):.1%} agree with it"
+    )
+    print(f"local latency: {mean(local_latencies) * 1e6:.0f} us per message")
+    print(f"LLM latency: {mean(llm_latencies) * 1000:.0f} ms per message")
+    print(
+        "latency saved: "
+        f"{skipped / turns * mean(llm_latencies) * 1000:.0f} ms per turn on average"
+    )
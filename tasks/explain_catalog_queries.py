@@ -0,0 +1,131 @@
+import json
+from typing import Any
+from sqlalchemy import Select
+from sqlalchemy.dialects import postgresql
+from db import Session
+from models.user_memory import NumericConfiguration
+from service.phone import PhoneFilter, Config as PhoneConfig
+from service.laptop import LaptopFilter
+from service.accessory import AccessoryFilter
+
+"""
+EXPLAINs the statements of representative phone, laptop and accessory filters and
+checks that each one reads the catalog index meant for it, then prints the plans that
+don't.
+
+With `force_index=True` (the default) sequential scans are disabled for the EXPLAIN,
+so the check also holds on a small catalog where the planner would rightly prefer
+reading the whole table; it then tells whether the index can serve the query.
+
+How to run:
+python
+from tasks.explain_catalog_queries import run
+run()
+"""
+
+# (description, filter, indexes the plan should read one of). A range filter with a
+# brand may also be served by walking the brand's rows in score order.
+_CASES: list[tuple[str, Any, tuple[str, ...]]] = [
+    (
+        "phones of a brand",
+        PhoneFilter(brand_code="samsung"),
+        ("ix_phones_brand_code_score_id",),
+    ),
+    (
+        "phones of a brand, next page",
+        PhoneFilter(brand_code="samsung", config=PhoneConfig(after=[4.5, "0"])),
+        ("ix_phones_brand_code_score_id",),
+    ),
+    (
+        "phones of any brand, next page",
+        PhoneFilter(config=PhoneConfig(after=[4.5, "0"])),
+        ("ix_phones_score_id",),
+    ),
+    (
+        "phones of a brand in a price range",
+        PhoneFilter(brand_code="apple", min_price=10_000_000, max_price=20_000_000),
+        ("ix_phones_brand_code_min_price_max_price", "ix_phones_brand_code_score_id"),
+    ),
+    (
+        "phones of a color",
+        PhoneFilter(brand_code="apple", color="đen"),
+        ("ix_phone_variants_color_tsv_gin",),
+    ),
+    (
+        "phones with a ROM range",
+        PhoneFilter(brand_code="apple", rom=NumericConfiguration(min_value=256)),
+        ("ix_phone_variants_phone_id",),
+    ),
+    (
+        "laptops of a brand",
+        LaptopFilter(brand_code="asus"),
+        ("ix_laptops_brand_code_score_id",),
+    ),
+    (
+        "laptops of a brand in a price range",
+        LaptopFilter(brand_code="asus", min_price=15_000_000, max_price=25_000_000),
+        (
+            "ix_laptops_brand_code_min_price_max_price",
+            "ix_laptops_brand_code_score_id",
+        ),
+    ),
+    (
+        "laptops of a color",
+        LaptopFilter(brand_code="asus", color="bạc"),
+        ("ix_laptop_variants_color_tsv_gin",),
+    ),
+    (
+        "accessories of a type and brand",
+        AccessoryFilter(product_type="05016", brand_code="apple"),
+        ("ix_accessories_product_type_brand_code_score_id",),
+    ),
+    (
+        "accessories of a type in a price range",
+        AccessoryFilter(product_type="05016", max_price=1_000_000),
+        (
+            "ix_accessories_product_type_price",
+            "ix_accessories_product_type_brand_code_score_id",
+        ),
+    ),
+]
+
+
+def index_names(plan: dict) -> set[str]:
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= index_names(child)
+    return names
+
+
+def explain(stmt: Select, force_index: bool) -> dict:
+    sql = str(
+        stmt.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+    with Session() as session:
+        connection = session.connection()
+        if force_index:
+            connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        result = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+        session.rollback()
+    plan = result if isinstance(result, list) else json.loads(result)
+    return plan[0]["Plan"]
+
+
+def run(force_index: bool = True):
+    failures = 0
+    for description, filter, indexes in _CASES:
+        plan = explain(filter.to_statement(), force_index)
+        used = index_names(plan)
+        if used.intersection(indexes):
+            print(f"ok      {description}: {', '.join(sorted(used))}")
+            continue
+        failures += 1
+        print(
+            f"MISSING {description}: expected one of {', '.join(indexes)}, "
+            f"read {', '.join(sorted(used)) or 'none'}"
+        )
+        print(json.dumps(plan, indent=2))
+
+    print(f"{len(_CASES) - failures}/{len(_CASES)} filters read their index")
@@ -0,0 +1,88 @@
+import json
+import uuid
+from typing import Any
+from sqlalchemy import Select, select
+from models.message import Message
+from models.thread import Thread
+from models.user import User, UserRole
+from models.user_memory import UserMemory
+from tasks.explain_catalog_queries import explain, index_names
+
+"""
+EXPLAINs the lookups every chat turn makes on the conversation tables, in the shape the
+repositories run them, and checks that each one reads the index meant for it. Those
+ordered by created_at must also come out of the index already sorted, without a Sort
+over the whole thread's messages or the whole user's threads.
+
+`force_index` works as in tasks.explain_catalog_queries.
+
+How to run:
+python
+from tasks.explain_conversation_queries import run
+run()
+"""
+
+_ID = uuid.UUID(int=0)
+
+# (description, statement, index the plan should read, whether it must not sort)
+_CASES: list[tuple[str, Select, str, bool]] = [
+    (
+        "message by Facebook message id",
+        select(Message).where(Message.fb_message_id == "m_0"),
+        "ix_messages_fb_message_id",
+        False,
+    ),
+    (
+        "latest messages of a thread",
+        select(Message)
+        .where(Message.thread_id == _ID)
+        .order_by(Message.created_at.desc())
+        .limit(10),
+        "ix_messages_thread_id_created_at",
+        True,
+    ),
+    (
+        "memory of a thread",
+        select(UserMemory).where(UserMemory.thread_id == _ID),
+        "ix_user_memory_thread_id",
+        False,
+    ),
+    (
+        "threads of a user",
+        select(Thread).where(Thread.user_id == _ID).order_by(Thread.created_at.desc()),
+        "ix_threads_user_id_created_at",
+        True,
+    ),
+    (
+        "user by Facebook user id",
+        select(User).where((User.fb_user_id == "0") & (User.role == UserRole.fb_user)),
+        "ix_users_fb_user_id_role",
+        False,
+    ),
+]
+
+
+def _node_types(plan: dict) -> set[str]:
+    types = {plan["Node Type"]}
+    for child in plan.get("Plans", []):
+        types |= _node_types(child)
+    return types
+
+
+def run(force_index: bool = True):
+    failures = 0
+    for description, stmt, index, ordered in _CASES:
+        plan: dict[str, Any] = explain(stmt, force_index)
+        used = index_names(plan)
+        sorts = ordered and "Sort" in _node_types(plan)
+        if index in used and not sorts:
+            print(f"ok      {description}: {', '.join(sorted(used))}")
+            continue
+        failures += 1
+        print(
+            f"MISSING {description}: expected {index} without a Sort, "
+            f"read {', '.join(sorted(used)) or 'none'}"
+        )
+        print(json.dumps(plan, indent=2))
+
+    print(f"{len(_CASES) - failures}/{len(_CASES)} lookups read their index")
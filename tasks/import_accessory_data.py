@@ -7,7 +7,8 @@ from bs4 import BeautifulSoup
 import os
 from models.accessory import CreateAccessoryModel
 from repositories.accessory import upsert_accessory
-from service.embedding import get_embedding
+from service.embedding import get_embedding, with_prefix, ACCESSORY_NAME_PREFIX
+from service.catalog import write_snapshot, ACCESSORY
 import sys
 # Thêm thư mục gốc vào PYTHONPATH
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -65,6 +66,8 @@ def import_accessories_data_jsonl_to_database(
         if len(batch) > 0:  # process the final batch
             import_batch_data_to_database(batch)
 
+    write_snapshot(ACCESSORY)
+
 
 def import_batch_data_to_database(batch: list[dict]):
     for accessory in batch:
@@ -80,7 +83,7 @@ def import_batch_data_to_database(batch: list[dict]):
         price = accessory.get("price", -1)
         score = accessory.get("score", 0)
         #name_embedding = get_embedding(name)
-        name_embedding = get_embedding(f"Accessor Name: {name}")
+        name_embedding = get_embedding(with_prefix(ACCESSORY_NAME_PREFIX, name))
         
         if id is not None:
             print(f"Upserting accessory: {id}, {name}, {brand_code}")
@@ -1,7 +1,7 @@
 from repositories.brand import upsert_brand
 from models.brand import CreateBrandModel
 import time
-from service.embedding import get_embedding
+from service.embedding import get_embedding, with_prefix, BRAND_PREFIX
 import json
 
 file_path = "tasks/unique_brands.json"
@@ -31,7 +31,7 @@ def import_json(file_path: str = file_path):
             if id and name:
                 upsert_brand(
                     CreateBrandModel(
-                        id=id, name=name, embedding=get_embedding(f"Brand: {name}")
+                        id=id, name=name, embedding=get_embedding(with_prefix(BRAND_PREFIX, name))
                     )
                 )
 
@@ -12,7 +12,8 @@ from env import env
 from bs4 import BeautifulSoup
 from models.laptop import CreateLaptopModel  # Cần tạo model này
 from repositories.laptop import upsert_laptop  # Cần tạo repository này
-from service.embedding import get_embedding
+from service.embedding import get_embedding, with_prefix, LAPTOP_NAME_PREFIX
+from service.catalog import write_snapshot, LAPTOP
 from repositories.laptop_variant import (
     delete_laptop_variants_by_laptop_id,
     create_laptop_variant,
@@ -79,6 +80,8 @@ def import_laptop_data_jsonl_to_database(
         if len(batch) > 0:
             import_batch_data_to_database(batch)
 
+    write_snapshot(LAPTOP)
+
 
 def import_batch_data_to_database(batch: list[dict]):
     for laptop in batch:
@@ -94,7 +97,7 @@ def import_batch_data_to_database(batch: list[dict]):
         price = laptop.get("price", -1)
         score = laptop.get("score", 0)
         # name_embedding = get_embedding(name)
-        name_embedding = get_embedding(f"Laptop Name: {name}")
+        name_embedding = get_embedding(with_prefix(LAPTOP_NAME_PREFIX, name))
 
         if id is not None and brand_code is not None and product_type is not None:
             print(f"Upserting laptop: {id}, {name}, {brand_code}")
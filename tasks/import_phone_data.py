@@ -9,7 +9,8 @@ from bs4 import BeautifulSoup
 import os
 from models.phone import CreatePhoneModel, Phone
 from repositories.phone import upsert_phone
-from service.embedding import get_embedding
+from service.embedding import get_embedding, with_prefix, PHONE_NAME_PREFIX
+from service.catalog import write_snapshot, PHONE
 import httpx
 from repositories.phone_variant import (
     delete_by_phone_id as delete_phone_variant_by_phone_id,
@@ -73,6 +74,8 @@ def import_jsonl_to_database(
         if len(batch) > 0:
             import_batch_data_to_database(batch)
 
+    write_snapshot(PHONE)
+
 
 # gửi dữ liệu lên db bằng cách gọi upsert_phone()
 def import_batch_data_to_database(batch: list[dict]):
@@ -89,7 +92,7 @@ def import_batch_data_to_database(batch: list[dict]):
         price = phone.get("currentPrice", -1)
         score = phone.get("score", 0)
         # name_embedding = get_embedding(name)
-        name_embedding = get_embedding(f"Phone Name: {name}")
+        name_embedding = get_embedding(with_prefix(PHONE_NAME_PREFIX, name))
         if id is not None and brand_code is not None and product_type is not None:
             print(f"Upserting phone: {id}, {name}, {brand_code}")
 
@@ -251,11 +254,13 @@ def update_embedding():
     with Session() as session:
         phones = session.query(Phone).all()
         for phone in phones:
-            phone.name_embedding = get_embedding(f"Phone Name: {phone.name}")
+            phone.name_embedding = get_embedding(with_prefix(PHONE_NAME_PREFIX, phone.name))
             session.add(phone)
 
         session.commit()
 
+    write_snapshot(PHONE)
+
 
 import json
 from collections import defaultdict
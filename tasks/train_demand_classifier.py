@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import time
+from glob import glob
+from statistics import mean
+from sklearn.metrics import classification_report
+from sklearn.model_selection import train_test_split
+from sqlalchemy import text
+from db import Session
+from env import env
+from openai.types.chat import ChatCompletionMessageParam
+import agents.detect_demand as detect_demand
+from models.user_memory import ProductType
+import service.demand_classifier as demand_classifier
+
+"""
+Trains the local demand classifier used by detect_demand before its LLM call and
+exports it to DEMAND_CLASSIFIER_PATH.
+
+The user messages of the stored conversations that went through the chatbot (threads
+with a user_memory row) and the golden questions are labeled by the detect_demand LLM
+itself, so the classifier learns to give the same answer. Labels are cached in
+`labels_path`, later runs only label new messages.
+
+How to run:
+python
+from tasks.train_demand_classifier import run
+run()
+"""
+
+CONTEXT_MESSAGES = 10
+
+
+def _label_key(messages: list[ChatCompletionMessageParam]) -> str:
+    payload = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_labels(labels_path: str) -> dict[str, str]:
+    if not os.path.exists(labels_path):
+        return {}
+    with open(labels_path) as f:
+        return {row["key"]: row["label"] for row in map(json.loads, f)}
+
+
+def _conversations(golden_glob: str) -> list[list[ChatCompletionMessageParam]]:
+    conversations = []
+    with Session() as session:
+        rows = session.execute(
+            text(
+                "SELECT m.thread_id, m.type, m.content FROM messages m "
+                "WHERE m.thread_id IN (SELECT thread_id FROM user_memory) "
+                "AND m.type IN ('user', 'bot') "
+                "ORDER BY m.thread_id, m.created_at"
+            )
+        )
+        threads: dict[str, list[ChatCompletionMessageParam]] = {}
+        for thread_id, type, content in rows:
+            threads.setdefault(str(thread_id), []).append(
+                {
+                    "role": "user" if type == "user" else "assistant",
+                    "content": content,
+                }
+            )
+        conversations += threads.values()
+
+    for file_path in glob(golden_glob):
+        with open(file_path) as f:
+            conversations += [
+                [{"role": "user", "content": golden["input"]}]
+                for golden in json.load(f)
+            ]
+    return conversations
+
+
+def _examples(
+    conversations: list[list[ChatCompletionMessageParam]], labels_path: str
+) -> tuple[list[str], list[str], list[float]]:
+    """
+    One example per user message: its features (message and previous demand) and the
+    demand the LLM detects with the conversation so far.
+    """
+    labels = _load_labels(labels_path)
+    agent = detect_demand.Agent(temporary_memory=detect_demand.AgentTemporaryMemory())
+    features, targets, llm_latencies = [], [], []
+
+    os.makedirs(os.path.dirname(labels_path) or ".", exist_ok=True)
+    with open(labels_path, "a") as labels_file:
+        for conversation in conversations:
+            previous_product_type = None
+            for i, message in enumerate(conversation):
+                if message["role"] != "user":
+                    continue
+                context = conversation[max(0, i + 1 - CONTEXT_MESSAGES) : i + 1]
+                key = _label_key(context)
+                if key not in labels:
+                    start = time.perf_counter()
+                    user_request = agent.parse_user_request(context)
+                    llm_latencies.append(time.perf_counter() - start)
+                    if user_request is None:
+                        continue
+                    labels[key] = user_request.user_demand.value
+                    labels_file.write(
+                        json.dumps({"key": key, "label": labels[key]}) + "\n"
+                    )
+
+                features.append(
+                    demand_classifier.to_features(
+                        str(message["content"]), previous_product_type
+                    )
+                )
+                targets.append(labels[key])
+                # An undetermined turn keeps the product type of the conversation.
+                if labels[key] != ProductType.UNDETERMINED.value:
+                    previous_product_type = labels[key]
+    return features, targets, llm_latencies
+
+
+def _report(model, features, targets, llm_latencies, threshold: float):
+    # One message at a time, the way detect_demand calls it.
+    sample = features[:200]
+    start = time.perf_counter()
+    for feature in sample:
+        model.predict_proba([feature])
+    local_latency = (time.perf_counter() - start) / max(len(sample), 1)
+
+    probabilities = model.predict_proba(features)
+    predictions = model.classes_[probabilities.argmax(axis=1)]
+    confident = probabilities.max(axis=1) >= threshold
+
+    print(classification_report(targets, predictions, zero_division=0))
+    covered = int(confident.sum())
+    covered_accuracy = (
+        mean(
+            prediction == target
+            for prediction, target, is_confident in zip(
+                predictions, targets, confident
+            )
+            if is_confident
+        )
+        if covered
+        else 0
+    )
+    print(
+        f"threshold {threshold}: {covered / max(len(targets), 1):.1%} of the turns "
+        f"skip the LLM, {covered_accuracy:.1%} accurate on those"
+    )
+    print(f"local latency: {local_latency * 1e6:.0f} us per message")
+    if llm_latencies:
+        print(f"LLM latency: {mean(llm_latencies) * 1000:.0f} ms per message")
+
+
+def run(
+    golden_glob: str = "goldens.json/*.json",
+    labels_path: str = "data/demand_labels.jsonl",
+    test_size: float = 0.2,
+    threshold: float | None = None,
+):
+    features, targets, llm_latencies = _examples(
+        _conversations(golden_glob), labels_path
+    )
+    train_features, test_features, train_targets, test_targets = train_test_split(
+        features, targets, test_size=test_size, random_state=42, stratify=targets
+    )
+
+    model = demand_classifier.build_pipeline()
+    model.fit(train_features, train_targets)
+    _report(
+        model,
+        test_features,
+        test_targets,
+        llm_latencies,
+        threshold if threshold is not None else env.DEMAND_CLASSIFIER_THRESHOLD,
+    )
+
+    # The exported model is trained on every example.
+    model = demand_classifier.build_pipeline()
+    model.fit(features, targets)
+    demand_classifier.save(model)
+    print(
+        f"Exported the model ({len(targets)} examples) to "
+        f"{env.DEMAND_CLASSIFIER_PATH}"
+    )
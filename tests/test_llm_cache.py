@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+from pydantic import BaseModel
+import service.llm_cache as llm_cache
+
+
+class Response(BaseModel):
+    content: str
+
+
+class AGetOrCreateTest(unittest.IsolatedAsyncioTestCase):
+    async def test_waiter_runs_the_request_when_the_owner_is_cancelled(self):
+        started = asyncio.Event()
+        calls = []
+
+        async def get_or_create(key, create, load, agent):
+            calls.append(key)
+            if len(calls) == 1:
+                started.set()
+                await asyncio.Event().wait()
+            return await create()
+
+        async def create():
+            return Response(content="answer")
+
+        with patch.object(
+            llm_cache, "_aget_or_create", get_or_create
+        ), patch.object(llm_cache, "_arecord", AsyncMock()):
+            owner = asyncio.create_task(
+                llm_cache.aget_or_create("key", create, Response.model_validate_json)
+            )
+            await started.wait()
+            waiter = asyncio.create_task(
+                llm_cache.aget_or_create("key", create, Response.model_validate_json)
+            )
+            await asyncio.sleep(0)
+
+            owner.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await owner
+
+            self.assertEqual(await waiter, Response(content="answer"))
+            self.assertEqual(len(calls), 2)
+            self.assertNotIn("key", llm_cache._local_futures)
+
+    async def test_waiter_cancelled_leaves_the_owner_running(self):
+        release = asyncio.Event()
+
+        async def get_or_create(key, create, load, agent):
+            await release.wait()
+            return await create()
+
+        async def create():
+            return Response(content="answer")
+
+        with patch.object(
+            llm_cache, "_aget_or_create", get_or_create
+        ), patch.object(llm_cache, "_arecord", AsyncMock()):
+            owner = asyncio.create_task(
+                llm_cache.aget_or_create("key", create, Response.model_validate_json)
+            )
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(
+                llm_cache.aget_or_create("key", create, Response.model_validate_json)
+            )
+            await asyncio.sleep(0)
+
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+            release.set()
+            self.assertEqual(await owner, Response(content="answer"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import patch
+from models.user_memory import ProductType
+import service.slot_extractor as slot_extractor
+
+_vocabulary = slot_extractor.Vocabulary(
+    brands=["Apple", "Samsung"], colors=["Đen", "Trắng"], loaded_at=0
+)
+
+
+@patch.object(slot_extractor, "get_vocabulary", lambda product_type: _vocabulary)
+class ExtractTest(unittest.TestCase):
+    def extract(self, message: str) -> slot_extractor.Extraction:
+        return slot_extractor.extract(message, ProductType.MOBILE_PHONE)
+
+    def test_from_price_is_not_an_ordinal(self):
+        # "từ" is both "from" and the word for the fourth.
+        extraction = self.extract("từ 10tr")
+
+        self.assertIsNone(extraction.get("ordinal"))
+        price = extraction.get("price")
+        self.assertIsNotNone(price)
+        self.assertEqual(price.value, {"min_price": 10_000_000})  # type: ignore
+
+    def test_fourth_is_an_ordinal(self):
+        extraction = self.extract("cái thứ tư")
+
+        ordinal = extraction.get("ordinal")
+        self.assertIsNotNone(ordinal)
+        self.assertEqual(ordinal.value, 4)  # type: ignore
+        self.assertIsNone(extraction.get("price"))
+        # Without suggestions, the ordinal refers to nothing the tools can set.
+        self.assertIsNone(
+            slot_extractor.to_tool_arguments(extraction, ProductType.MOBILE_PHONE)
+        )
+
+    def test_from_storage_is_not_an_ordinal(self):
+        extraction = self.extract("từ 128gb")
+
+        self.assertIsNone(extraction.get("ordinal"))
+        self.assertEqual(
+            extraction.get("storage").value,  # type: ignore
+            {"min_value": 128},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
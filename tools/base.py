@@ -128,3 +128,10 @@ class ToolBase:
 
     def invoke(self, *args, **kwargs) -> ToolResponse:
         raise NotImplementedError()
+
+    async def ainvoke(self, *args, **kwargs) -> ToolResponse:
+        """
+        Async variant of `invoke`. Tools that only update the temporary memory can rely on this default,
+        tools that do I/O must override it.
+        """
+        return self.invoke(*args, **kwargs)
@@ -1,6 +1,9 @@
 from typing import Any
 from agents.base import AgentTemporaryMemory
-from service.converter import convert_band_name_to_code
+from service.converter import (
+    convert_band_name_to_code,
+    aconvert_band_name_to_code,
+)
 from tools.base import ToolResponse
 from tools.langgpt_template import LangGPTTemplateTool
 from service.wandb import client as wandb_client
@@ -49,7 +52,36 @@ class Tool(LangGPTTemplateTool):
         """
         Invoke the tool to collect and update the requirements about the brand and version of a phone product.
         """
+        brand_code = (
+            convert_band_name_to_code(kwargs.get("phone_brand"))
+            if self._is_brand_changed(temporary_memory, **kwargs)
+            else None
+        )
+        return self._update_brand(temporary_memory, brand_code, **kwargs)
+
+    async def ainvoke(
+        self, temporary_memory: AgentTemporaryMemory | None, *args, **kwargs
+    ) -> ToolResponse:
+        brand_code = (
+            await aconvert_band_name_to_code(kwargs.get("phone_brand"))
+            if self._is_brand_changed(temporary_memory, **kwargs)
+            else None
+        )
+        return self._update_brand(temporary_memory, brand_code, **kwargs)
 
+    def _is_brand_changed(
+        self, temporary_memory: AgentTemporaryMemory | None, **kwargs
+    ) -> bool:
+        if not (temporary_memory and temporary_memory.user_memory):
+            return False
+        return kwargs.get("phone_brand") != temporary_memory.user_memory.brand_name
+
+    def _update_brand(
+        self,
+        temporary_memory: AgentTemporaryMemory | None,
+        brand_code: str | None,
+        **kwargs,
+    ) -> ToolResponse:
         if not (temporary_memory and temporary_memory.user_memory):
             return ToolResponse(type="error", content="User memory is not available.")
 
@@ -67,7 +99,6 @@ class Tool(LangGPTTemplateTool):
                 type="finished", content="User requirements collected successfully."
             )
 
-        brand_code = convert_band_name_to_code(phone_brand)
         if not brand_code and phone_brand:
             wandb_client.finish_call(
                 call, output=f"{phone_brand} is not a valid phone brand."